@@ -1,6 +1,12 @@
 import argparse
+import importlib
+import json
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PLATFORMS = ['django', 'react', 'flutter']
 
 
 def is_django_project():
@@ -15,19 +21,339 @@ def is_react_project():
     return os.path.isdir('node_modules') and os.path.isfile('fps_config.json')
 
 
-def run_django_generator():
-    from .gen.django import main as platform_gen
-    platform_gen()
+def run_generators(platforms, check=False, jobs=0):
+    """
+    Runs the generators of the platforms concurrently (sharing parsed specs and the protoc job pool) and prints
+    the time of each stage. Returns the exit code.
+    """
+    from .gen.jobs import Jobs, Timings, GenerateError
+    if jobs:
+        Jobs.n_jobs = jobs
+    if 'django' in platforms:
+        from .gen.django import remove_venv_from_path
+        remove_venv_from_path()
+
+    config = json.load(open('fps_config.json'))
+    timings = Timings()
+    start = time.time()
+    if len(platforms) > 1 and not check:
+        # assign new message ids once for all protos, so concurrent generators emit the same lock file
+        from .gen import get_protos, get_message_ids_path
+        from .gen.platforms import read_schema
+        with timings.stage('all', 'ids'):
+            try:
+                read_schema(get_protos(dict(config, include_common=True), '-I')[1], get_message_ids_path(config))
+            except GenerateError:
+                pass  # reported by the generators
+    with ThreadPoolExecutor(len(platforms)) as executor:
+        futures = [(p, executor.submit(importlib.import_module('.gen.' + p, __package__).run, config, check, timings))
+                   for p in platforms]
+    code = 0
+    for platform, future in futures:
+        try:
+            code = max(code, future.result())
+        except GenerateError as e:
+            print(f'{platform}: {e}')
+            code = 1
+    if not check:
+        timings.report(time.time() - start)
+    return code
+
+
+# run in a fresh interpreter per sample, prints the seconds of each step
+IMPORT_BENCHMARK = """
+import time
+start = time.perf_counter()
+import proto.messages as pb
+imported = time.perf_counter()
+pb.TxAck
+first = time.perf_counter()
+pb.load_all()
+loaded = time.perf_counter()
+print(imported - start, first - imported, loaded - first, len(pb._packages))
+"""
+
+
+def bench_import(runs=10):
+    """
+    Prints the median time of importing proto.messages, of using the first message (importing its package) and of
+    importing all remaining packages (what every process paid at startup before packages were loaded lazily).
+    """
+    import statistics
+    import subprocess
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', IMPORT_BENCHMARK], capture_output=True, text=True,
+                                env=dict(os.environ, PYTHONPATH=os.pathsep.join([os.getcwd()] + sys.path)))
+        if result.returncode:
+            print(result.stderr)
+            return 1
+        samples.append(result.stdout.split())
+    n_packages = samples[0][3]
+    for i, name in enumerate(['import proto.messages', 'first message', f'load_all ({n_packages} packages)']):
+        print('{:<30} {:>8.1f}ms'.format(name, statistics.median(float(s[i]) for s in samples) * 1000))
+    return 0
+
+
+def _bench_receiver(config, members, messages, ready, done):
+    import asyncio
+    from django.utils.module_loading import import_string
+    layer = import_string(config['BACKEND'])(**config.get('CONFIG', {}))
+
+    async def receive():
+        channels = [await layer.new_channel() for _ in range(members)]
+        for channel in channels:
+            await layer.group_add('bench', channel)
+        ready.put(None)
+
+        async def drain(channel):
+            for _ in range(messages):
+                await layer.receive(channel)
+        await asyncio.wait_for(asyncio.gather(*[drain(c) for c in channels]), 120)
+        done.put(time.time())
+    asyncio.run(receive())
+
 
+def local_redis() -> str:
+    """
+    Starts an in-process fakeredis server on a free port, for benchmarking without a Redis server.
+    """
+    import socket
+    import threading
+    from fakeredis import TcpFakeServer
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'redis://127.0.0.1:{}'.format(port)
+
+
+def bench_layer(configs, processes=4, members=50, messages=1000):
+    """
+    Prints group_send throughput (deliveries per second) of each channel layer config - `processes` receiver
+    processes with `members` channels in one group each, and a sender process. The in-memory layer can't
+    deliver between processes, so its receivers are tasks in the sender process.
+    """
+    import asyncio
+    import multiprocessing
+    from django.utils.module_loading import import_string
+    context = multiprocessing.get_context('fork')
+    for name, config in configs:
+        config = dict(config, CONFIG=dict(config.get('CONFIG', {}), capacity=messages + 10))
+        in_process = config['BACKEND'] == 'channels.layers.InMemoryChannelLayer'
+        ready, done = context.Queue(), context.Queue()
+
+        async def send(layer):
+            start = time.time()
+            for i in range(messages):
+                await layer.group_send('bench', {'type': 'bench', 'i': i})
+            return start
+
+        if in_process:
+            layer = import_string(config['BACKEND'])(**config['CONFIG'])
+
+            async def run():
+                channels = [await layer.new_channel() for _ in range(processes * members)]
+                for channel in channels:
+                    await layer.group_add('bench', channel)
+
+                async def drain(channel):
+                    for _ in range(messages):
+                        await layer.receive(channel)
+                drains = asyncio.gather(*[drain(c) for c in channels])
+                start = await send(layer)
+                await drains
+                return time.time() - start
+            elapsed = asyncio.run(run())
+        else:
+            receivers = [context.Process(target=_bench_receiver, args=(config, members, messages, ready, done))
+                         for _ in range(processes)]
+            for receiver in receivers:
+                receiver.start()
+            for _ in receivers:
+                ready.get(timeout=60)
+            layer = import_string(config['BACKEND'])(**config['CONFIG'])
+            start = asyncio.run(send(layer))
+            elapsed = max(done.get(timeout=180) for _ in receivers) - start
+            for receiver in receivers:
+                receiver.join()
+        deliveries = processes * members * messages
+        print('{:<12} {:>10} deliveries {:>8.2f}s {:>12.0f}/s'.format(name, deliveries, elapsed, deliveries / elapsed))
+    return 0
+
+
+# run in a fresh interpreter (the package is only partly imported with -m), prints the median seconds of each step
+SERIALIZE_BENCHMARK = """
+import json, statistics, sys, time
+import django
+django.setup()
+from django.apps import apps
+from django.db import transaction
+model_label, rows, runs = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+model = apps.get_model(model_label)
+template = model._default_manager.first()
+if template is None:
+    sys.exit(model_label + ' has no rows to copy')
+fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+with transaction.atomic():
+    model._default_manager.bulk_create(
+        [model(**{f.attname: getattr(template, f.attname) for f in fields}) for _ in range(rows)])
+    objects = list(model._default_manager.all()[:rows])
+    protos = [obj.to_proto() for obj in objects]
+    dicts = [proto.to_dict() for proto in protos]
+    proto_class = type(protos[0])
+    queryset = model._default_manager.all()[:rows]
+    # the hand-written serializer of the README (a ProtoSerializer subclass of the proto, setting each field)
+    from proto_socket_django.api_models import SerializationPlan
+    from proto_socket_django.betterproto_patch import get_plan
+    from proto_socket_django.serializers import ProtoSerializer
+    plan = SerializationPlan.get(model)
+    columns = {name: (column, serialize) for column, (name, serialize) in zip(plan.columns, plan.fields)}
+    namespace, lines = {}, ['def __init__(self, obj):']
+    for field in get_plan(proto_class).fields:
+        column, serialize = columns.get(field.name, (None, None))
+        if column is None:
+            namespace['d_' + field.name] = field.default_gen
+            lines.append('    self.{0} = d_{0}()'.format(field.name))
+        elif serialize is not None:
+            namespace['s_' + field.name] = serialize
+            lines.append('    self.{0} = s_{0}(obj.{1}) if obj.{1} is not None else None'.format(field.name, column))
+        else:
+            lines.append('    self.{} = obj.{}'.format(field.name, column))
+    exec('\\n'.join(lines), namespace)
+    Serializer = type(proto_class.__name__ + 'Serializer', (proto_class, ProtoSerializer),
+                      {'__init__': namespace['__init__']})
+    steps = {
+        'query + ProtoSerializer': lambda: [Serializer(obj) for obj in queryset.all()],
+        'query + to_proto': lambda: [obj.to_proto() for obj in queryset.all()],
+        'to_proto_many': lambda: model.to_proto_many(queryset.all()),
+        'to_dict': lambda: [proto.to_dict() for proto in protos],
+        'from_dict': lambda: [proto_class().from_dict(d) for d in dicts],
+    }
+    times = {}
+    for name, step in steps.items():
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            step()
+            samples.append(time.perf_counter() - start)
+        times[name] = statistics.median(samples)
+    transaction.set_rollback(True)
+print(json.dumps([len(objects), times]))
+"""
 
-def run_flutter_generator():
-    from .gen.flutter import main as platform_gen
-    platform_gen()
 
+# run in a fresh interpreter without django, prints the median seconds of each step
+MESSAGE_BENCHMARK = """
+import dataclasses, importlib.util, json, statistics, sys, time
+from typing import List
+import betterproto
+runs, count = int(sys.argv[1]), int(sys.argv[2])
+# by path - the package needs the generated messages of a project
+spec = importlib.util.spec_from_file_location('betterproto_patch', sys.argv[3])
+patch = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(patch)
+original_from_dict, original_to_dict = patch.original_from_dict, patch.original_to_dict
 
-def run_react_generator():
-    from .gen.react import main as platform_gen
-    platform_gen()
+
+class Color(betterproto.Enum):
+    RED = 0
+    GREEN = 1
+
+
+@dataclasses.dataclass
+class Node(betterproto.Message):
+    id: int = betterproto.int64_field(1)
+    name: str = betterproto.string_field(2)
+    tags: List[str] = betterproto.string_field(3)
+    color: Color = betterproto.enum_field(4)
+    children: List['Node'] = betterproto.message_field(5)
+
+
+kinds = [(int, betterproto.int32_field, 7), (str, betterproto.string_field, 'text'), (bool, betterproto.bool_field, True),
+         (float, betterproto.double_field, 1.5), (bytes, betterproto.bytes_field, b'blob'),
+         (Color, betterproto.enum_field, Color.GREEN)]
+Wide = dataclasses.make_dataclass('Wide', [('f{}'.format(i), kinds[i % 6][0], kinds[i % 6][1](i)) for i in range(1, 61)],
+                                  bases=(betterproto.Message,))
+Wide.__module__ = __name__
+
+
+def tree(depth, width, i=0):
+    return Node(id=i, name='node-{}'.format(i), tags=['a', 'b'], color=Color.GREEN,
+                children=[tree(depth - 1, width, i * width + j + 1) for j in range(width)] if depth else [])
+
+
+def chain(depth):
+    node = Node(id=depth, name='leaf')
+    for i in range(depth):
+        node = Node(id=i, name='link', children=[node])
+    return node
+
+
+cases = {
+    'wide (60 fields)': [Wide(**{'f{}'.format(i): kinds[i % 6][2] for i in range(1, 61)}) for _ in range(count)],
+    'tree (depth 4, width 3)': [tree(4, 3) for _ in range(count // 100 or 1)],
+    'chain (depth 50)': [chain(50) for _ in range(count // 50 or 1)],
+}
+times = {}
+for case, messages in cases.items():
+    cls = type(messages[0])
+    dicts = [original_to_dict(m) for m in messages]
+    assert [m.to_dict() for m in messages] == dicts, case
+    assert [cls().from_dict(d) for d in dicts] == [original_from_dict(cls(), d) for d in dicts], case
+    steps = {
+        'to_dict betterproto': lambda: [original_to_dict(m) for m in messages],
+        'to_dict patched': lambda: [m.to_dict() for m in messages],
+        'from_dict betterproto': lambda: [original_from_dict(cls(), d) for d in dicts],
+        'from_dict patched': lambda: [cls().from_dict(d) for d in dicts],
+    }
+    for name, step in steps.items():
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            step()
+            samples.append(time.perf_counter() - start)
+        times['{} {} x{}'.format(case, name, len(messages))] = statistics.median(samples)
+print(json.dumps(times))
+"""
+
+
+def bench_messages(count=1000, runs=5):
+    """
+    Prints the median time of to_dict/from_dict of synthetic wide and deeply nested messages with betterproto's own
+    implementation and with the plan based one of betterproto_patch.
+    """
+    import subprocess
+    patch_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'betterproto_patch.py')
+    result = subprocess.run([sys.executable, '-c', MESSAGE_BENCHMARK, str(runs), str(count), patch_path],
+                            capture_output=True, text=True)
+    if result.returncode:
+        print(result.stderr)
+        return 1
+    for name, seconds in json.loads(result.stdout.splitlines()[-1]).items():
+        print('{:<60} {:>8.1f}ms'.format(name, seconds * 1000))
+    return 0
+
+
+def bench_serialize(model_label: str, settings_module: str, rows=10000, runs=5):
+    """
+    Prints the median time of serializing `rows` copies of the first row of a model (app_label.Model) with a
+    hand-written ProtoSerializer, to_proto and to_proto_many, and of to_dict/from_dict of the protos - run in the
+    project, the copies are rolled back.
+    """
+    import subprocess
+    result = subprocess.run([sys.executable, '-c', SERIALIZE_BENCHMARK, model_label, str(rows), str(runs)],
+                            capture_output=True, text=True,
+                            env=dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module,
+                                     PYTHONPATH=os.pathsep.join([os.getcwd()] + sys.path)))
+    if result.returncode:
+        print(result.stderr)
+        return 1
+    n_rows, times = json.loads(result.stdout.splitlines()[-1])
+    for name, seconds in times.items():
+        print('{:<30} {:>8.1f}ms'.format(f'{name} ({n_rows} rows)', seconds * 1000))
+    return 0
 
 
 def main():
@@ -39,21 +365,79 @@ def main():
 
     # Add the 'generate' command
     generate_parser = subparsers.add_parser('generate')
+    generate_parser.add_argument('--check', action='store_true',
+                                 help='exit with 1 if generated code is out of date, without generating (for CI)')
+    generate_parser.add_argument('--all', action='store_true', help='generate for all platforms')
+    generate_parser.add_argument('--platforms', type=str, default='',
+                                 help='comma separated platforms to generate for (django,react,flutter)')
+    generate_parser.add_argument('--jobs', type=int, default=0,
+                                 help='max concurrent protoc/pbjs processes (default: cpu count)')
+
+    # Add the 'bench-import' command
+    bench_parser = subparsers.add_parser('bench-import', help='measure the startup cost of the generated messages')
+    bench_parser.add_argument('--runs', type=int, default=10)
+
+    # Add the 'bench-layer' command
+    layer_parser = subparsers.add_parser('bench-layer', help='compare group_send throughput of channel layers')
+    layer_parser.add_argument('--processes', type=int, default=4)
+    layer_parser.add_argument('--members', type=int, default=50, help='group members per process')
+    layer_parser.add_argument('--messages', type=int, default=1000)
+    layer_parser.add_argument('--redis', type=str, default='',
+                              help='eg. redis://localhost:6379, or local for an in-process fakeredis server '
+                                   '(needs channels_redis)')
+
+    # Add the 'bench-messages' command
+    messages_parser = subparsers.add_parser('bench-messages',
+                                            help='compare to_dict/from_dict with betterproto\'s own implementation')
+    messages_parser.add_argument('--count', type=int, default=1000, help='wide messages per run (fewer nested ones)')
+    messages_parser.add_argument('--runs', type=int, default=5)
+
+    # Add the 'bench-serialize' command
+    serialize_parser = subparsers.add_parser('bench-serialize', help='measure model and message serialization')
+    serialize_parser.add_argument('model', type=str, help='app_label.Model, its first row is copied')
+    serialize_parser.add_argument('--rows', type=int, default=10000)
+    serialize_parser.add_argument('--runs', type=int, default=5)
+    serialize_parser.add_argument('--settings', type=str, default=os.environ.get('DJANGO_SETTINGS_MODULE', ''),
+                                  help='django settings module (default: $DJANGO_SETTINGS_MODULE)')
 
     args = parser.parse_args()
 
     if args.command == 'generate':
-        if is_django_project():
-            run_django_generator()
+        if args.all or args.platforms:
+            platforms = PLATFORMS if args.all else [p.strip() for p in args.platforms.split(',') if p.strip()]
+            unknown = [p for p in platforms if p not in PLATFORMS]
+            if unknown or not os.path.isfile('fps_config.json'):
+                print(f'Error: unknown platforms {unknown}' if unknown else "Error: 'fps_config.json' not found.")
+                sys.exit(1)
+        elif is_django_project():
+            platforms = ['django']
         elif is_flutter_project():
-            run_flutter_generator()
+            platforms = ['flutter']
         elif is_react_project():
-            run_react_generator()
+            platforms = ['react']
         else:
             print(
                 "Error: The current directory does not seem to be a Django, Flutter, or React project with a 'fps_config.json'."
             )
             sys.exit(1)
+        sys.exit(run_generators(platforms, args.check, args.jobs))
+    elif args.command == 'bench-import':
+        sys.exit(bench_import(args.runs))
+    elif args.command == 'bench-layer':
+        configs = [('in-memory', {'BACKEND': 'channels.layers.InMemoryChannelLayer'}),
+                   ('host', {'BACKEND': 'proto_socket_django.layers.HostChannelLayer'})]
+        if args.redis:
+            configs.append(('redis' if args.redis != 'local' else 'fakeredis', {
+                'BACKEND': 'channels_redis.core.RedisChannelLayer',
+                'CONFIG': {'hosts': [args.redis if args.redis != 'local' else local_redis()]}}))
+        sys.exit(bench_layer(configs, args.processes, args.members, args.messages))
+    elif args.command == 'bench-messages':
+        sys.exit(bench_messages(args.count, args.runs))
+    elif args.command == 'bench-serialize':
+        if not args.settings:
+            print('Error: pass --settings or set DJANGO_SETTINGS_MODULE.')
+            sys.exit(1)
+        sys.exit(bench_serialize(args.model, args.settings, args.rows, args.runs))
     else:
         parser.print_help()
         sys.exit(1)
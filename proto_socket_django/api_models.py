@@ -2,10 +2,10 @@
 #
 import importlib
 import uuid
-from typing import List, Type
+from typing import List, Type, Dict, Optional, Callable, Tuple, Union
 import betterproto
 import stringcase
-from django.db import models
+from django.db import models, connections
 from django.conf import settings
 
 
@@ -13,6 +13,9 @@ def _default_id():
     return str(uuid.uuid1())
 
 
+_proto_classes: Dict[type, Type[betterproto.Message]] = {}
+
+
 class ApiModel(models.Model):
     id = models.CharField(
         max_length=64, default=_default_id, primary_key=True
@@ -22,18 +25,41 @@ class ApiModel(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     date_modified = models.DateTimeField(auto_now=True)
     user = None
+    # fields (or tuples of fields) clients may subscribe to changes by, besides the id and all rows - None disables
+    # subscriptions (see subscriptions.ChangeFeed)
+    subscribe_filters: Optional[List[Union[str, Tuple[str, ...]]]] = None
 
     class Meta:
         abstract = True
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if cls.subscribe_filters is not None:
+            # to notify the subscribers of the old values when they change
+            from .subscriptions import filter_values
+            instance._psd_filter_values = filter_values(instance)
+        return instance
+
+    @classmethod
+    def can_subscribe(cls, user, filter: Dict[str, str]) -> bool:
+        """
+        Whether user may subscribe to the changes of rows matching filter (column -> value), view permission by default.
+        """
+        return user is not None and user.has_perms(cls.perms_view())
+
     def to_proto_map(self):
         from .management.commands.genproto import ProtoGen
         proto_map = {}
+        # fields deferred by only() (see ProtoQuerySet.for_proto) are not part of the proto
+        deferred = self.get_deferred_fields()
         for field in self._meta.get_fields():
             field_type = type(field)
             field_name = field.name
 
-            if getattr(self, field_name) is None:
+            # read FKs through their _id column, so the related object isn't fetched just for the None check
+            attname = getattr(field, 'attname', field_name)
+            if attname in deferred or getattr(self, attname) is None:
                 continue
 
             if field.related_model:
@@ -49,10 +75,29 @@ class ApiModel(models.Model):
         return proto_map
 
     def to_proto(self):
-        protos = importlib.import_module(
-            'proto.{project}_{app}'.format(project=settings.PROJECT, app=self._meta.app_label))
-        proto: Type[betterproto.Message] = getattr(protos, self.__class__.__name__)
-        return proto().from_dict(self.to_proto_map())
+        return self.proto_class()().from_dict(self.to_proto_map())
+
+    @classmethod
+    def proto_class(cls) -> Type[betterproto.Message]:
+        proto = _proto_classes.get(cls)
+        if proto is None:
+            protos = importlib.import_module(
+                'proto.{project}_{app}'.format(project=settings.PROJECT, app=cls._meta.app_label))
+            proto = getattr(protos, cls.__name__)
+            _proto_classes[cls] = proto
+        return proto
+
+    @classmethod
+    def to_proto_many(cls, queryset: Optional[models.QuerySet] = None, chunk_size: int = 2000) -> List[
+        betterproto.Message]:
+        """
+        Serializes a queryset (all objects by default) straight from values_list() rows - models are not
+        instantiated and related objects are not fetched (FK _id columns are used directly).
+        """
+        if queryset is None:
+            queryset = cls._default_manager.all()
+        from .serializers import model_serializer
+        return model_serializer(cls).many(queryset, chunk_size)
 
     @classmethod
     def permission(cls, action: str):
@@ -79,6 +124,162 @@ class ApiModel(models.Model):
         return cls.perms_add() + cls.perms_change() + cls.perms_delete() + cls.perms_view()
 
 
+class SerializationPlan:
+    """
+    Per-model plan used by the generated serializers (see serializers.model_serializer) - columns, proto field
+    names, serializers and choice index maps are resolved once per model instead of once per instance.
+    """
+    plans: Dict[type, 'SerializationPlan'] = {}
+
+    def __init__(self, model: Type[ApiModel]):
+        from .management.commands.genproto import ProtoGen, FieldType
+        self.proto = model.proto_class()
+        self.columns: List[str] = []
+        self.fields: List[Tuple[str, Optional[Callable]]] = []
+
+        for field in model._meta.get_fields():
+            if not field.concrete or field.many_to_many:
+                continue
+
+            field_type = type(field)
+            serialize = None
+            if field.related_model:
+                field_type = type(field.related_model._meta.pk)
+                field_name = field.name + '_id'
+            elif field.choices:
+                camel_capital_name = stringcase.capitalcase(stringcase.camelcase(field.name))
+                choices: Choices = getattr(model, camel_capital_name)
+                field_name = field.name
+                serialize = {choice.key: choice.index for choice in choices.enum()}.get
+            else:
+                field_name = field.name
+
+            if serialize is None:
+                if field_type not in ProtoGen.type_map:
+                    # not part of the generated proto (see ProtoGen.get_proto)
+                    continue
+                if issubclass(field_type, models.FileField):
+                    serialize = SerializationPlan.file_serializer(field)
+                elif field_type in FieldType.serializers:
+                    serialize = ProtoGen.type_map[field_type].serialize
+
+            self.columns.append(field.attname)
+            self.fields.append((field_name, serialize))
+
+    @staticmethod
+    def file_serializer(field: models.FileField) -> Callable:
+        # values_list() returns the stored name, not a FieldFile
+        return lambda name: field.storage.url(name) if name else None
+
+    @classmethod
+    def get(cls, model: Type[ApiModel]) -> 'SerializationPlan':
+        plan = cls.plans.get(model)
+        if plan is None:
+            plan = SerializationPlan(model)
+            cls.plans[model] = plan
+        return plan
+
+
+class QueryPlan:
+    """
+    only()/select_related()/prefetch_related() arguments derived from the fields of a proto message: model fields
+    that are not in the proto are deferred, forward relations serialized as nested messages are joined and
+    reverse / many-to-many relations are prefetched.
+    """
+    plans: Dict[Tuple[type, type], 'QueryPlan'] = {}
+    max_depth = 3
+
+    def __init__(self, model: Type[models.Model], proto: Type[betterproto.Message]):
+        self.only: List[str] = []
+        self.select_related: List[str] = []
+        self.prefetch_related: List[str] = []
+        self.add(model, proto, '', 0)
+        self.only = list(dict.fromkeys(self.only))
+
+    def add(self, model: Type[models.Model], proto: Type[betterproto.Message], prefix: str, depth: int):
+        from .betterproto_patch import get_plan
+        fields = {}
+        for field in model._meta.get_fields():
+            fields[field.name] = field
+            if field.concrete and field.attname != field.name:
+                # proto messages refer to FKs by their _id column
+                fields[field.attname] = field
+            elif field.auto_created and not field.concrete and field.get_accessor_name():
+                fields[field.get_accessor_name()] = field
+
+        self.only.append(prefix + model._meta.pk.name)
+        for proto_field in get_plan(proto).fields:
+            field = fields.get(proto_field.name)
+            if field is None:
+                continue
+            if not field.is_relation:
+                self.only.append(prefix + field.name)
+            elif field.concrete and not field.many_to_many:
+                self.only.append(prefix + field.name)
+                if proto_field.is_message and depth < self.max_depth:
+                    self.select_related.append(prefix + field.name)
+                    self.add(field.related_model, proto_field.cls, prefix + field.name + '__', depth + 1)
+            else:
+                name = field.get_accessor_name() if field.auto_created and not field.concrete else field.name
+                self.prefetch_related.append(prefix + name)
+
+    @classmethod
+    def get(cls, model: Type[models.Model], proto: Type[betterproto.Message]) -> 'QueryPlan':
+        plan = cls.plans.get((model, proto))
+        if plan is None:
+            plan = QueryPlan(model, proto)
+            cls.plans[(model, proto)] = plan
+        return plan
+
+    def apply(self, queryset: models.QuerySet) -> models.QuerySet:
+        queryset = queryset.only(*self.only)
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        return queryset
+
+
+class QueryCounter:
+    def __init__(self):
+        self.queries: List[str] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+
+class ProtoQuerySet(models.QuerySet):
+    def for_proto(self, proto: Optional[Type[betterproto.Message]] = None) -> 'ProtoQuerySet':
+        """
+        Loads only what the model's proto message (or `proto`) needs, see QueryPlan.
+        """
+        return QueryPlan.get(self.model, proto or self.model.proto_class()).apply(self)
+
+    def to_proto(self, proto: Optional[Type[betterproto.Message]] = None,
+                 serialize: Optional[Callable[[models.Model], betterproto.Message]] = None) -> List[
+        betterproto.Message]:
+        """
+        Serializes the optimized queryset with `serialize` (model.to_proto by default). With
+        PSD_ASSERT_SERIALIZATION_QUERIES = True, queries issued during serialization (after the queryset and its
+        prefetches were fetched) raise an AssertionError listing them.
+        """
+        objects = list(self.for_proto(proto))
+        serialize = serialize or (lambda obj: obj.to_proto())
+        if not getattr(settings, 'PSD_ASSERT_SERIALIZATION_QUERIES', False):
+            return [serialize(obj) for obj in objects]
+
+        counter = QueryCounter()
+        with connections[self.db].execute_wrapper(counter):
+            protos = [serialize(obj) for obj in objects]
+        assert not counter.queries, '{n} extra queries while serializing {model}:\n{queries}'.format(
+            n=len(counter.queries), model=self.model.__name__, queries='\n'.join(counter.queries))
+        return protos
+
+
+ProtoManager = models.Manager.from_queryset(ProtoQuerySet)
+
+
 class Choice:
     def __init__(self, key, value, index):
         self.key = key
@@ -7,5 +7,6 @@ class ApiConfig(AppConfig):
     name = 'proto_socket_django'
 
     def ready(self):
+        from proto_socket_django import subscriptions  # connects the change signals
         if 'manage.py' not in sys.argv:
             ApiWebsocketConsumer.static_init()
\ No newline at end of file
@@ -1,68 +1,203 @@
 import dataclasses
 import datetime
+import threading
 from base64 import b64decode
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Type, Tuple, Union
 import betterproto
 from betterproto import safe_snake_case
 
+
+# casing of the compact encoding (to_dict(FIELD_NUMBERS)): keys are proto field numbers and enums are sent as
+# numbers. Field names never start with a digit, so decoders tell compact objects apart by their keys.
+FIELD_NUMBERS = object()
+
+
+class FieldPlan:
+    """
+    Everything to_dict/from_dict need to know about a single field, resolved once per message class.
+    """
+
+    def __init__(self, message_cls: Type[betterproto.Message], field: dataclasses.Field):
+        proto_meta = message_cls._betterproto_meta
+        self.field = field
+        self.name = field.name
+        self.meta = betterproto.FieldMetadata.get(field)
+        self.proto_type = self.meta.proto_type
+        self.number = str(self.meta.number)
+        self.default_gen: Callable = proto_meta.default_gen[field.name]
+        self.cls = proto_meta.cls_by_field.get(field.name)
+        self.is_message = self.proto_type == betterproto.TYPE_MESSAGE
+        self.is_map = self.proto_type == betterproto.TYPE_MAP
+        self.map_value_cls = None
+        if self.is_map and self.meta.map_types[1] == betterproto.TYPE_MESSAGE:
+            self.map_value_cls = proto_meta.cls_by_field[field.name + '.value']
+        self.enum_values = None
+        if self.proto_type == betterproto.TYPE_ENUM:
+            self.enum_values = {int(v): v for v in self.cls}
+
+
+class MessagePlan:
+    """
+    Cached per-message-class encoding plan. Replaces the per-call dataclasses.fields()/FieldMetadata.get()/casing()
+    reflection of the default betterproto to_dict/from_dict with dict lookups.
+    """
+
+    def __init__(self, cls: Type[betterproto.Message]):
+        # make sure betterproto metadata (default_gen, cls_by_field) exists before reading it
+        if not getattr(cls, '_betterproto_meta', None):
+            cls._betterproto_meta = betterproto.ProtoClassMetadata(cls)
+        self.fields: List[FieldPlan] = [FieldPlan(cls, f) for f in dataclasses.fields(cls)]
+        self.cased_names: Dict[object, List[str]] = {}  # by casing function or FIELD_NUMBERS
+
+        # incoming keys are usually camel or snake cased field names - map those directly, anything else still
+        # goes through safe_snake_case (not cached, so unknown client keys can't grow this dict)
+        self.by_key: Dict[str, FieldPlan] = {}
+        self.by_name: Dict[str, FieldPlan] = {}
+        for f in self.fields:
+            self.by_name[f.name] = f
+            for key in (f.name, betterproto.Casing.CAMEL(f.name).rstrip('_'), f.name.rstrip('_')):
+                if safe_snake_case(key) == f.name:
+                    self.by_key[key] = f
+            self.by_key[f.number] = f
+
+    def get_cased_names(self, casing) -> List[str]:
+        names = self.cased_names.get(casing)
+        if names is None:
+            if casing is FIELD_NUMBERS:
+                names = [f.number for f in self.fields]
+            else:
+                names = [casing(f.name).rstrip('_') for f in self.fields]
+            self.cased_names[casing] = names
+        return names
+
+    def field_for_key(self, key: str) -> Optional[FieldPlan]:
+        f = self.by_key.get(key)
+        if f is None:
+            f = self.by_name.get(safe_snake_case(key))
+        return f
+
+
+_plans: Dict[type, MessagePlan] = {}
+
+
+class BinarySlots:
+    """
+    Collects bytes values of at least `threshold` bytes while encoding, so they can be sent as separate binary
+    frames. The JSON body references them as {"$binary": slot id}.
+    """
+
+    def __init__(self, threshold: int, first_id: int):
+        self.threshold = threshold
+        self.next_id = first_id
+        self.blobs: List[Tuple[int, bytes]] = []
+
+    def encode(self, value: bytes) -> Union[str, dict]:
+        if len(value) < self.threshold:
+            return betterproto.b64encode(value).decode("utf8")
+        slot_id = self.next_id
+        self.next_id = (self.next_id + 1) % 2 ** 32
+        self.blobs.append((slot_id, value))
+        return {'$binary': slot_id}
+
+
+_local = threading.local()
+
+
+@contextmanager
+def binary_slots(threshold: int, first_id: int):
+    slots = BinarySlots(threshold, first_id)
+    _local.binary_slots = slots
+    try:
+        yield slots
+    finally:
+        _local.binary_slots = None
+
+
+def _encode_bytes(value: bytes):
+    slots: Optional[BinarySlots] = getattr(_local, 'binary_slots', None)
+    if slots is None:
+        return betterproto.b64encode(value).decode("utf8")
+    return slots.encode(value)
+
+
+def _decode_bytes(value) -> Union[bytes, memoryview]:
+    # memoryviews are bytes received in binary frames (see ApiWebsocketConsumer.receive)
+    if isinstance(value, memoryview):
+        return value
+    return b64decode(value)
+
+
+def get_plan(cls: Type[betterproto.Message]) -> MessagePlan:
+    plan = _plans.get(cls)
+    if plan is None:
+        # threads building the same plan at once share the first one stored
+        plan = _plans.setdefault(cls, MessagePlan(cls))
+    return plan
+
+
 def from_dict_patch(self, value: dict):
     """
     Parse the key/value pairs in `value` into this message instance. This
     returns the instance itself and is therefore assignable and chainable.
     """
     self._serialized_on_wire = True
-    fields_by_name = {f.name: f for f in dataclasses.fields(self)}
+    plan = get_plan(self.__class__)
     for key in value:
-        snake_cased = safe_snake_case(key)
-        if snake_cased in fields_by_name:
-            field = fields_by_name[snake_cased]
-            meta = betterproto.FieldMetadata.get(field)
-
-            if value[key] is not None:
-                if meta.proto_type == "message":
-                    v = getattr(self, field.name)
+        f = plan.field_for_key(key)
+        if f is None:
+            continue
+        meta = f.meta
+        item = value[key]
+
+        if item is not None:
+            if f.is_message:
+                v = getattr(self, f.name)
+                if isinstance(v, list):
+                    cls = f.cls
+                    for i in range(len(item)):
+                        v.append(cls().from_dict(item[i]))
+                elif isinstance(v, datetime.datetime):
+                    v = datetime.datetime.fromisoformat(
+                        item.replace("Z", "+00:00")
+                    )
+                    setattr(self, f.name, v)
+                elif isinstance(v, datetime.timedelta):
+                    v = datetime.timedelta(seconds=float(item[:-1]))
+                    setattr(self, f.name, v)
+                elif meta.wraps:
+                    setattr(self, f.name, item)
+                else:
+                    v.from_dict(item)
+            elif f.map_value_cls is not None:
+                v = getattr(self, f.name) or {}
+                cls = f.map_value_cls
+                for k in item:
+                    v[k] = cls().from_dict(item[k])
+                setattr(self, f.name, v)
+            else:
+                v = item
+                if f.proto_type in betterproto.INT_64_TYPES:
+                    if isinstance(item, list):
+                        v = [int(n) for n in item]
+                    else:
+                        v = int(item)
+                elif f.proto_type == betterproto.TYPE_BYTES:
+                    if isinstance(item, list):
+                        v = [_decode_bytes(n) for n in item]
+                    else:
+                        v = _decode_bytes(item)
+                elif f.enum_values is not None:
+                    enum_cls = f.cls
                     if isinstance(v, list):
-                        cls = self._betterproto.cls_by_field[field.name]
-                        for i in range(len(value[key])):
-                            v.append(cls().from_dict(value[key][i]))
-                    elif isinstance(v, datetime.datetime):
-                        v = datetime.datetime.fromisoformat(
-                            value[key].replace("Z", "+00:00")
-                        )
-                        setattr(self, field.name, v)
-                    elif isinstance(v, datetime.timedelta):
-                        v = datetime.timedelta(seconds=float(value[key][:-1]))
-                        setattr(self, field.name, v)
-                    elif meta.wraps:
-                        setattr(self, field.name, value[key])
+                        v = [enum_cls.from_string(e) if isinstance(e, str) else f.enum_values.get(e, e) for e in v]
+                    elif isinstance(v, str):
+                        v = enum_cls.from_string(v)
                     else:
-                        v.from_dict(value[key])
-                elif meta.map_types and meta.map_types[1] == betterproto.TYPE_MESSAGE:
-                    v = getattr(self, field.name) or {}
-                    cls = self._betterproto.cls_by_field[field.name + ".value"]
-                    for k in value[key]:
-                        v[k] = cls().from_dict(value[key][k])
-                    setattr(self, field.name, v)
-                else:
-                    v = value[key]
-                    if meta.proto_type in betterproto.INT_64_TYPES:
-                        if isinstance(value[key], list):
-                            v = [int(n) for n in value[key]]
-                        else:
-                            v = int(value[key])
-                    elif meta.proto_type == betterproto.TYPE_BYTES:
-                        if isinstance(value[key], list):
-                            v = [b64decode(n) for n in value[key]]
-                        else:
-                            v = b64decode(value[key])
-                    elif meta.proto_type == betterproto.TYPE_ENUM:
-                        enum_cls = self._betterproto.cls_by_field[field.name]
-                        if isinstance(v, list):
-                            v = [enum_cls.from_string(e) for e in v]
-                        elif isinstance(v, str):
-                            v = enum_cls.from_string(v)
-
-                    if v is not None:
-                        setattr(self, field.name, v)
+                        v = f.enum_values.get(v, v)
+
+                if v is not None:
+                    setattr(self, f.name, v)
     return self
 
 
@@ -79,20 +214,19 @@ def to_dict_patch(self, casing: betterproto.Casing = betterproto.Casing.CAMEL,
     `False`.
     """
     output: betterproto.Dict[str, betterproto.Any] = {}
-    for field in betterproto.dataclasses.fields(self):
-        meta = betterproto.FieldMetadata.get(field)
-        v = getattr(self, field.name)
+    plan = get_plan(self.__class__)
+    for f, cased_name in zip(plan.fields, plan.get_cased_names(casing)):
+        v = getattr(self, f.name)
         if isinstance(v, betterproto._PLACEHOLDER) and not include_default_values:
             continue
-        cased_name = casing(field.name).rstrip("_")  # type: ignore
-        if meta.proto_type == "message":
+        if f.is_message:
             if isinstance(v, betterproto.datetime):
                 if v != betterproto.DATETIME_ZERO or include_default_values:
                     output[cased_name] = betterproto._Timestamp.timestamp_to_json(v)
             elif isinstance(v, betterproto.timedelta):
                 if v != betterproto.timedelta(0) or include_default_values:
                     output[cased_name] = betterproto._Duration.delta_to_json(v)
-            elif meta.wraps:
+            elif f.meta.wraps:
                 if v is not None or include_default_values:
                     output[cased_name] = v
             elif isinstance(v, list):
@@ -103,41 +237,72 @@ def to_dict_patch(self, casing: betterproto.Casing = betterproto.Casing.CAMEL,
             else:
                 if getattr(v, '_serialized_on_wire', False) or include_default_values:
                     output[cased_name] = v.to_dict(casing, include_default_values)
-        elif meta.proto_type == "map":
+        elif f.is_map:
             for k in (v or dict()):
                 if hasattr(v[k], "to_dict"):
                     v[k] = v[k].to_dict(casing, include_default_values)
 
             if v or include_default_values:
                 output[cased_name] = v
-        elif v != self._get_field_default(field, meta) or include_default_values:
-            if meta.proto_type in betterproto.INT_64_TYPES:
+        elif v != f.default_gen() or include_default_values:
+            if f.proto_type in betterproto.INT_64_TYPES:
                 if isinstance(v, list):
                     output[cased_name] = [str(n) for n in v]
                 else:
                     output[cased_name] = str(v)
-            elif meta.proto_type == betterproto.TYPE_BYTES:
+            elif f.proto_type == betterproto.TYPE_BYTES:
                 if isinstance(v, list):
-                    output[cased_name] = [betterproto.b64encode(b).decode("utf8") for b in v]
+                    output[cased_name] = [_encode_bytes(b) for b in v]
                 else:
-                    output[cased_name] = betterproto.b64encode(v).decode("utf8")
-            elif meta.proto_type == betterproto.TYPE_STRING:
+                    output[cased_name] = _encode_bytes(v)
+            elif f.proto_type == betterproto.TYPE_STRING:
                 if isinstance(v, list):
                     output[cased_name] = [str(b) for b in v]
                 else:
                     output[cased_name] = str(v)
-            elif meta.proto_type == betterproto.TYPE_ENUM:
-                enum_values = {
-                    int(v): v for v in self._betterproto.cls_by_field[field.name]
-                }  # type: ignore
-                if isinstance(v, list):
-                    output[cased_name] = [enum_values[e].name for e in v]
+            elif f.enum_values is not None:
+                if casing is FIELD_NUMBERS:
+                    output[cased_name] = [int(e) for e in v] if isinstance(v, list) else int(v)
+                elif isinstance(v, list):
+                    output[cased_name] = [f.enum_values[e].name for e in v]
                 else:
-                    output[cased_name] = enum_values[v].name
+                    output[cased_name] = f.enum_values[v].name
             else:
                 output[cased_name] = v
     return output
 
+
+def compact_dict(cls: Type[betterproto.Message], value: dict) -> dict:
+    """
+    Rewrites the to_dict() output of a cls message to the FIELD_NUMBERS encoding, without decoding it.
+    """
+    plan = get_plan(cls)
+    output = {}
+    for key, item in value.items():
+        f = plan.field_for_key(key)
+        if f is None:
+            continue
+        if item is not None:
+            if f.is_message and f.cls is not None and isinstance(item, (dict, list)) and \
+                    issubclass(f.cls, betterproto.Message) and not f.meta.wraps:
+                if isinstance(item, list):
+                    item = [compact_dict(f.cls, i) for i in item]
+                else:
+                    item = compact_dict(f.cls, item)
+            elif f.map_value_cls is not None:
+                item = {k: compact_dict(f.map_value_cls, v) for k, v in item.items()}
+            elif f.enum_values is not None:
+                enum_cls = f.cls
+                if isinstance(item, list):
+                    item = [int(enum_cls.from_string(e)) if isinstance(e, str) else e for e in item]
+                elif isinstance(item, str):
+                    item = int(enum_cls.from_string(item))
+        output[f.number] = item
+    return output
+
+
+# kept for comparison (python -m proto_socket_django bench-messages)
+original_to_dict = betterproto.Message.to_dict
+original_from_dict = betterproto.Message.from_dict
 betterproto.Message.to_dict = to_dict_patch
 betterproto.Message.from_dict = from_dict_patch
-default_app_config = 'proto_socket_django.apps.ApiConfig'
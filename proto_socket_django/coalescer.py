@@ -0,0 +1,75 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+
+
+class Coalescer:
+    """
+    Latest-wins throttling per key. The first submit for an idle key runs immediately and opens a window,
+    submits during the window only replace the pending callback, which runs once the window closes. Windows are closed
+    by one timer thread for all keys.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # key -> pending callback (None if the window is open, but nothing is pending)
+        self.windows: Dict[Hashable, Optional[Callable[[], None]]] = {}
+        # (closes at, tiebreaker, key, window) - keys don't need to be comparable
+        self.deadlines: List[Tuple[float, int, Hashable, float]] = []
+        self.counter = itertools.count()
+        self.thread: Optional[threading.Thread] = None
+        # event loop of the connections (set by ApiWebsocketConsumer) - pending callbacks run from it, so their
+        # async_to_sync calls reach it instead of a new loop in the timer thread
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def submit(self, key: Hashable, callback: Callable[[], None], window: float):
+        with self.condition:
+            if key in self.windows:
+                self.windows[key] = callback
+                return
+            self.windows[key] = None
+        self._run(callback)
+        self._open_window(key, window)
+
+    def _open_window(self, key: Hashable, window: float):
+        with self.condition:
+            heapq.heappush(self.deadlines, (time.monotonic() + window, next(self.counter), key, window))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._timer, daemon=True, name='psd-coalescer')
+                self.thread.start()
+            self.condition.notify()
+
+    def _timer(self):
+        while True:
+            with self.condition:
+                while not self.deadlines or self.deadlines[0][0] > time.monotonic():
+                    self.condition.wait(self.deadlines[0][0] - time.monotonic() if self.deadlines else None)
+                _, _, key, window = heapq.heappop(self.deadlines)
+            self._close_window(key, window)
+
+    def _close_window(self, key: Hashable, window: float):
+        with self.condition:
+            callback = self.windows.get(key)
+            if callback is None:
+                self.windows.pop(key, None)
+                return
+            self.windows[key] = None
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            self._run(callback)
+        else:
+            asyncio.run_coroutine_threadsafe(sync_to_async(self._run, thread_sensitive=False)(callback), loop)
+        self._open_window(key, window)
+
+    @staticmethod
+    def _run(callback: Callable[[], None]):
+        try:
+            callback()
+        except:
+            traceback.print_exc()
@@ -1,3 +1,6 @@
+import asyncio
+import struct
+import threading
 import traceback
 from uuid import UUID
 
@@ -5,20 +8,35 @@ from django.contrib.auth import get_user_model
 import inspect
 import abc
 import json
-from typing import Union, Type, Dict, List, Callable, Optional, Any
+from typing import Union, Type, Dict, List, Callable, Optional, Any, Tuple, Sequence
 from asgiref.sync import async_to_sync
 from channels.generic.websocket import JsonWebsocketConsumer
 from channels.layers import get_channel_layer
+from betterproto import Casing
 from proto.messages import TxMessage
 import proto.messages as pb
 from django.conf import settings
+from django.db import transaction
 from proto_socket_django.worker import SyncWorker, AsyncWorker, LongRunningTask
+from proto_socket_django.coalescer import Coalescer
+from proto_socket_django.dispatch import HandlerDispatcher, CONCURRENCY, ORDERED, SERIAL
+from proto_socket_django.loader import Loader
+from proto_socket_django.outbox import Outbox, BULK, CONTROL, INTERACTIVE
+from proto_socket_django.relay import GroupRelay
+from proto_socket_django.sessions import Session
+from proto_socket_django.subscriptions import ChangeFeed
+from proto_socket_django.sync import SyncState
+from proto_socket_django.betterproto_patch import binary_slots, compact_dict, FIELD_NUMBERS
 
 
 class ApiWebsocketConsumer(JsonWebsocketConsumer):
     receivers: List[Type['FPSReceiver']] = []
     sync_workers: List['SyncWorker'] = None
     async_worker: Optional[AsyncWorker] = None
+    broadcast_coalescer: Coalescer = Coalescer()
+    group_relay: GroupRelay = GroupRelay()
+    # sent ahead of other frames waiting on the connection (see outbox.Outbox)
+    control_message_types = {'ack', 'token-invalid', 'refresh-token-invalid', 'upgrade-api-version', 'session'}
 
     @classmethod
     def static_init(cls):
@@ -43,6 +61,26 @@ class ApiWebsocketConsumer(JsonWebsocketConsumer):
         self.user = None
         self.token = None
         self.handlers: Dict[str, List[Callable]] = {}
+        self.streams: Dict[str, 'Stream'] = {}
+        self.sync_states: Dict[Tuple[str, str], SyncState] = {}
+        # binary side-channel frames (4 byte big-endian slot id + payload), enabled by the binaryFrames header
+        self.binary_frames = False
+        self.binary_slot_id = 0
+        self.binary_inbox: Dict[int, memoryview] = {}
+        self.binary_lock = threading.Lock()
+        # numeric message type ids instead of messageType strings (see message_ids.lock), enabled by the
+        # messageTypeIds header
+        self.message_type_ids = False
+        # bodies keyed by proto field numbers (see betterproto_patch.FIELD_NUMBERS), enabled by the compactBodies
+        # header. State frames (send_state) keep field names.
+        self.body_casing = Casing.CAMEL
+        # resumable session (see sessions.Session), started by the client with session-resume
+        self.session: Optional[Session] = None
+        # runs handlers by their concurrency (see receive)
+        self.dispatcher = HandlerDispatcher()
+        # batched loads by primary key across messages
+        self.loader = Loader(self.dispatcher)
+        self.outbox = Outbox()
 
         # register all receivers
         for receiver in self.receivers:
@@ -55,13 +93,121 @@ class ApiWebsocketConsumer(JsonWebsocketConsumer):
                         self.handlers[mtype] = []
                     self.handlers[mtype].append(getattr(receiver_instance, member_name))
 
-    def send_message(self, message: 'TxMessage', uuid: Optional[str] = None):
-        json = message.get_message()
+    async def __call__(self, scope, receive, send):
+        loop = self.dispatcher.loop = asyncio.get_running_loop()
+        # the server's loop - the change feed and coalesced broadcasts are sent through it
+        ChangeFeed.loop = self.broadcast_coalescer.loop = loop
+
+        async def send_on_loop(message):
+            # async_to_sync on worker threads (sync workers, timers, pool callbacks) runs on a new event loop - the
+            # connection's loop wouldn't notice the send until it woke up for something else
+            if asyncio.get_running_loop() is loop:
+                return await send(message)
+            if loop.is_closed():
+                return
+            return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(send(message), loop))
+        return await super().__call__(scope, receive, send_on_loop)
+
+    def send_message(self, message: 'TxMessage', uuid: Optional[str] = None, headers: Optional[dict] = None,
+                     priority: Optional[str] = None):
+        """
+        priority: 'control', 'interactive' or 'bulk' (see outbox.Outbox), by default control for
+        control_message_types and interactive for the rest.
+        """
+        if not self.binary_frames:
+            self.send_frame(message.get_message(self.body_casing), uuid, headers, priority=priority)
+            return
+
+        # large bytes fields are sent as binary frames ahead of the json frame, which lists their slots
+        with self.binary_lock:
+            with binary_slots(getattr(settings, 'PSD_BINARY_FRAME_THRESHOLD', 1024), self.binary_slot_id) as slots:
+                json = message.get_message(self.body_casing)
+            self.binary_slot_id = slots.next_id
+        blobs = [b''.join((struct.pack('>I', slot_id), blob)) for slot_id, blob in slots.blobs]
+        if slots.blobs:
+            headers = dict(headers or {}, binarySlots=[slot_id for slot_id, _ in slots.blobs])
+        self.send_frame(json, uuid, headers, blobs, priority)
+
+    def send_frame(self, json: dict, uuid: Optional[str] = None, headers: Optional[dict] = None,
+                   blobs: Sequence[bytes] = (), priority: Optional[str] = None):
         if uuid is not None:
             json['headers']['uuid'] = uuid
+        if headers:
+            json['headers'].update(headers)
+        message_type = json['headers']['messageType']
+        if priority is None:
+            priority = CONTROL if message_type in self.control_message_types else INTERACTIVE
+        if self.message_type_ids:
+            json['headers']['messageType'] = pb.tx_message_type_ids.get(message_type, message_type)
         if settings.DEBUG:
             print('tx:', json)
-        self.send_json(json)
+        if self.session is not None:
+            # numbered when it's sent
+            self.outbox.send(lambda: self.send_session_frame(json, blobs), priority)
+            return
+        text = self.encode_json(json)
+
+        def send():
+            for blob in blobs:
+                self.send(bytes_data=blob)
+            self.send(text_data=text)
+        self.outbox.send(send, priority)
+
+    def send_session_frame(self, json: dict, blobs: Sequence[bytes] = ()):
+        """
+        Numbers and buffers the frame (see sessions.Session), sent unless the session is parked or replaying.
+        """
+        session = self.session
+        # handlers running in parallel must not reorder the seqs
+        with session.send_lock:
+            frames = session.frame(json, self.encode_json, blobs)
+            if frames is None:
+                if session.parked:
+                    session.save()
+                return
+            # the session may have been resumed by another connection since
+            consumer = session.consumer
+            for frame in frames[:-1]:
+                consumer.send(bytes_data=frame)
+            consumer.send(text_data=frames[-1])
+
+    def send_state(self, message: 'TxMessage', key: str = '', uuid: Optional[str] = None):
+        """
+        Sends message as state identified by (message type, key). The consumer remembers the last body sent and
+        only sends a patch against it (see sync.diff) with syncVersion/syncBase/syncPatch headers; every
+        PSD_SYNC_SNAPSHOT_INTERVAL updates the full body is sent instead. Unchanged state is not resent, unless
+        this is a response (uuid).
+        """
+        state = self.sync_states.get((message.type, key))
+        if state is None:
+            # handlers running in parallel share the first one
+            state = self.sync_states.setdefault(
+                (message.type, key), SyncState(getattr(settings, 'PSD_SYNC_SNAPSHOT_INTERVAL', 100)))
+        body = message.proto.to_dict()
+        with state.lock:
+            headers, body = state.update(body)
+            if body is None:
+                if uuid is None:
+                    return
+                headers, body = state.snapshot()
+            self._send_sync_frame(message.type, key, headers, body, uuid)
+
+    def forget_state(self, message_type: str, key: str = ''):
+        self.sync_states.pop((message_type, key), None)
+
+    def on_sync_resync(self, message: 'pb.RxSyncResync'):
+        state = self.sync_states.get((message.proto.message_type, message.proto.key))
+        if state is None:
+            return
+        with state.lock:
+            if state.body is None:
+                return
+            headers, body = state.snapshot()
+            self._send_sync_frame(message.proto.message_type, message.proto.key, headers, body)
+
+    def _send_sync_frame(self, message_type: str, key: str, headers: dict, body: dict, uuid: Optional[str] = None):
+        headers['syncKey'] = key
+        self.send_frame({'headers': {'messageType': message_type}, 'body': body}, uuid, headers)
 
     def encode_json(cls, content):
         return json.dumps(content, cls=UUIDEncoder)
@@ -98,47 +244,274 @@ class ApiWebsocketConsumer(JsonWebsocketConsumer):
             self.send_message(pb.TxTokenInvalid())
             return
 
+    def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None and text_data is None:
+            self.receive_binary(bytes_data)
+        else:
+            super().receive(text_data, bytes_data, **kwargs)
+
+    def receive_binary(self, bytes_data: bytes):
+        if len(bytes_data) < 4:
+            return
+        slot_id, = struct.unpack_from('>I', bytes_data)
+        # slicing a memoryview doesn't copy the payload
+        self.binary_inbox[slot_id] = memoryview(bytes_data)[4:]
+        max_size = getattr(settings, 'PSD_BINARY_INBOX_SIZE', 64)
+        while len(self.binary_inbox) > max_size:
+            # drop the oldest unclaimed frame
+            del self.binary_inbox[next(iter(self.binary_inbox))]
+
+    def resolve_binary_slots(self, value):
+        if isinstance(value, dict):
+            if '$binary' in value and len(value) == 1:
+                return self.binary_inbox.pop(value['$binary'], None)
+            for k, v in value.items():
+                value[k] = self.resolve_binary_slots(v)
+        elif isinstance(value, list):
+            for i, v in enumerate(value):
+                value[i] = self.resolve_binary_slots(v)
+        return value
+
     def receive_json(self, json_data, **kwargs):
         if settings.DEBUG:
             print('rx:', json_data)
         data = pb.RxMessageData(json_data)
 
+        if data.headers.get('binaryFrames') is not None:
+            self.binary_frames = bool(data.headers['binaryFrames'])
+        if data.headers.get('messageTypeIds') is not None:
+            self.message_type_ids = bool(data.headers['messageTypeIds'])
+        if data.headers.get('compactBodies') is not None:
+            self.body_casing = FIELD_NUMBERS if data.headers['compactBodies'] else Casing.CAMEL
+        if data.headers.get('binarySlots'):
+            self.resolve_binary_slots(data.body)
+
         if data.authHeader != self.token and data.authHeader:
             self.token = data.authHeader
             self._authenticate()
 
+        if data.type == pb.RxStreamCredit.type:
+            self.on_stream_credit(pb.RxStreamCredit(data, self.user))
+            return
+
+        if data.type == pb.RxSyncResync.type:
+            self.on_sync_resync(pb.RxSyncResync(data, self.user))
+            return
+
+        if data.type == pb.RxSessionResume.type:
+            self.on_session_resume(pb.RxSessionResume(data, self.user), data.uuid)
+            return
+
         for handler in self.handlers.get(data.type, []):
-            handler.__func__(ReceiverProxy(handler.__self__, data.uuid), data, self.user)
+            self.dispatch_handler(handler, data)
+
+    def dispatch_handler(self, handler: Callable, data: 'pb.RxMessageData'):
+        user = self.user
+        receiver = ReceiverProxy(handler.__self__, data.uuid)
+        concurrency = getattr(handler, '__receive_concurrency', SERIAL)
+        if concurrency == ORDERED:
+            # authorized and parsed once, the key is read from the message the handler gets - failures are reported
+            # like the handler's
+            ordered = handler.__func__(receiver, data, user, order_key=True)
+            if ordered is None:
+                return
+            key, handle = ordered
+            self.dispatcher.submit(handle, concurrency, key)
+            return
+        self.dispatcher.submit(lambda: handler.__func__(receiver, data, user), concurrency, None)
+
+    def on_stream_credit(self, message: 'pb.RxStreamCredit'):
+        stream = self.streams.get(message.proto.uuid)
+        if stream is None:
+            return
+        if message.proto.cancel:
+            stream.cancel()
+        else:
+            stream.add_credit(message.proto.credit)
+
+    def on_session_resume(self, message: 'pb.RxSessionResume', uuid: Optional[str] = None):
+        """
+        Starts a session, or resumes the parked one with session_id - the reply (`session`) is followed by the frames
+        after last_seq. Sessions can't be resumed (resumed = false, a new one is started) if they expired, the buffer
+        doesn't reach back to last_seq or they belong to a user the connection isn't authenticated as (send the
+        token with session-resume) - the session id doesn't authenticate the connection.
+        """
+        if self.session is not None:
+            self.send_message(pb.TxSessionInfo(pb.SessionInfo(session_id=self.session.id, seq=self.session.seq)), uuid)
+            return
+        session = Session.take(message.proto.session_id) if message.proto.session_id else None
+        user_id, binary_slot_id = session.credentials() if session is not None else (None, 0)
+        if session is not None and not (user_id is None or (self.user is not None and str(self.user.pk) == user_id)):
+            # not dropped, the session may be resumed by its user
+            session = None
+        if session is not None and not session.attach(self, message.proto.last_seq):
+            session.drop()
+            session = None
+        resumed = session is not None
+        if session is None:
+            session = Session.create(self)
+        # not numbered, the session isn't set yet
+        self.send_message(pb.TxSessionInfo(pb.SessionInfo(session_id=session.id, resumed=resumed, seq=session.seq)),
+                          uuid)
+
+        # the connection's groups are joined through the session from now on
+        groups = self.registered_groups
+        self.remove_groups()
+        self.registered_groups = session.groups
+        self.session = session
+        if resumed:
+            self.sync_states = session.sync_states
+            self.binary_slot_id = max(self.binary_slot_id, binary_slot_id)
+            if session.restored:
+                session.restored = False
+                for name in session.groups:
+                    self.group_relay.join(session, name, self.channel_layer)
+        else:
+            session.sync_states = self.sync_states
+        for name in groups:
+            self.add_group(name)
+
+        after = message.proto.last_seq
+        while resumed:
+            frames = session.replay(after)
+            if not frames:
+                break
+            for after, frame in frames:
+                for data in frame[:-1]:
+                    self.send(bytes_data=data)
+                self.send(text_data=frame[-1])
 
     def on_authenticated(self):
         pass
 
     def broadcast_message(self, event):
-        self.send_json(event['event'])
+        text = self.encode_json(self.encode_broadcast(event['event']))
+        self.outbox.send(lambda: self.send(text_data=text))
+
+    def encode_broadcast(self, json: dict) -> dict:
+        if self.body_casing is FIELD_NUMBERS:
+            message = pb.get_tx_message(json['headers']['messageType'])
+            if message is not None:
+                json = dict(json, body=compact_dict(message.proto, json['body']))
+        if self.message_type_ids:
+            # the event is shared by all consumers of the group (in-memory layer)
+            json = dict(json, headers=dict(json['headers']))
+            json['headers']['messageType'] = pb.tx_message_type_ids.get(json['headers']['messageType'],
+                                                                        json['headers']['messageType'])
+        return json
 
     @staticmethod
     def broadcast(group: str, message: 'TxMessage'):
-        async_to_sync(get_channel_layer().group_send)(group,
-                                                      {'type': 'broadcast.message', 'event': message.get_message()})
+        ApiWebsocketConsumer.broadcast_many([(group, message)])
+
+    @staticmethod
+    def broadcast_many(broadcasts: List[Tuple[str, 'TxMessage']]):
+        """
+        Broadcasts to several groups at once - each message is serialized once (however many groups it's sent to)
+        and the group sends are issued concurrently in one hop to the event loop.
+        """
+        layer = get_channel_layer()
+        events = {}
+        sends = []
+        for group, message in broadcasts:
+            event = events.get(id(message))
+            if event is None:
+                event = events[id(message)] = {'type': 'broadcast.message', 'event': message.get_message()}
+            if GroupRelay.is_sharded(group):
+                sends.extend(GroupRelay.shard_events(group, event))
+            else:
+                # the group is for the relay (sessions)
+                sends.append((group, dict(event, group=group)))
+        if not sends:
+            return
+        if hasattr(layer, 'group_send_nowait'):
+            # layers.HostChannelLayer queues sends from any thread, no event loop hop needed
+            for name, event in sends:
+                layer.group_send_nowait(name, event)
+        else:
+            async_to_sync(ApiWebsocketConsumer._group_send_many)(layer, sends)
+
+    @staticmethod
+    async def _group_send_many(layer, sends: List[Tuple[str, dict]]):
+        # bounded, layers like channels_redis have a limited connection pool
+        limit = asyncio.Semaphore(getattr(settings, 'PSD_BROADCAST_CONCURRENCY', 32))
+
+        async def group_send(group: str, event: dict):
+            async with limit:
+                await layer.group_send(group, event)
+
+        await asyncio.gather(*(group_send(group, event) for group, event in sends))
+
+    @staticmethod
+    def broadcast_on_commit(broadcasts: List[Tuple[str, 'TxMessage']], using: Optional[str] = None):
+        """
+        broadcast_many once the current transaction commits (immediately outside of transactions), nothing is sent if
+        it's rolled back.
+        """
+        transaction.on_commit(lambda: ApiWebsocketConsumer.broadcast_many(broadcasts), using=using)
+
+    @staticmethod
+    def broadcast_coalesced(group: str, message: 'TxMessage', key: Optional[str] = None,
+                            window: Optional[float] = None):
+        """
+        Broadcast for state snapshots, where only the newest message matters. Messages with the same group and key
+        (message type by default) are throttled to one per window - intermediate ones are dropped before they are
+        serialized or reach the channel layer.
+        """
+        if window is None:
+            window = getattr(settings, 'PSD_COALESCE_WINDOW', 0.1)
+        ApiWebsocketConsumer.broadcast_coalescer.submit(
+            (group, key or message.type),
+            lambda: ApiWebsocketConsumer.broadcast(group, message),
+            window,
+        )
 
     def remove_groups(self):
         for name in self.registered_groups:
-            async_to_sync(self.channel_layer.group_discard)(name, self.channel_name)
+            self._group_discard(name)
 
     def add_group(self, name):
         if name in self.registered_groups:
             return
-        async_to_sync(self.channel_layer.group_add)(name, self.channel_name)
+        if self.session is not None:
+            self.group_relay.join(self.session, name, self.channel_layer)
+        elif GroupRelay.is_sharded(name):
+            self.group_relay.join(self, name, self.channel_layer)
+        elif hasattr(self.channel_layer, 'group_add_nowait'):
+            self.channel_layer.group_add_nowait(name, self.channel_name)
+        else:
+            async_to_sync(self.channel_layer.group_add)(name, self.channel_name)
         self.registered_groups.append(name)
 
     def remove_group(self, name):
         if name not in self.registered_groups:
             return
-        async_to_sync(self.channel_layer.group_discard)(name, self.channel_name)
+        self._group_discard(name)
         self.registered_groups.remove(name)
 
+    def _group_discard(self, name):
+        if self.session is not None:
+            self.group_relay.leave(self.session, name, self.channel_layer)
+        elif GroupRelay.is_sharded(name):
+            self.group_relay.leave(self, name, self.channel_layer)
+        elif hasattr(self.channel_layer, 'group_discard_nowait'):
+            self.channel_layer.group_discard_nowait(name, self.channel_name)
+        else:
+            async_to_sync(self.channel_layer.group_discard)(name, self.channel_name)
+
     def disconnect(self, close_code):
-        self.remove_groups()
+        self.dispatcher.close()
+        if self.session is not None and self.session.consumer is self:
+            # groups are kept for a resume
+            self.session.park(self.drop_session)
+        elif self.session is None:
+            self.remove_groups()
+        for stream in list(self.streams.values()):
+            stream.cancel(ack=False)
+
+    def drop_session(self, session: Session):
+        for name in session.groups:
+            self.group_relay.leave(session, name, self.channel_layer)
 
     @classmethod
     def continue_async(cls, handler: Callable[[Any], Union[Any, None]], *args, **kwargs):
@@ -160,6 +533,133 @@ class ApiWebsocketConsumer(JsonWebsocketConsumer):
         return task
 
 
+class Stream:
+    """
+    Sends messages yielded by a generator handler as chunks (same uuid, increasing streamSeq header), followed by
+    the ack once the generator is exhausted. Every chunk uses up one credit - the client starts with the streamCredit
+    header of the request (PSD_STREAM_INITIAL_CREDIT by default) and grants more with stream-credit messages, so the
+    generator is never advanced further than the client allows. Chunks are sent from the handler pool (see
+    dispatch.HandlerDispatcher) while there is credit - without it the thread is free for other tasks and the stream
+    continues on the pool when credit arrives. Streams without credit for PSD_STREAM_CREDIT_TIMEOUT seconds (default
+    60) are closed. Credit is capped at PSD_STREAM_MAX_CREDIT (default 64). Generators resume on any pool thread - they
+    must not keep database cursors open across yields (see utils.stream_queryset).
+    """
+
+    def __init__(self, consumer: ApiWebsocketConsumer, uuid: str, generator, credit: int,
+                 on_result: Callable[[Optional['FPSReceiverError']], None]):
+        self.consumer = consumer
+        self.uuid = uuid
+        self.generator = generator
+        self.on_result = on_result  # acks the request
+        self.ack = True
+        self.lock = threading.Lock()
+        self.credit = 0
+        self._add(credit)
+        self.queued = False  # running on the pool, or waiting for a thread
+        self.cancelled = False
+        self.done = False
+        self.timer: Optional[threading.Timer] = None
+        self.seq = 0
+        consumer.streams[uuid] = self
+
+    def start(self):
+        with self.lock:
+            self.queued = True
+        self.consumer.dispatcher.run_in_pool(self.run)
+
+    def add_credit(self, credit: int):
+        with self.lock:
+            self._add(credit)
+            self._wake()
+
+    def _add(self, credit):
+        # client controlled
+        try:
+            credit = int(credit)
+        except (TypeError, ValueError):
+            return
+        if credit > 0:
+            self.credit = min(self.credit + credit, getattr(settings, 'PSD_STREAM_MAX_CREDIT', 64))
+
+    def cancel(self, ack: bool = True):
+        """
+        Stops the stream - acked, unless the connection is gone (ack=False).
+        """
+        with self.lock:
+            self.cancelled = True
+            self.ack = self.ack and ack
+            queued = self.queued
+        if not queued:
+            self._finish()
+
+    def _wake(self):
+        # called with self.lock held
+        if self.done or self.queued or not self.credit:
+            return
+        self.queued = True
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.consumer.dispatcher.run_in_pool(self.run)
+
+    def run(self):
+        """
+        Sends chunks while there is credit, on a pool thread.
+        """
+        HandlerDispatcher.check_db()
+        try:
+            while True:
+                with self.lock:
+                    if self.cancelled:
+                        break
+                    if not self.credit:
+                        self.queued = False
+                        self.timer = threading.Timer(getattr(settings, 'PSD_STREAM_CREDIT_TIMEOUT', 60), self._expire)
+                        self.timer.daemon = True
+                        self.timer.start()
+                        return
+                    self.credit -= 1
+                try:
+                    message = next(self.generator)
+                except StopIteration:
+                    break
+                # bulk - other frames of the connection go ahead between chunks
+                self.consumer.send_message(message, self.uuid, headers={'streamSeq': self.seq}, priority=BULK)
+                self.seq += 1
+        except Exception as e:
+            traceback.print_exc()
+            self._finish(e)
+            return
+        self._finish()
+
+    def _expire(self):
+        with self.lock:
+            # a timer cancelled while it fired
+            if self.done or threading.current_thread() is not self.timer:
+                return
+            # credit arriving now doesn't restart it
+            self.queued = True
+        error = Exception('stream {} timed out waiting for credit'.format(self.uuid))
+        print(error)
+        self.consumer.dispatcher.run_in_pool(self._finish, error)
+
+    def _finish(self, error: Optional[Exception] = None):
+        with self.lock:
+            if self.done:
+                return
+            self.done = True
+        try:
+            self.generator.close()
+        finally:
+            self.consumer.streams.pop(self.uuid, None)
+        if not self.ack:
+            return
+        if error is None:
+            self.on_result(None)
+        elif getattr(settings, 'PSD_FORWARD_EXCEPTIONS', False):
+            self.on_result(FPSReceiverError(getattr(settings, 'PSD_EXCEPTION_FORMATTER', lambda e: str(e))(error)))
+
+
 class FPSReceiver(abc.ABC):
     receivers: Dict[str, str] = {}
 
@@ -179,7 +679,15 @@ class FPSReceiverError:
 # decorators
 #
 def receive(permissions: List[str] = None, auth: bool = None, whitelist_groups: List[str] = None,
-            blacklist_groups: List[str] = None):
+            blacklist_groups: List[str] = None, concurrency: str = SERIAL,
+            key: Optional[Callable[[Any], Any]] = None):
+    """
+    concurrency: 'serial' (default) handles the message alone, in order with all others of the connection,
+    'parallel' concurrently with other messages and 'ordered' concurrently, but in order with the messages of the
+    same key - key(rx_message), eg. `lambda m: m.get_field('document_id')`. See dispatch.HandlerDispatcher.
+    Parallel and ordered handlers share the receiver instance with the other handlers of the connection running on
+    other threads - keep per-message state in locals and guard shared attributes.
+    """
     if auth is None:
         auth = getattr(settings, 'PSD_DEFAULT_AUTH', True)
     forward_exceptions = getattr(settings, 'PSD_FORWARD_EXCEPTIONS', False)
@@ -188,9 +696,15 @@ def receive(permissions: List[str] = None, auth: bool = None, whitelist_groups:
     def _receive(method):
         message = method.__annotations__.get('message')
         assert message is not None and hasattr(message, 'proto')
+        assert concurrency in CONCURRENCY and (concurrency == ORDERED) == (key is not None)
 
         from django.contrib.auth.models import User
-        def wrapper(self: FPSReceiver, message_data: pb.RxMessageData, user: User):
+        def wrapper(self: FPSReceiver, message_data: pb.RxMessageData, user: User, order_key: bool = False):
+            """
+            Handles the message, or with order_key only authorizes it and returns (key, handle) for the dispatcher -
+            handle() runs the handler on the parsed message (None if it's unauthorized or key failed - reported like
+            errors of the handler).
+            """
             def _handle_result(result):
                 ack_message = pb.TxAck(pb.Ack(uuid=message_data.uuid))
                 if type(result) is FPSReceiverError:
@@ -198,6 +712,40 @@ def receive(permissions: List[str] = None, auth: bool = None, whitelist_groups:
                     ack_message.proto.error_code = result.code
                 self.consumer.send_message(ack_message)
 
+            def _handle(rx_message):
+                # call receiver implementation
+                result = method(self, rx_message)
+
+                # generator handlers stream the yielded messages and are always acked at the end
+                if inspect.isgenerator(result):
+                    credit = message_data.headers.get('streamCredit') or getattr(
+                        settings, 'PSD_STREAM_INITIAL_CREDIT', 8)
+                    Stream(self.consumer.original, message_data.uuid, result, credit, _handle_result).start()
+                    return None
+
+                # handle ack
+                if message_data.ack:
+                    if type(result) is LongRunningTask:
+                        result.on_result = _handle_result
+                        result.ack = True
+                    else:
+                        _handle_result(result)
+
+                if type(result) is LongRunningTask:
+                    result.run()
+
+                return result
+
+            def _handle_authorized(rx_message):
+                try:
+                    return _handle(rx_message)
+                except Exception as e:
+                    if forward_exceptions and message_data.ack:
+                        _handle_result(FPSReceiverError(format_exception(e)))
+                    elif not forward_exceptions:
+                        raise
+                    traceback.print_exc()
+
             try:
                 authorized = True
 
@@ -215,31 +763,22 @@ def receive(permissions: List[str] = None, auth: bool = None, whitelist_groups:
                 if not authorized:
                     raise Exception(user, 'is unauthorized for', message)
 
-                # call receiver implementation
-                result = method(self, message(message_data, user))
-
-                # handle ack
-                if message_data.ack:
-                    if type(result) is LongRunningTask:
-                        result.on_result = _handle_result
-                        result.ack = message_data.ack
-                    else:
-                        _handle_result(result)
-
-                if type(result) is LongRunningTask:
-                    result.run()
-
-                return result
+                rx_message = message(message_data, user)
+                if order_key:
+                    return key(rx_message), lambda: _handle_authorized(rx_message)
+                return _handle(rx_message)
             except Exception as e:
                 if forward_exceptions and message_data.ack:
                     _handle_result(FPSReceiverError(format_exception(e)))
-                elif not forward_exceptions:
+                elif not forward_exceptions and not order_key:
                     raise
                 traceback.print_exc()
 
         wrapper.__receive = message
         wrapper.__receive_auth = auth
         wrapper.__receive_permissions = permissions
+        wrapper.__receive_concurrency = concurrency
+        wrapper.__receive_key = key
         return wrapper
 
     return _receive
@@ -266,8 +805,12 @@ class ConsumerProxy:
             return method
         return attr
 
-    def send_message(self, message: 'TxMessage', uuid: Optional[str] = None):
-        self.original.send_message(message, uuid or self.uuid)
+    def send_message(self, message: 'TxMessage', uuid: Optional[str] = None, headers: Optional[dict] = None,
+                     priority: Optional[str] = None):
+        self.original.send_message(message, uuid or self.uuid, headers, priority)
+
+    def send_state(self, message: 'TxMessage', key: str = '', uuid: Optional[str] = None):
+        self.original.send_state(message, key, uuid or self.uuid)
 
 
 class ReceiverProxy:
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from proto_socket_django.dispatch import HandlerDispatcher
+
+
+def cache_dir() -> str:
+    return getattr(settings, 'PSD_DERIVATIVE_CACHE_DIR', None) or os.path.join(
+        getattr(settings, 'MEDIA_ROOT', None) or tempfile.gettempdir(), 'psd_derivatives')
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def variant(thumb_size: Tuple[int, int], preview_size: Tuple[int, int]) -> str:
+    # derivatives of other sizes are cached separately
+    return '{}x{}-{}x{}'.format(*thumb_size, *preview_size)
+
+
+def generate(path: str, cache_path: str, thumb_size: Tuple[int, int], preview_size: Tuple[int, int]) -> dict:
+    """
+    Runs in the process pool. Generates the thumbnail, preview (images only, requires Pillow) and metadata of the
+    file at path into cache_path/<content hash>/<sizes>/, or returns the cached result if the content was seen before
+    with these sizes.
+    """
+    content_hash = file_hash(path)
+    out_dir = os.path.join(cache_path, content_hash[:2], content_hash, variant(thumb_size, preview_size))
+    meta_path = os.path.join(out_dir, 'derivatives.json')
+    if os.path.isfile(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    os.makedirs(out_dir, exist_ok=True)
+    result = {'hash': content_hash, 'variant': variant(thumb_size, preview_size), 'dir': out_dir, 'metadata': {'size': str(os.path.getsize(path))}, 'files': {}}
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+
+    if Image is not None:
+        try:
+            with Image.open(path) as image:
+                result['metadata'].update(width=str(image.width), height=str(image.height), format=image.format or '')
+                for name, size in (('thumb', thumb_size), ('preview', preview_size)):
+                    derivative = image.convert('RGB')
+                    derivative.thumbnail(size)
+                    derivative.save(os.path.join(out_dir, name + '.jpg'), 'JPEG', quality=85)
+                    result['files'][name] = name + '.jpg'
+        except Exception:
+            # not an image
+            pass
+
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+    os.replace(tmp_path, meta_path)
+    return result
+
+
+class Derivatives:
+    """
+    Thumbnail/preview urls and metadata of a stored file, generated off the socket path in a process pool
+    (PSD_DERIVATIVE_WORKERS) and cached by content hash, so duplicate uploads are processed once.
+    """
+    executor: Optional[ProcessPoolExecutor] = None
+    executor_lock = threading.Lock()
+
+    def __init__(self, content_hash: str, metadata: Dict[str, str], urls: Dict[str, str]):
+        self.hash = content_hash
+        self.metadata = metadata
+        self.urls = urls
+
+    @property
+    def thumb_url(self) -> str:
+        return self.urls.get('thumb', '')
+
+    @property
+    def preview_url(self) -> str:
+        return self.urls.get('preview', '')
+
+    @classmethod
+    def get_executor(cls) -> ProcessPoolExecutor:
+        with cls.executor_lock:
+            if cls.executor is None:
+                cls.executor = ProcessPoolExecutor(getattr(settings, 'PSD_DERIVATIVE_WORKERS', 2))
+            return cls.executor
+
+    @classmethod
+    def submit(cls, name: str, callback: Callable[['Derivatives'], None]) -> Future:
+        """
+        Generates derivatives of `name` (in the default storage) and calls callback with them once they are ready, on
+        the handler pool (see dispatch.HandlerDispatcher).
+        """
+        tmp_path = None
+        try:
+            path = default_storage.path(name)
+        except NotImplementedError:
+            # remote storage - the pool needs a local copy
+            with default_storage.open(name, 'rb') as src, tempfile.NamedTemporaryFile(delete=False) as dst:
+                shutil.copyfileobj(src, dst)
+                tmp_path = path = dst.name
+
+        future = cls.get_executor().submit(
+            generate, path, cache_dir(),
+            tuple(getattr(settings, 'PSD_THUMBNAIL_SIZE', (256, 256))),
+            tuple(getattr(settings, 'PSD_PREVIEW_SIZE', (1280, 1280))),
+        )
+        # done callbacks run on the pool's result thread, which must not wait for the storage or the callback
+        future.add_done_callback(
+            lambda f: HandlerDispatcher.get_pool().submit(cls.on_generated, f, callback, tmp_path))
+        return future
+
+    @staticmethod
+    def on_generated(future: Future, callback: Callable[['Derivatives'], None], tmp_path: Optional[str]):
+        try:
+            if tmp_path:
+                os.remove(tmp_path)
+            result = future.result()
+            prefix = getattr(settings, 'PSD_DERIVATIVE_STORAGE_PREFIX', 'derivatives/')
+            urls = {}
+            for key, filename in result['files'].items():
+                storage_name = '{}{}/{}/{}'.format(prefix, result['hash'], result['variant'], filename)
+                if not default_storage.exists(storage_name):
+                    with open(os.path.join(result['dir'], filename), 'rb') as f:
+                        storage_name = default_storage.save(storage_name, File(f))
+                urls[key] = default_storage.url(storage_name)
+            callback(Derivatives(result['hash'], result['metadata'], urls))
+        except:
+            traceback.print_exc()
@@ -0,0 +1,183 @@
+import asyncio
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Hashable, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+SERIAL = 'serial'
+PARALLEL = 'parallel'
+ORDERED = 'ordered'
+CONCURRENCY = (SERIAL, PARALLEL, ORDERED)
+
+
+@dataclass
+class HandlerTask:
+    run: Callable[[], None]
+    concurrency: str
+    key: Optional[Hashable] = None
+
+
+class HandlerDispatcher:
+    """
+    Runs the handlers of one connection by their concurrency (see receive): serial handlers run alone, after every
+    earlier message of the connection and before every later one, parallel ones as soon as a slot is free and ordered
+    ones after the earlier messages with the same key. At most PSD_CONNECTION_CONCURRENCY (default 4) handlers of a
+    connection run at once, on a pool of PSD_HANDLER_THREADS threads (default 16) shared by all connections.
+    Serial messages arriving while nothing else runs are handled on the consumer's thread, as before.
+    Handlers waiting for a loader.Loader batch are suspended - they don't count towards the limit.
+    """
+    pool: Optional[ThreadPoolExecutor] = None
+    pool_lock = threading.Lock()
+    db_checks = threading.local()
+    local = threading.local()  # dispatcher of the handler running on the thread
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue: List[HandlerTask] = []  # waiting, in arrival order
+        self.running: List[HandlerTask] = []
+        self.suspended = 0
+        self.closed = False
+        # event loop of the connection, handlers run from it so their sends (async_to_sync) go back to it
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @classmethod
+    def current(cls) -> Optional['HandlerDispatcher']:
+        return getattr(cls.local, 'dispatcher', None)
+
+    @classmethod
+    def get_pool(cls) -> ThreadPoolExecutor:
+        with cls.pool_lock:
+            if cls.pool is None:
+                cls.pool = ThreadPoolExecutor(getattr(settings, 'PSD_HANDLER_THREADS', 16),
+                                              thread_name_prefix='psd-handler')
+            return cls.pool
+
+    def submit(self, run: Callable[[], None], concurrency: str = SERIAL, key: Optional[Hashable] = None):
+        task = HandlerTask(run, concurrency, key)
+        with self.lock:
+            if self.closed:
+                return
+            inline = concurrency == SERIAL and not self.queue and not self.running
+            if inline:
+                self.running.append(task)
+            else:
+                self.queue.append(task)
+                ready = self._ready()
+        if not inline:
+            self._start(ready)
+            return
+        try:
+            self._call(task)
+        finally:
+            self._finish(task)
+
+    def close(self):
+        """
+        Drops the waiting messages (eg. on disconnect), running handlers finish.
+        """
+        with self.lock:
+            self.closed = True
+            self.queue.clear()
+
+    def suspend(self):
+        """
+        The handler running on this thread waits (see loader.Loader), other messages may start.
+        """
+        with self.lock:
+            self.suspended += 1
+            ready = self._ready()
+        self._start(ready)
+
+    def resume(self):
+        with self.lock:
+            self.suspended -= 1
+
+    def stalled(self) -> bool:
+        """
+        True if all running handlers are suspended and no waiting message can start.
+        """
+        with self.lock:
+            return self.suspended >= len(self.running)
+
+    def _ready(self) -> List[HandlerTask]:
+        # called with self.lock held, moves the tasks that may start now from queue to running
+        if any(task.concurrency == SERIAL for task in self.running):
+            return []
+        limit = getattr(settings, 'PSD_CONNECTION_CONCURRENCY', 4)
+        keys = {task.key for task in self.running if task.key is not None}
+        ready = []
+        for task in list(self.queue):
+            if len(self.running) - self.suspended >= limit:
+                break
+            if task.concurrency == SERIAL:
+                if not self.running:
+                    ready.append(task)
+                    self.queue.remove(task)
+                    self.running.append(task)
+                # later messages wait for it
+                break
+            if task.key is not None:
+                if task.key in keys:
+                    continue
+                keys.add(task.key)
+            ready.append(task)
+            self.queue.remove(task)
+            self.running.append(task)
+        return ready
+
+    def run_in_pool(self, run: Callable, *args):
+        """
+        Calls run(*args) on a pool thread, from the connection's event loop (if it's known and open).
+        """
+        if self.loop is None or self.loop.is_closed():
+            self.get_pool().submit(run, *args)
+        else:
+            run = sync_to_async(run, thread_sensitive=False, executor=self.get_pool())
+            asyncio.run_coroutine_threadsafe(run(*args), self.loop)
+
+    def _start(self, tasks: List[HandlerTask]):
+        for task in tasks:
+            self.run_in_pool(self._run, task)
+
+    def _run(self, task: HandlerTask):
+        self.check_db()
+        try:
+            self._call(task)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self._finish(task)
+
+    def _call(self, task: HandlerTask):
+        previous = self.current()
+        self.local.dispatcher = self
+        try:
+            task.run()
+        finally:
+            self.local.dispatcher = previous
+
+    def _finish(self, task: HandlerTask):
+        with self.lock:
+            self.running.remove(task)
+            ready = self._ready()
+        self._start(ready)
+
+    @classmethod
+    def check_db(cls):
+        # like the sync workers, pool threads keep their connections
+        last_check = getattr(cls.db_checks, 'last', None)
+        if last_check is None:
+            cls.db_checks.last = time.time()
+        elif time.time() - last_check > 10:
+            cls.db_checks.last = time.time()
+            try:
+                for conn in connections.all():
+                    conn.close_if_unusable_or_obsolete()
+            except Exception:
+                traceback.print_exc()
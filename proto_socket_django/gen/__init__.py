@@ -1,6 +1,5 @@
 import json
 import os
-import shutil
 from pathlib import Path as P, Path
 
 COMMON_PROTO = str(P(__file__).parent.resolve() / 'common')
@@ -17,12 +16,6 @@ def discover_protos(dir: str):
     return protos
 
 
-def delete_existing(dir):
-    if os.path.isdir(dir):
-        shutil.rmtree(dir)
-    os.makedirs(dir)
-
-
 def get_protos(config, path_arg):
     # sorted, deduped dirs so protoc/pbjs see files in a stable order and the
     # generated modules don't churn between runs
@@ -32,3 +25,10 @@ def get_protos(config, path_arg):
     proto_path = ' '.join([path_arg + ' ' + i for i in proto_dirs])
     protos = [p for ps in [discover_protos(i) for i in proto_dirs] for p in ps]
     return proto_path, protos
+
+
+def get_message_ids_path(config):
+    # shared by all platforms (and projects using the same protos), so it lives next to the protos by default
+    if config.get('message_ids'):
+        return os.path.expandvars(config['message_ids'])
+    return os.path.join(sorted(set([os.path.expandvars(p) for p in config['protos']]))[0], 'message_ids.lock')
@@ -1,32 +1,62 @@
 #!/usr/bin/python3
 import os
-import subprocess
 import sys
 import json
-from . import get_protos, delete_existing
+from . import get_protos, get_message_ids_path
+from .jobs import Jobs, Timings, GenerateError, chunk_protos
+from .manifest import Manifest
 from .platforms.django.messages_generator import generate
 
 
-def main():
-    if not os.path.isfile('fps_config.json') or not os.path.isfile('manage.py'):
-        print('Run the command from django project root, containing fps_config.json and manage.py.')
-        sys.exit(1)
+def remove_venv_from_path():
+    venv_path = os.getenv('VIRTUAL_ENV')
+    if venv_path:
+        paths = os.getenv('PATH').split(os.pathsep)
+        paths = [p for p in paths if venv_path not in p]
+        new_path = os.pathsep.join(paths)
+        os.environ['PATH'] = new_path
 
+
+def run(config: dict, check=False, timings: Timings = None) -> int:
+    timings = timings or Timings()
     proto_out = 'proto'
-    delete_existing(proto_out)
-    proto_path, protos = get_protos(json.load(open('fps_config.json')), '-I')
+    with timings.stage('django', 'plan'):
+        proto_path, protos = get_protos(config, '-I')
+        manifest = Manifest(proto_out, 'django', protos, config)
+        if check:
+            return manifest.report_check()
+        changed = manifest.plan()
+    if not changed:
+        print(f'{proto_out} is up to date')
+        return 0
+
+    staging = manifest.staging()
+    try:
+        # specs first, so spec errors are reported before compiling
+        with timings.stage('django', 'messages'):
+            generate(protos, staging, get_message_ids_path(config))
+        with timings.stage('django', 'protoc'):
+            Jobs.run([f'protoc {proto_path} --python_betterproto_out={staging} {" ".join(chunk)}'
+                      for chunk in chunk_protos(changed, Jobs.n_jobs)], 'protoc')
+    except GenerateError:
+        manifest.discard(staging)
+        raise
+    with timings.stage('django', 'sync'):
+        manifest.sync(staging)
+    return 0
 
-    def remove_venv_from_path():
-        venv_path = os.getenv('VIRTUAL_ENV')
-        if venv_path:
-            paths = os.getenv('PATH').split(os.pathsep)
-            paths = [p for p in paths if venv_path not in p]
-            new_path = os.pathsep.join(paths)
-            os.environ['PATH'] = new_path
+
+def main(check=False):
+    if not os.path.isfile('fps_config.json') or not os.path.isfile('manage.py'):
+        print('Run the command from django project root, containing fps_config.json and manage.py.')
+        sys.exit(1)
 
     remove_venv_from_path()
-    subprocess.run(f'protoc {proto_path} --python_betterproto_out={proto_out} {" ".join(protos)}', shell=True)
-    generate(protos)
+    try:
+        sys.exit(run(json.load(open('fps_config.json')), check))
+    except GenerateError as e:
+        print(e)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
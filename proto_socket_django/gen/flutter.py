@@ -1,45 +1,75 @@
 import os
-import platform
-import subprocess
 import sys
 import json
-from . import get_protos, delete_existing, COMMON_PROTO
+import tempfile
+from . import get_protos, get_message_ids_path, COMMON_PROTO
+from .jobs import Jobs, Timings, GenerateError, chunk_protos
+from .manifest import Manifest, copy_if_changed
 from .platforms.flutter.messages_generator import generate
 
+# messages shipped with flutter_persistent_socket are imported from the package
+PACKAGE_PROTOS = ['sfiles.pb.dart', 'uploader.pb.dart']
 
-def main():
-    if not os.path.isfile('pubspec.yaml') or not os.path.isfile('fps_config.json'):
-        print('Run the command from flutter project root, containing fps_config.json and pubspec.yaml.')
-        sys.exit(1)
 
-    proto_out = 'lib/proto'
-    delete_existing(proto_out)
+def use_package_protos(dir):
+    for root, dirnames, filenames in os.walk(dir):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            replaced = content
+            for name in PACKAGE_PROTOS:
+                replaced = replaced.replace(name, 'package:flutter_persistent_socket/proto/' + name)
+            if replaced != content:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(replaced)
 
-    config = json.load(open('fps_config.json'))
+
+def run(config: dict, check=False, timings: Timings = None) -> int:
+    timings = timings or Timings()
+    proto_out = 'lib/proto'
+    config = dict(config)
     if 'include_common' not in config:
         config['include_common'] = False
 
-    proto_path, protos = get_protos(config, '-I')
-    subprocess.run(f'protoc {proto_path} -I {COMMON_PROTO} --dart_out={proto_out} {" ".join(protos)}', shell=True)
-    if platform.system() == "Darwin":
-        subprocess.run(
-            "sed -i '' 's/sfiles.pb.dart/package:flutter_persistent_socket\/proto\/sfiles.pb.dart/g' ./lib/proto/*",
-            shell=True
-        )
-        subprocess.run(
-            "sed -i '' 's/uploader.pb.dart/package:flutter_persistent_socket\/proto\/uploader.pb.dart/g' ./lib/proto/*",
-            shell=True
-        )
-    else:
-        subprocess.run(
-            "sed -i 's/sfiles.pb.dart/package:flutter_persistent_socket\/proto\/sfiles.pb.dart/g' ./lib/proto/*",
-            shell=True
-        )
-        subprocess.run(
-            "sed -i 's/uploader.pb.dart/package:flutter_persistent_socket\/proto\/uploader.pb.dart/g' ./lib/proto/*",
-            shell=True
-        )
-    generate(protos)
+    with timings.stage('flutter', 'plan'):
+        proto_path, protos = get_protos(config, '-I')
+        manifest = Manifest(proto_out, 'flutter', protos, config)
+        if check:
+            return manifest.report_check()
+        changed = manifest.plan()
+    if not changed:
+        print(f'{proto_out} is up to date')
+        return 0
+
+    staging = manifest.staging()
+    with tempfile.TemporaryDirectory() as messages_out:
+        try:
+            with timings.stage('flutter', 'messages'):
+                generate(protos, messages_out, get_message_ids_path(config))
+            with timings.stage('flutter', 'protoc'):
+                Jobs.run([f'protoc {proto_path} -I {COMMON_PROTO} --dart_out={staging} {" ".join(chunk)}'
+                          for chunk in chunk_protos(changed, Jobs.n_jobs)], 'protoc')
+                use_package_protos(staging)
+        except GenerateError:
+            manifest.discard(staging)
+            raise
+        with timings.stage('flutter', 'sync'):
+            manifest.sync(staging)
+            copy_if_changed(os.path.join(messages_out, 'messages.dart'), './lib/messages.dart')
+    return 0
+
+
+def main(check=False):
+    if not os.path.isfile('pubspec.yaml') or not os.path.isfile('fps_config.json'):
+        print('Run the command from flutter project root, containing fps_config.json and pubspec.yaml.')
+        sys.exit(1)
+
+    try:
+        sys.exit(run(json.load(open('fps_config.json')), check))
+    except GenerateError as e:
+        print(e)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
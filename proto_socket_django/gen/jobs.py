@@ -0,0 +1,78 @@
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+
+class GenerateError(Exception):
+    pass
+
+
+class Timings:
+    """
+    Wall time of each (platform, stage) of a generate run.
+    """
+
+    def __init__(self):
+        self.stages: List[Tuple[str, str, float]] = []
+
+    @contextmanager
+    def stage(self, platform: str, name: str):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.stages.append((platform, name, time.time() - start))
+
+    def report(self, total: Optional[float] = None):
+        for platform, name, duration in self.stages:
+            print('{:<10} {:<10} {:>8.2f}s'.format(platform, name, duration))
+        if total is not None:
+            print('{:<21} {:>8.2f}s'.format('total', total))
+
+
+class Jobs:
+    """
+    Pool running protoc/pbjs commands concurrently - shared by all platforms of a generate run, so at most
+    n_jobs (generate --jobs, default: cpu count) compilers run at once.
+    """
+    n_jobs = os.cpu_count() or 1
+    executor: Optional[ThreadPoolExecutor] = None
+    executor_lock = threading.Lock()
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        with cls.executor_lock:
+            if cls.executor is None:
+                cls.executor = ThreadPoolExecutor(cls.n_jobs)
+            return cls.executor
+
+    @classmethod
+    def run(cls, commands: List[str], name: str):
+        """
+        Runs the shell commands concurrently, raises GenerateError if any of them failed.
+        """
+        futures = [cls.get_executor().submit(subprocess.run, command, shell=True) for command in commands]
+        failed = [f for f in futures if f.result().returncode]
+        if failed:
+            raise GenerateError('{} failed ({} of {} jobs)'.format(name, len(failed), len(commands)))
+
+
+def chunk_protos(protos: List[str], n: int, min_size: int = 16) -> List[List[str]]:
+    """
+    Splits protos into at most n chunks of similar size (and at least min_size protos - compiler startup
+    outweighs parallelism for small chunks). Protos of the same package stay in one chunk, since some
+    compilers (betterproto) write one file per package.
+    """
+    from .manifest import Manifest
+    packages: Dict[str, List[str]] = {}
+    for proto in protos:
+        packages.setdefault(Manifest.get_package(proto), []).append(proto)
+    chunks: List[List[str]] = [[] for _ in range(max(1, min(n, len(packages), len(protos) // min_size)))]
+    for group in sorted(packages.values(), key=len, reverse=True):
+        min(chunks, key=len).extend(group)
+    order = {proto: i for i, proto in enumerate(protos)}
+    return [sorted(c, key=order.get) for c in chunks if c]
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path as P
+from typing import Dict, List, Optional, Set
+
+from . import get_message_ids_path
+
+MANIFEST_NAME = '.psd_manifest.json'
+GEN_DIR = P(__file__).parent.resolve()
+
+
+def file_hash(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def generator_version(platform: str) -> str:
+    # hash of the generator sources, so upgrading the library regenerates everything
+    h = hashlib.sha256()
+    sources = [GEN_DIR / '__init__.py', GEN_DIR / 'manifest.py', GEN_DIR / (platform + '.py'),
+               GEN_DIR / 'platforms' / '__init__.py']
+    sources += sorted((GEN_DIR / 'platforms' / platform).glob('*.py'))
+    for path in sources:
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+
+def copy_if_changed(src: str, dst: str) -> bool:
+    if os.path.isfile(dst) and file_hash(dst) == file_hash(src):
+        return False
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    shutil.copyfile(src, dst)
+    return True
+
+
+class Manifest:
+    """
+    Hashes of the input protos and generated files of the last run (in <out>/.psd_manifest.json), used to
+    regenerate only what changed. Files are generated into a staging dir and copied to the output dir only when
+    their content differs, so unchanged outputs are never rewritten.
+    """
+
+    def __init__(self, out: str, platform: str, protos: List[str], config: dict):
+        self.out = out
+        self.path = os.path.join(out, MANIFEST_NAME)
+        self.protos = protos
+        self.platform = platform
+        self.config = config
+        self.version = self.get_version()
+        self.hashes: Dict[str, str] = {p: file_hash(p) for p in protos}
+        self.outputs: Dict[str, str] = {}
+        self.previous: Optional[dict] = None
+        self.full = False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.previous = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def get_version(self) -> str:
+        # message ids are emitted into the generated code, so the lock file counts as generator input
+        ids_path = get_message_ids_path(self.config)
+        ids = file_hash(ids_path) if os.path.isfile(ids_path) else ''
+        return hashlib.sha256('{}:{}:{}'.format(
+            generator_version(self.platform), json.dumps(self.config, sort_keys=True), ids).encode()).hexdigest()
+
+    @property
+    def is_full(self) -> bool:
+        """
+        Everything has to be regenerated - no usable manifest, generator/config changed or protos were removed
+        (their outputs can only be told apart by a full run).
+        """
+        previous = self.previous
+        return previous is None or previous.get('version') != self.version or \
+            not set(previous.get('protos', {})).issubset(self.hashes)
+
+    def changed_protos(self) -> List[str]:
+        """
+        Protos whose content changed, plus protos in the same package or importing them (their output may
+        depend on it). All protos if is_full.
+        """
+        if self.is_full:
+            return list(self.protos)
+        previous = self.previous['protos']
+        changed = {p for p in self.protos if previous.get(p) != self.hashes[p]}
+        if not changed:
+            return []
+
+        packages = {p: self.get_package(p) for p in self.protos}
+        imports = {p: self.get_imports(p) for p in self.protos}
+        pending = list(changed)
+        while pending:
+            proto = pending.pop()
+            for other in self.protos:
+                if other in changed:
+                    continue
+                if packages[other] == packages[proto] or any(proto.endswith(os.sep + i) for i in imports[other]):
+                    changed.add(other)
+                    pending.append(other)
+        return [p for p in self.protos if p in changed]
+
+    @staticmethod
+    def get_package(proto: str) -> str:
+        with open(proto, 'r', encoding='utf-8') as f:
+            match = re.search(r'^\s*package\s+([\w.]+)\s*;', f.read(), flags=re.M)
+        return match.group(1) if match else ''
+
+    @staticmethod
+    def get_imports(proto: str) -> Set[str]:
+        with open(proto, 'r', encoding='utf-8') as f:
+            return set(i.replace('/', os.sep) for i in
+                       re.findall(r'^\s*import\s+(?:public\s+|weak\s+)?"([^"]+)"', f.read(), flags=re.M))
+
+    def stale_outputs(self) -> List[str]:
+        """
+        Outputs of the last run that are missing or were modified since.
+        """
+        stale = []
+        for name, digest in (self.previous or {}).get('outputs', {}).items():
+            path = os.path.join(self.out, name)
+            if not os.path.isfile(path) or file_hash(path) != digest:
+                stale.append(name)
+        return stale
+
+    def check(self) -> List[str]:
+        """
+        Reasons the generated code is out of date (empty if it is up to date).
+        """
+        if self.previous is None:
+            return ['{} not found'.format(self.path)]
+        if self.previous.get('version') != self.version:
+            return ['generator version or config changed']
+        previous = self.previous.get('protos', {})
+        reasons = ['removed: ' + p for p in previous if p not in self.hashes]
+        reasons += ['changed: ' + p for p in self.protos if previous.get(p) != self.hashes[p]]
+        reasons += ['modified output: ' + p for p in self.stale_outputs()]
+        return reasons
+
+    def report_check(self) -> int:
+        """
+        Prints check() and returns the exit code for --check.
+        """
+        reasons = self.check()
+        for reason in reasons:
+            print(reason)
+        print('{} is {}'.format(self.out, 'out of date' if reasons else 'up to date'))
+        return 1 if reasons else 0
+
+    def plan(self) -> List[str]:
+        """
+        Protos to regenerate - all of them if is_full or outputs were modified, [] if everything is up to date.
+        """
+        if self.is_full or self.stale_outputs():
+            self.full = True
+            return list(self.protos)
+        return self.changed_protos()
+
+    def staging(self) -> str:
+        return tempfile.mkdtemp(prefix='psd_gen_')
+
+    def discard(self, staging: str):
+        # a failed run must not replace (or, on full runs, remove) existing outputs
+        shutil.rmtree(staging, ignore_errors=True)
+        print('{} was not changed'.format(self.out))
+
+    def sync(self, staging: str):
+        """
+        Copies files from staging that differ from the output dir and records their hashes. On full runs, outputs
+        of the last run that were not generated again are removed. Saves the manifest.
+        """
+        os.makedirs(self.out, exist_ok=True)
+        if self.previous is None:
+            # first run - the output dir used to be deleted before generating, so everything in it is generated
+            previous_outputs = {os.path.relpath(os.path.join(root, f), self.out): '' for root, _, filenames in
+                                os.walk(self.out) for f in filenames if f != MANIFEST_NAME}
+        else:
+            previous_outputs = dict(self.previous.get('outputs', {}))
+        if not self.full:
+            self.outputs.update(previous_outputs)
+        written = 0
+        for root, dirnames, filenames in os.walk(staging):
+            for filename in filenames:
+                src = os.path.join(root, filename)
+                name = os.path.relpath(src, staging)
+                self.outputs[name] = file_hash(src)
+                written += copy_if_changed(src, os.path.join(self.out, name))
+        shutil.rmtree(staging)
+
+        removed = 0
+        if self.full:
+            for name in previous_outputs:
+                path = os.path.join(self.out, name)
+                if name not in self.outputs and os.path.isfile(path):
+                    os.remove(path)
+                    removed += 1
+        print('{} file(s) written, {} removed, {} unchanged'.format(
+            written, removed, len(self.outputs) - written))
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.get_version(), 'protos': self.hashes, 'outputs': self.outputs}, f, indent=2,
+                      sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -1,5 +1,64 @@
-import re
+import threading
+from typing import Dict, List, Optional
 
+from proto_socket_django.gen.platforms.message_ids import MessageIds
+from proto_socket_django.gen.platforms.schema import MessageSpec, ProtoTypes, Schema, SpecError, parse_proto, \
+    parse_types
 
-def get_psd_messages(proto_content: str):
-    return re.findall('/\*(.+?)\*/\nmessage(.+?){', proto_content, flags=re.S)
+# specs parsed per proto file, shared by the platforms of a generate --all run
+_specs: Dict[str, List[MessageSpec]] = {}
+_specs_lock = threading.Lock()
+_types: Dict[str, tuple] = {}
+
+
+def read_schema(protos: List[str], ids_path: Optional[str] = None) -> Schema:
+    """
+    Parses the specs of all protos (each file once per run) into a Schema and assigns their numeric ids from the
+    ids_path lock file (ids are not persisted without it). Raises SpecError listing all errors.
+    """
+    messages, errors = [], []
+    for path in protos:
+        with _specs_lock:
+            specs = _specs.get(path)
+            if specs is None:
+                with open(path, 'r', encoding='utf-8') as f:
+                    try:
+                        specs = parse_proto(path, f.read())
+                    except SpecError as e:
+                        errors += e.errors
+                        continue
+                _specs[path] = specs
+        messages += specs
+    if errors:
+        raise SpecError(errors)
+
+    schema = Schema(messages)
+    with _specs_lock:
+        schema.ids = MessageIds(ids_path)
+        if schema.ids.assign(schema.messages):
+            schema.ids.save()
+    return schema
+
+
+def read_types(protos: List[str]) -> ProtoTypes:
+    """
+    Parses the messages and fields of all protos (each file once per run).
+    """
+    types = ProtoTypes()
+    for path in protos:
+        with _specs_lock:
+            parsed = _types.get(path)
+            if parsed is None:
+                with open(path, 'r', encoding='utf-8') as f:
+                    parsed = _types[path] = parse_types(path, f.read())
+        types.add(path, parsed)
+    return types
+
+
+def format_compact_fields(types: ProtoTypes, schema: Schema) -> str:
+    """
+    Field tables of the server messages (and the messages they contain) as a TS/Dart map literal.
+    """
+    tables = types.get_compact_fields([types.get_full_name(m) for m in schema.messages if not m.origin_is_client])
+    return ', '.join("'{}': {{{}}}".format(name, ', '.join("'{}': [{}]".format(number, ', '.join(
+        repr(i) for i in field)) for number, field in table.items())) for name, table in tables.items())
@@ -1,30 +1,28 @@
 import argparse
 import sys
-import re
 import os
-from pathlib import Path
 from typing import List
 
 from proto_socket_django.gen.platforms.django import messages_templates as templates
-from proto_socket_django.gen.platforms import get_psd_messages
+from proto_socket_django.gen.platforms import read_schema, read_types
+from proto_socket_django.gen.platforms.schema import MessageSpec, SpecError
 
 
 class MessagesGenerator:
-    def __init__(self, path, spec, proto):
-        self.path = path
-        self.proto = proto.strip()
-        self.spec = spec.strip()
-        self.spec_items = [i.strip() for i in self.spec.split('\n') if i.strip()]
-        self.package = Path(self.path).stem
+    def __init__(self, spec: MessageSpec):
+        self.spec = spec
+        self.path = spec.path
+        self.proto = spec.proto
+        self.package = spec.package
 
     def get_type(self):
-        return re.search('type.+=.+\'(.+)\'', self.spec).group(1)
+        return self.spec.type
 
     def get_import(self):
         return 'from proto.%s import *' % self.package
 
     def get_server_prefix(self):
-        if 'client' in re.search('origin.+=(.+)', self.spec).group(1):
+        if self.spec.origin_is_client:
             return 'Rx'
         else:
             return 'Tx'
@@ -33,37 +31,63 @@ class MessagesGenerator:
         return self.get_server_prefix() + self.proto
 
     def is_auth_required(self):
-        auth = re.search('auth\s*=\s*(.+)\s*', self.spec)
-        if auth:
-            return auth.group(1).capitalize()
-        else:
-            return 'True'
+        return str(self.spec.auth)
 
     def get_server_message(self) -> str:
         return templates.server_message.format(prefix=self.get_server_prefix(), proto=self.proto,
-                                               type=self.get_type(), auth=self.is_auth_required())
+                                               package=self.package, type=self.get_type(), type_id=self.spec.id,
+                                               auth=self.is_auth_required())
 
     def __str__(self):
-        return self.proto + ' (' + self.path + ')'
+        return str(self.spec)
 
 
-def generate(protos: List[str]):
-    generators = []
-    imports = {'from abc import ABC', 'import dataclasses', 'from betterproto import *'}
-    for f in protos:
-        proto_content = open(f, 'r', encoding='utf-8').read()
-        imports.add(f'from proto.{os.path.splitext(os.path.basename(f))[0]} import *')
-        generators += [MessagesGenerator(f, i[0], i[1]) for i in get_psd_messages(proto_content)]
+def generate(protos: List[str], proto_out='proto', ids_path=None):
+    imports = {'from abc import ABC', 'import dataclasses', 'import threading', 'import betterproto',
+               'from betterproto import *', 'from typing import TYPE_CHECKING, Optional, Type, Union'}
+    packages = sorted(set(os.path.splitext(os.path.basename(f))[0] for f in protos))
+    schema = read_schema(protos, ids_path)
+    generators = [MessagesGenerator(spec) for spec in schema.messages]
+    by_package = {package: [] for package in packages}
+    for generator in generators:
+        by_package[generator.package].append(generator)
+    # package of every name proto.messages exports, so only the owning package is imported on first use
+    names, errors = {}, []
+    types = read_types(protos)
+    for path in protos:
+        package = os.path.splitext(os.path.basename(path))[0]
+        class_names = types.get_class_names(path)
+        class_names += [g.get_server_message_classname() for g in by_package[package]]
+        for name in class_names:
+            if names.setdefault(name, package) != package:
+                errors.append('{}: {} is defined by {} as well'.format(path, name, names[name]))
+    if errors:
+        raise SpecError(errors)
 
-    generators.sort(key=lambda g: f'{g.package}_{g.proto}')
-    with open('proto/messages.py', 'w', encoding='utf-8') as f:
+    with open(os.path.join(proto_out, 'messages.py'), 'w', encoding='utf-8') as f:
         f.write('\n'.join(sorted(imports)))
+        if packages:
+            # static analysis still sees all names
+            f.write('\n\nif TYPE_CHECKING:\n' + '\n'.join(f'    from proto.{p} import *' for p in packages))
         f.write(templates.boilerplate)
-        for generator in generators:
-            try:
-                f.write(generator.get_server_message())
-            except Exception as e:
-                print('Syntax error:', generator, '|', e)
+        for package, package_generators in by_package.items():
+            f.write(templates.package_loader.format(
+                package=package,
+                messages=''.join(g.get_server_message() for g in package_generators),
+                classnames=', '.join(g.get_server_message_classname() for g in package_generators),
+            ))
+        f.write(templates.lazy_registry.format(
+            packages=', '.join('{!r}: _load_{}'.format(p, p) for p in packages),
+            names=', '.join('{!r}: {!r}'.format(n, p) for n, p in names.items()),
+            rx_names=', '.join('{!r}: {!r}'.format(g.get_type(), g.get_server_message_classname())
+                               for g in generators if g.spec.origin_is_client),
+            tx_names=', '.join('{!r}: {!r}'.format(g.get_type(), g.get_server_message_classname())
+                               for g in generators if not g.spec.origin_is_client),
+        ))
+        f.write(templates.message_type_ids.format(
+            rx=', '.join('{}: {!r}'.format(id, t) for t, id in schema.ids.by_origin('client').items()),
+            tx=', '.join('{!r}: {}'.format(t, id) for t, id in schema.ids.by_origin('server').items()),
+        ))
 
 
 if __name__ == '__main__':
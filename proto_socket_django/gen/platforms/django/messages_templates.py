@@ -1,9 +1,18 @@
 server_message = '''
+    class {prefix}{proto}({prefix}Message):
+        type = '{type}'
+        type_id = {type_id}
+        proto: {package}.{proto} = {package}.{proto}
+        auth_required = {auth}
+'''
+
+# messages of a proto package are defined when the package is first used, see load_package
+package_loader = '''
 
-class {prefix}{proto}({prefix}Message):
-    type = '{type}'
-    proto: {proto} = {proto}
-    auth_required = {auth}
+def _load_{package}():
+    from proto import {package}
+{messages}
+    return {package}, [{classnames}]
 '''
 
 boilerplate = '''
@@ -18,31 +27,81 @@ class RxMessageData:
         self.ack = self.headers.get('ack')
         self.uuid = self.headers.get('uuid')
         self.type = self.headers.get('messageType')
+        if type(self.type) is int:
+            # numeric id (see message_ids.lock)
+            self.type = rx_message_types.get(self.type)
         self.retryCount = self.headers.get('retryCount', 0)
 
 
+class LazyProto:
+    """
+    RxMessage.proto - the proto class when accessed on the class, the decoded body (decoded on first access and
+    stored on the instance) when accessed on a message.
+    """
+
+    def __init__(self, proto_class):
+        self.proto_class = proto_class
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.proto_class
+        proto = self.proto_class()
+        if instance.data is not None:
+            proto.from_dict(instance.data.body)
+        instance.__dict__['proto'] = proto
+        return proto
+
+
 class RxMessage(ABC):
     proto = None
     type = None
+    type_id = None
     auth_required = True
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        proto = cls.__dict__.get('proto')
+        if isinstance(proto, type):
+            cls.proto = LazyProto(proto)
+
     def __init__(self, data: Optional[Union[RxMessageData, betterproto.Message]] = None, user=None):
         self.data = None
-        if not data:
-            self.proto = self.proto()
-        elif isinstance(data, betterproto.Message):
+        self.decoded_fields = {}
+        if isinstance(data, betterproto.Message):
             self.proto = data
-        else:
-            self.data = data
+        elif data:
             self.set_data(data)
         self.user = user
 
     def set_data(self, data: RxMessageData):
-        self.proto = self.proto().from_dict(data.body)
+        # body is decoded lazily, on first access to self.proto
+        self.data = data
+        self.decoded_fields = {}
+        self.__dict__.pop('proto', None)
+
+    def get_field(self, name: str):
+        """
+        Decodes a single field of the body (eg. a large repeated or bytes field) without decoding the whole message.
+        """
+        if 'proto' in self.__dict__ or self.data is None:
+            return getattr(self.proto, name)
+        if name not in self.decoded_fields:
+            from proto_socket_django.betterproto_patch import get_plan
+            body = self.data.body or {}
+            proto_class = type(self).proto
+            # names in any casing, or field numbers of compact bodies
+            plan = get_plan(proto_class)
+            keys = [k for k in body if getattr(plan.field_for_key(k), 'name', None) == name]
+            proto = proto_class()
+            if keys:
+                proto.from_dict({keys[0]: body[keys[0]]})
+            self.decoded_fields[name] = getattr(proto, name)
+        return self.decoded_fields[name]
 
 class TxMessage(ABC):
     proto: betterproto.Message = None
     type: str = None
+    type_id: int = None
 
     def __init__(self, proto=None):
         self.fields = {}
@@ -52,12 +111,12 @@ class TxMessage(ABC):
         else:
             self.proto = self.proto()
 
-    def get_message(self) -> dict:
+    def get_message(self, casing=Casing.CAMEL) -> dict:
         return {
             'headers': {
                 'messageType': self.type,
             },
-            'body': self.proto.to_dict()
+            'body': self.proto.to_dict(casing)
         }
 
 def init_default_gen_patch(self):
@@ -74,3 +133,75 @@ def init_default_gen_patch(self):
 
 betterproto.ProtoClassMetadata.init_default_gen = init_default_gen_patch
 '''
+
+lazy_registry = '''
+
+# proto packages are imported on first use of one of their names (pb.RxLogin, pb.Item, ...) - importing all
+# betterproto dataclasses of a large project at startup is slow. load_all() imports everything.
+_packages = {{{packages}}}
+_names = {{{names}}}  # every proto class and message, by the package defining it
+_loaded = set()
+_load_lock = threading.RLock()
+
+# message class name by type
+rx_message_names = {{{rx_names}}}
+tx_message_names = {{{tx_names}}}
+
+
+def load_package(package: str):
+    with _load_lock:
+        if package in _loaded:
+            return
+        module, messages = _packages[package]()
+        classes = [value for value in vars(module).values()
+                   if isinstance(value, type) and value.__module__ == module.__name__]
+        module_globals = globals()
+        for value in classes + messages:
+            name = value.__name__
+            if module_globals.get(name, value) is not value:
+                raise ImportError('{{}} of proto package {{}} conflicts with {{!r}}'.format(
+                    name, package, module_globals[name]))
+            module_globals[name] = value
+        for message in messages:
+            message.__qualname__ = message.__name__
+        _loaded.add(package)
+
+
+def load_all():
+    for package in _packages:
+        load_package(package)
+
+
+def get_rx_message(message_type: str) -> Optional[Type[RxMessage]]:
+    name = rx_message_names.get(message_type)
+    return __getattr__(name) if name else None
+
+
+def get_tx_message(message_type: str) -> Optional[Type[TxMessage]]:
+    name = tx_message_names.get(message_type)
+    return __getattr__(name) if name else None
+
+
+def __getattr__(name: str):
+    if name.startswith('__'):
+        # eg. __all__ of a star import, __path__ - never a proto
+        raise AttributeError(f"module {{__name__!r}} has no attribute {{name!r}}")
+    package = _names.get(name)
+    if package is not None:
+        load_package(package)
+        module_globals = globals()
+        if name in module_globals:
+            return module_globals[name]
+    raise AttributeError(f"module {{__name__!r}} has no attribute {{name!r}}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_names))
+'''
+
+message_type_ids = '''
+
+# numeric message type ids, sent instead of messageType strings to clients with the messageTypeIds header
+rx_message_types = {{{rx}}}
+tx_message_type_ids = {{{tx}}}
+'''
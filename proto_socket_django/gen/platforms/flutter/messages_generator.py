@@ -1,11 +1,11 @@
 import argparse
+import os
 import sys
-import re
 from dataclasses import dataclass
-from pathlib import Path
 from typing import List
 from proto_socket_django.gen.platforms.flutter import messages_templates as templates
-from proto_socket_django.gen.platforms import get_psd_messages
+from proto_socket_django.gen.platforms import read_schema, read_types, format_compact_fields
+from proto_socket_django.gen.platforms.schema import MessageSpec
 
 
 def to_camel_case(snake_str):
@@ -16,15 +16,15 @@ def to_camel_case(snake_str):
 
 
 class MessagesGenerator:
-    def __init__(self, path, spec, proto):
-        self.path = path
-        self.proto = proto.strip()
-        self.spec = spec.strip()
-        self.spec_items = [i.strip() for i in self.spec.split('\n') if i.strip()]
-        self.package = Path(self.path).stem
+    def __init__(self, spec: MessageSpec, full_name: str):
+        self.spec = spec
+        self.full_name = full_name
+        self.path = spec.path
+        self.proto = spec.proto
+        self.package = spec.package
 
     def get_type(self):
-        return re.search('type.+=.+\'(.+)\'', self.spec).group(1)
+        return self.spec.type
 
     def get_import(self):
         prefix = ''
@@ -33,38 +33,21 @@ class MessagesGenerator:
         return "import '{}proto/{}.pb.dart';".format(prefix, self.package)
 
     def get_client_prefix(self):
-        if 'client' in re.search('origin.+=(.+)', self.spec).group(1):
+        if self.spec.origin_is_client:
             return 'Tx'
         else:
             return 'Rx'
 
     def origin_is_client(self):
-        return 'client' in re.search('origin.+=(.+)', self.spec).group(1)
+        return self.spec.origin_is_client
 
     def get_client_message_classname(self):
         return self.get_client_prefix() + self.proto
 
     def get_client_cache_duration(self):
-        if re.search('client\s+cache\s*=', self.spec):
-            cache = re.search('client\s+cache\s*=(.+)', self.spec).group(1)
-            cache_duration = {
-                'seconds': 0,
-                'minutes': 0,
-                'hours': 0,
-                'days': 0,
-            }
-            if 'seconds' in cache:
-                cache_duration['seconds'] = int(re.search('seconds\((.+)\)', cache).group(1))
-            if 'minutes' in cache:
-                cache_duration['minutes'] = int(re.search('minutes\((.+)\)', cache).group(1))
-            if 'hours' in cache:
-                cache_duration['hours'] = int(re.search('hours\((.+)\)', cache).group(1))
-            if 'days' in cache:
-                cache_duration['days'] = int(re.search('days\((.+)\)', cache).group(1))
-            if 'years' in cache:
-                cache_duration['days'] += int(re.search('years\((.+)\)', cache).group(1)) * 365
+        if self.spec.cache:
             return 'const Duration(days: {days}, hours: {hours}, minutes: {minutes}, seconds: {seconds})'.format(
-                **cache_duration)
+                **self.spec.cache)
 
     def get_spec_fields_and_cache_class(self):
         common_fields = []
@@ -75,20 +58,11 @@ class MessagesGenerator:
         if client_cache:
             common_fields.append('final Duration cache = {};'.format(client_cache))
 
-        if re.search('client\s+cache_keys\s*=', self.spec):
-            cache_keys = re.search('client\s+cache_keys\s*=(.+)', self.spec).group(1)
-
-            def find_keys(key_type: str):
-                if re.search(f'{key_type}\((.+?)\)', cache_keys):
-                    return re.findall('\'(.+?)\'', re.search(f'{key_type}\((.+?)\)', cache_keys).group(1))
-                return []
-
-            text_keys = find_keys('text')
-            real_keys = find_keys('real')
-            date_keys = find_keys('date')
-            int_keys = find_keys('int')
-
-
+        if self.spec.cache_keys:
+            text_keys = self.spec.cache_keys.get('text', [])
+            real_keys = self.spec.cache_keys.get('real', [])
+            date_keys = self.spec.cache_keys.get('date', [])
+            int_keys = self.spec.cache_keys.get('int', [])
 
             if text_keys or real_keys or date_keys or int_keys:
                 text_keys = [to_camel_case(k) for k in text_keys]
@@ -147,11 +121,7 @@ class MessagesGenerator:
         return common_fields, rx_fields, tx_fields, cache_class
 
     def is_auth_required(self):
-        auth = re.search('auth\s*=\s*(.+)\s*', self.spec)
-        if auth:
-            return auth.group(1)
-        else:
-            return 'true'
+        return 'true' if self.spec.auth else 'false'
 
     def get_client_message(self) -> str:
         common_fields, rx_fields, tx_fields, cache_class = self.get_spec_fields_and_cache_class()
@@ -159,6 +129,7 @@ class MessagesGenerator:
             return cache_class + '\n\n' + templates.tx_message_class.format(
                 prefix=self.get_client_prefix(),
                 type=self.get_type(),
+                type_id=self.spec.id,
                 proto=self.proto,
                 auth=self.is_auth_required(),
                 fields='\n  '.join(common_fields + tx_fields),
@@ -167,6 +138,8 @@ class MessagesGenerator:
             return cache_class + '\n\n' + templates.rx_message_class.format(
                 prefix=self.get_client_prefix(),
                 type=self.get_type(),
+                type_id=self.spec.id,
+                full_name=self.full_name,
                 table_type=f'<{self.get_client_prefix()}{self.proto}Table>' if cache_class else '',
                 proto=self.proto,
                 fields='\n  '.join(common_fields + rx_fields),
@@ -180,15 +153,13 @@ class MessagesGenerator:
         return hash(self.proto)
 
     def __str__(self):
-        return self.proto + ' (' + self.path + ')'
+        return str(self.spec)
 
 
-def generate(protos: List[str]):
-    generators = []
-    for f in protos:
-        proto_content = open(f, 'r', encoding='utf-8').read()
-        generators += [MessagesGenerator(f, i[0], i[1]) for i in get_psd_messages(proto_content)]
-    generators = list(set(generators))
+def generate(protos: List[str], out='./lib', ids_path=None):
+    schema = read_schema(protos, ids_path)
+    types = read_types(protos)
+    generators = list(set(MessagesGenerator(spec, types.get_full_name(spec)) for spec in schema.messages))
     generators.sort(key=lambda g: f'{g.package}_{g.proto}')
 
     imports = set()
@@ -199,23 +170,28 @@ def generate(protos: List[str]):
     imports.add("import 'package:drift/drift.dart';")
     imports.update(set([i.get_import() for i in generators]))
 
-    with open('./lib/messages.dart', 'w', encoding='utf-8') as f:
+    with open(os.path.join(out, 'messages.dart'), 'w', encoding='utf-8') as f:
         f.write('\n'.join(sorted(imports)))
 
         rx_classnames = []
         for generator in generators:
-            try:
-                f.write(generator.get_client_message())
-                if not generator.origin_is_client():
-                    rx_classnames.append(generator.get_client_message_classname())
-            except IndexError as e:
-                print('Syntax error:', generator)
-                print(e)
+            f.write(generator.get_client_message())
+            if not generator.origin_is_client():
+                rx_classnames.append(generator.get_client_message_classname())
         f.write('''
 
         List<SocketRxMessage> rxMessages = [
           %s
         ];''' % ',\n  '.join(['{}()'.format(i) for i in rx_classnames]))
+        f.write('''
+
+        // numeric message type ids (see message_ids.lock), by origin
+        const Map<String, int> clientMessageTypeIds = {%s};
+        const Map<String, int> serverMessageTypeIds = {%s};''' % (
+            ', '.join("'{}': {}".format(t, id) for t, id in schema.ids.by_origin('client').items()),
+            ', '.join("'{}': {}".format(t, id) for t, id in schema.ids.by_origin('server').items()),
+        ))
+        f.write(templates.compact_decoder % format_compact_fields(types, schema))
 
 
 if __name__ == '__main__':
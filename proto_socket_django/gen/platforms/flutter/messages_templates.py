@@ -16,18 +16,24 @@ class {prefix}{proto}CacheKeys extends CacheKeys {{
 
 rx_message_class = '''class Rx{proto} extends SocketRxMessage{table_type} {{
   static const String type = '{type}';
+  static const int typeId = {type_id};
   final {proto} data = {proto}();
   {fields}
 
   Rx{proto}([SocketRxMessageData? message]) : super(type, message);
 
   @override
-  Rx{proto} fromMessage(SocketRxMessageData message) => Rx{proto}(message);{table}
+  Rx{proto} fromMessage(SocketRxMessageData message) => Rx{proto}(message);
+
+  static const String protoName = '{full_name}';
+
+  dynamic expandBody(dynamic body) => expandCompact(protoName, body);{table}
 }}
 '''
 
 tx_message_class = '''class Tx{proto} extends SocketTxMessage {{
   static const String type = '{type}';
+  static const int typeId = {type_id};
   final {proto} proto;
   {fields}
 
@@ -38,3 +44,38 @@ tx_message_class = '''class Tx{proto} extends SocketTxMessage {{
   static Tx{proto} create([{proto} Function({proto} data)? setData]) => Tx{proto}((setData ?? (p) => p)(Tx{proto}.newProto));
 }}
 '''
+
+
+compact_decoder = '''
+
+// field tables of the compact encoding (compactBodies header): field number -> [json name, message, is map]
+const Map<String, Map<String, List<Object>>> compactFields = {%s};
+
+final _compactKey = RegExp(r'^\\d');
+
+/// Expands a body keyed by field numbers to the json names, other bodies are returned as they are.
+dynamic expandCompact(String message, dynamic body) {
+  final fields = compactFields[message];
+  if (fields == null || body is! Map || body.isEmpty || !_compactKey.hasMatch(body.keys.first as String)) {
+    return body;
+  }
+  final expanded = <String, dynamic>{};
+  body.forEach((key, value) {
+    final field = fields[key];
+    if (field == null) {
+      return;
+    }
+    if (field.length > 1 && value != null) {
+      final type = field[1] as String;
+      if (field.length > 2) {
+        value = (value as Map).map((k, v) => MapEntry(k, expandCompact(type, v)));
+      } else if (value is List) {
+        value = value.map((v) => expandCompact(type, v)).toList();
+      } else {
+        value = expandCompact(type, value);
+      }
+    }
+    expanded[field[0] as String] = value;
+  });
+  return expanded;
+}'''
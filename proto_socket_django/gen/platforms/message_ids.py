@@ -0,0 +1,52 @@
+import json
+import os
+from typing import Dict, Optional
+
+
+class MessageIds:
+    """
+    Stable numeric ids of message types (per origin, since a client and a server message may share a type), kept
+    in a lock file shared by all platforms. Ids of removed messages are never reused.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.next = 1
+        self.ids: Dict[str, int] = {}
+        if path and os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                lock = json.load(f)
+            self.next = lock['next']
+            self.ids = lock['ids']
+
+    @staticmethod
+    def key(origin: str, type: str) -> str:
+        return '{}:{}'.format(origin, type)
+
+    def assign(self, messages) -> bool:
+        """
+        Sets the id of each MessageSpec, assigning new ids to new types. Returns whether new ids were assigned.
+        """
+        changed = False
+        for message in messages:
+            key = self.key(message.origin, message.type)
+            if key not in self.ids:
+                self.ids[key] = self.next
+                self.next += 1
+                changed = True
+            message.id = self.ids[key]
+        return changed
+
+    def by_origin(self, origin: str) -> Dict[str, int]:
+        prefix = origin + ':'
+        return {key[len(prefix):]: id for key, id in sorted(self.ids.items(), key=lambda i: i[1])
+                if key.startswith(prefix)}
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'next': self.next, 'ids': dict(sorted(self.ids.items(), key=lambda i: i[1]))}, f, indent=2)
+            f.write('\n')
+        os.replace(tmp_path, self.path)
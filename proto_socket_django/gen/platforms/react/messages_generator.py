@@ -2,57 +2,39 @@ import argparse
 import json
 import os
 import sys
-import re
-from pathlib import Path
 from typing import List
 from proto_socket_django.gen.platforms.react import messages_templates as templates
-from proto_socket_django.gen.platforms import get_psd_messages
+from proto_socket_django.gen.platforms import read_schema, read_types, format_compact_fields
+from proto_socket_django.gen.platforms.schema import MessageSpec
 
 
 class MessagesGenerator:
-    def __init__(self, path, spec, proto):
-        self.path = path
-        self.proto = proto.strip()
-        self.spec = spec.strip()
-        self.spec_items = [i.strip() for i in self.spec.split('\n') if i.strip()]
-        self.package = Path(self.path).stem
+    def __init__(self, spec: MessageSpec, full_name: str):
+        self.spec = spec
+        self.full_name = full_name
+        self.path = spec.path
+        self.proto = spec.proto
+        self.package = spec.package
 
     def get_type(self):
-        return re.search('type.+=.+\'(.+)\'', self.spec).group(1)
+        return self.spec.type
 
     def get_client_prefix(self):
-        if 'client' in re.search('origin.+=(.+)', self.spec).group(1):
+        if self.spec.origin_is_client:
             return 'Tx'
         else:
             return 'Rx'
 
     def origin_is_client(self):
-        return 'client' in re.search('origin.+=(.+)', self.spec).group(1)
+        return self.spec.origin_is_client
 
     def get_client_message_classname(self):
         return self.get_client_prefix() + self.proto
 
     def get_client_cache_duration(self):
-        if re.search('client\s+cache\s*=', self.spec):
-            cache = re.search('client\s+cache\s*=(.+)', self.spec).group(1)
-            cache_duration = {
-                'seconds': 0,
-                'minutes': 0,
-                'hours': 0,
-                'days': 0,
-            }
-            if 'seconds' in cache:
-                cache_duration['seconds'] = int(re.search('seconds\((.+)\)', cache).group(1))
-            if 'minutes' in cache:
-                cache_duration['minutes'] = int(re.search('minutes\((.+)\)', cache).group(1))
-            if 'hours' in cache:
-                cache_duration['hours'] = int(re.search('hours\((.+)\)', cache).group(1))
-            if 'days' in cache:
-                cache_duration['days'] = int(re.search('days\((.+)\)', cache).group(1))
-            if 'years' in cache:
-                cache_duration['days'] += int(re.search('years\((.+)\)', cache).group(1)) * 365
+        if self.spec.cache:
             return 'const Duration(days: {days}, hours: {hours}, minutes: {minutes}, seconds: {seconds})'.format(
-                **cache_duration)
+                **self.spec.cache)
 
     def get_spec_fields_and_cache_class(self):
         common_fields = []
@@ -62,11 +44,7 @@ class MessagesGenerator:
         return common_fields, rx_fields, tx_fields, ''
 
     def is_auth_required(self):
-        auth = re.search('auth\s*=\s*(.+)\s*', self.spec)
-        if auth:
-            return auth.group(1)
-        else:
-            return 'true'
+        return 'true' if self.spec.auth else 'false'
 
     def get_client_message(self) -> str:
         common_fields, rx_fields, tx_fields, cache_class = self.get_spec_fields_and_cache_class()
@@ -74,6 +52,7 @@ class MessagesGenerator:
             return cache_class + '\n\n' + templates.tx_message_class.format(
                 prefix=self.get_client_prefix(),
                 type=self.get_type(),
+                type_id=self.spec.id,
                 proto=self.proto,
                 auth=self.is_auth_required(),
                 package=self.package,
@@ -83,6 +62,8 @@ class MessagesGenerator:
             return cache_class + '\n\n' + templates.rx_message_class.format(
                 prefix=self.get_client_prefix(),
                 type=self.get_type(),
+                type_id=self.spec.id,
+                full_name=self.full_name,
                 proto=self.proto,
                 package=self.package,
                 fields='\n  '.join(common_fields + rx_fields),
@@ -95,15 +76,13 @@ class MessagesGenerator:
         return hash(self.proto)
 
     def __str__(self):
-        return self.proto + ' (' + self.path + ')'
+        return str(self.spec)
 
 
-def generate(protos: List[str], is_proto_socket_module=False, proto_out='./src'):
-    generators = []
-    for f in protos:
-        proto_content = open(f, 'r', encoding='utf-8').read()
-        generators += [MessagesGenerator(f, i[0], i[1]) for i in get_psd_messages(proto_content)]
-    generators = list(set(generators))
+def generate(protos: List[str], is_proto_socket_module=False, proto_out='./src', ids_path=None):
+    schema = read_schema(protos, ids_path)
+    types = read_types(protos)
+    generators = list(set(MessagesGenerator(spec, types.get_full_name(spec)) for spec in schema.messages))
     generators.sort(key=lambda g: f'{g.package}_{g.proto}')
 
     imports = set()
@@ -121,18 +100,23 @@ def generate(protos: List[str], is_proto_socket_module=False, proto_out='./src')
         f.write('\n\nexport namespace proto {')
         rx_classnames = []
         for generator in generators:
-            try:
-                f.write(generator.get_client_message())
-                if not generator.origin_is_client():
-                    rx_classnames.append(generator.get_client_message_classname())
-            except IndexError as e:
-                print('Syntax error:', generator)
-                print(e)
+            f.write(generator.get_client_message())
+            if not generator.origin_is_client():
+                rx_classnames.append(generator.get_client_message_classname())
         f.write('''
 
         export const rxMessages: SocketRxMessage<any>[] = [
             %s
         ];''' % ',\n    '.join(['new {}()'.format(i) for i in rx_classnames]))
+        f.write('''
+
+        // numeric message type ids (see message_ids.lock), by origin
+        export const clientMessageTypeIds: {[type: string]: number} = {%s};
+        export const serverMessageTypeIds: {[type: string]: number} = {%s};''' % (
+            ', '.join("'{}': {}".format(t, id) for t, id in schema.ids.by_origin('client').items()),
+            ', '.join("'{}': {}".format(t, id) for t, id in schema.ids.by_origin('server').items()),
+        ))
+        f.write(templates.compact_decoder % format_compact_fields(types, schema))
         f.write('\n}')
 
 
@@ -1,5 +1,6 @@
 rx_message_class = '''export class Rx{proto} extends SocketRxMessage<{package}.{proto}> {{
     static type: string = '{type}';
+    static typeId: number = {type_id};
     proto = {package}.{proto}.create({{}});
     protoClass = {package}.{proto};
     {fields}
@@ -7,7 +8,7 @@ rx_message_class = '''export class Rx{proto} extends SocketRxMessage<{package}.{
     constructor(message: SocketRxMessageData | null = null) {{
         super(Rx{proto}.type, message);
         if (message !== null) {{
-            this.proto = this.protoClass.fromObject(message.body);
+            this.proto = this.protoClass.fromObject(expandCompact('{full_name}', message.body));
         }}
     }}
 
@@ -19,6 +20,7 @@ rx_message_class = '''export class Rx{proto} extends SocketRxMessage<{package}.{
 
 tx_message_class = '''export class Tx{proto} extends SocketTxMessage<{package}.{proto}> {{
     static type: string = '{type}';
+    static typeId: number = {type_id};
     proto: {package}.{proto};
     protoClass = {package}.{proto};
     {fields}
@@ -32,4 +34,45 @@ tx_message_class = '''export class Tx{proto} extends SocketTxMessage<{package}.{
         return new Tx{proto}({package}.{proto}.create(properties));
     }}
 }}
-'''
\ No newline at end of file
+'''
+
+compact_decoder = '''
+
+// field tables of the compact encoding (compactBodies header): field number -> [json name, message, is map]
+const compactFields: {[message: string]: {[number: string]: [string, string?, number?]}} = {%s};
+
+// expands a body keyed by field numbers to the json names, other bodies are returned as they are
+export function expandCompact(message: string, body: any): any {
+    const fields = compactFields[message];
+    if (!fields || body === null || typeof body !== 'object') {
+        return body;
+    }
+    const keys = Object.keys(body);
+    if (keys.length === 0 || !/^\\d/.test(keys[0])) {
+        return body;
+    }
+    const expanded: any = {};
+    for (const key of keys) {
+        const field = fields[key];
+        if (field === undefined) {
+            continue;
+        }
+        let value = body[key];
+        const type = field[1];
+        if (type !== undefined && value !== null) {
+            if (field[2]) {
+                const map: any = {};
+                for (const k of Object.keys(value)) {
+                    map[k] = expandCompact(type, value[k]);
+                }
+                value = map;
+            } else if (Array.isArray(value)) {
+                value = value.map((v: any) => expandCompact(type, v));
+            } else {
+                value = expandCompact(type, value);
+            }
+        }
+        expanded[field[0]] = value;
+    }
+    return expanded;
+}'''
@@ -0,0 +1,340 @@
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import stringcase
+from betterproto import Casing, safe_snake_case
+
+from proto_socket_django.gen.jobs import GenerateError
+
+# proto source tokens - comments and strings are matched whole, so braces and keywords inside them are ignored.
+# Anything else is skipped by finditer (a spec comment must be followed by only whitespace and its message). No
+# prefix skipping the text between tokens - a nested repetition there backtracks exponentially after the last token.
+TOKENS = re.compile(r'''
+    (?P<block>/\*.*?\*/)
+   |(?P<comment>//[^\n]*)
+   |(?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+   |(?P<message>\bmessage\s+(?P<name>\w+))
+   |(?P<open>\{)
+   |(?P<close>\})
+''', re.S | re.X)
+
+# tokens of message/enum declarations and fields, for the field tables of the compact encoding (see ProtoTypes)
+TYPE_TOKENS = re.compile(r'''
+    (?P<block>/\*.*?\*/)
+   |(?P<comment>//[^\n]*)
+   |(?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+   |\bpackage\s+(?P<package>[\w.]+)\s*;
+   |\b(?P<scope>message|enum|oneof|service|extend)\s+(?P<scope_name>[\w.]+)\s*\{
+   |(?<![\w.])(?:(?:repeated|optional|required)\s+)?
+        (?P<type>map\s*<\s*\w+\s*,\s*(?P<map_value>\.?[\w.]+)\s*>|\.?[\w.]+)\s+(?P<field>\w+)\s*=\s*(?P<number>\d+)
+   |(?P<open>\{)
+   |(?P<close>\})
+''', re.S | re.X)
+
+SPEC_LINE = re.compile(r'^(client\s+)?(\w+)\s*=\s*(.*?)\s*;?$')
+QUOTED = re.compile(r'\'([^\']+)\'|"([^"]+)"')
+SPEC_KEYS = {'type', 'origin', 'auth', 'client cache', 'client cache_keys'}
+CACHE_UNITS = ('seconds', 'minutes', 'hours', 'days', 'years')
+CACHE_KEY_TYPES = ('text', 'real', 'date', 'int')
+
+
+class SpecError(GenerateError):
+    def __init__(self, errors: List[str]):
+        super().__init__('\n'.join(errors))
+        self.errors = errors
+
+
+class MessageSpec:
+    """
+    Transport spec of a message, from the comment directly above it:
+        /*
+        type = 'get-data'
+        origin = client
+        auth = false
+        client cache = minutes(5) seconds(30)
+        client cache_keys = text('name') int('count')
+         */
+        message GetData {
+    """
+
+    def __init__(self, path: str, package: str, line: int, proto: str):
+        self.path = path
+        self.line = line
+        self.proto = proto
+        self.package = package
+        self.type: Optional[str] = None
+        self.id: Optional[int] = None  # see MessageIds
+        self.origin: Optional[str] = None
+        self.auth = True
+        self.cache: Optional[Dict[str, int]] = None
+        self.cache_keys: Dict[str, List[str]] = {}
+
+    @property
+    def origin_is_client(self) -> bool:
+        return self.origin == 'client'
+
+    @property
+    def location(self) -> str:
+        return '{}:{}'.format(self.path, self.line)
+
+    def __str__(self):
+        return self.proto + ' (' + self.location + ')'
+
+
+class Schema:
+    """
+    Index of the specs of all protos, shared by the generators of all platforms.
+    """
+
+    def __init__(self, messages: List[MessageSpec]):
+        self.messages = sorted(messages, key=lambda m: f'{m.package}_{m.proto}')
+        self.ids: Optional['MessageIds'] = None
+        # a type may be used once per direction (eg. a client request and the server's response)
+        self.by_type: Dict[Tuple[str, str], MessageSpec] = {}
+        errors = []
+        for message in self.messages:
+            other = self.by_type.get((message.origin, message.type))
+            if other is not None:
+                errors.append('{}: duplicate {} type \'{}\' of {}, already used by {}'.format(
+                    message.location, message.origin, message.type, message.proto, other))
+                continue
+            self.by_type[(message.origin, message.type)] = message
+        if errors:
+            raise SpecError(errors)
+
+
+def parse_proto(path: str, content: str) -> List[MessageSpec]:
+    """
+    Returns the specs of the messages in the proto source, raises SpecError with all errors (path:line: error).
+    """
+    messages, errors = [], []
+    package = Path(path).stem
+    depth = 0
+    spec: Optional[Tuple[str, int, int]] = None  # last block comment (text, line, end), if no token followed it
+    line, last = 1, 0
+
+    for token in TOKENS.finditer(content):
+        kind = token.lastgroup
+        start = token.start(kind)
+        line += content.count('\n', last, start)
+        last = start
+
+        if kind == 'block':
+            spec = (token.group(kind), line, token.end())
+            continue
+        if kind == 'message' and spec is not None and not content[spec[2]:start].strip():
+            message = parse_spec(path, package, spec[0], spec[1], token.group('name'), errors)
+            # plain documentation of nested messages is fine
+            if message is not None and depth:
+                errors.append('{}:{}: specs of nested messages ({}) are not supported'.format(
+                    path, spec[1], token.group('name')))
+            elif message is not None:
+                messages.append(message)
+        elif kind == 'open':
+            depth += 1
+        elif kind == 'close':
+            depth -= 1
+        spec = None
+
+    if errors:
+        raise SpecError(errors)
+    return messages
+
+
+def parse_spec(path: str, package: str, comment: str, line: int, proto: str, errors: List[str]) -> Optional[MessageSpec]:
+    """
+    Parses the `key = value` lines of a spec comment. Comments without such lines are plain documentation.
+    """
+    message = MessageSpec(path, package, line, proto)
+    lines = []
+    for i, text in enumerate(comment[2:-2].split('\n')):
+        text = text.strip().lstrip('*').strip()
+        if text:
+            lines.append((line + i, text, SPEC_LINE.match(text)))
+    if not any(match for _, _, match in lines):
+        return None
+
+    def error(at: int, text: str):
+        errors.append('{}:{}: {} ({})'.format(path, at, text, proto))
+
+    n_errors = len(errors)
+    seen = set()
+    for at, text, match in lines:
+        if not match:
+            error(at, 'expected `key = value`, got `{}`'.format(text))
+            continue
+        key = ('client ' if match.group(1) else '') + match.group(2)
+        value = match.group(3)
+        if key not in SPEC_KEYS:
+            error(at, 'unknown key `{}`'.format(key))
+        elif key in seen:
+            error(at, 'duplicate key `{}`'.format(key))
+        elif key == 'type':
+            quoted = QUOTED.fullmatch(value)
+            if quoted:
+                message.type = quoted.group(1) or quoted.group(2)
+            else:
+                error(at, 'type must be a quoted string, got `{}`'.format(value))
+        elif key == 'origin':
+            if value in ('client', 'server'):
+                message.origin = value
+            else:
+                error(at, 'origin must be client or server, got `{}`'.format(value))
+        elif key == 'auth':
+            if value.lower() in ('true', 'false'):
+                message.auth = value.lower() == 'true'
+            else:
+                error(at, 'auth must be true or false, got `{}`'.format(value))
+        elif key == 'client cache':
+            cache = parse_calls(value, CACHE_UNITS, r'\s*\d+\s*')
+            if cache is None:
+                error(at, 'client cache must be like `minutes(5) seconds(30)` ({}), got `{}`'.format(
+                    ', '.join(CACHE_UNITS), value))
+            else:
+                message.cache = {unit: 0 for unit in ('seconds', 'minutes', 'hours', 'days')}
+                for unit, amount in cache:
+                    if unit == 'years':
+                        message.cache['days'] += int(amount) * 365
+                    else:
+                        message.cache[unit] += int(amount)
+        elif key == 'client cache_keys':
+            keys = parse_calls(value, CACHE_KEY_TYPES, r'\s*(?:\'[^\']+\'\s*,\s*)*\'[^\']+\'\s*')
+            if keys is None:
+                error(at, 'client cache_keys must be like `text(\'name\') int(\'count\')` ({}), got `{}`'.format(
+                    ', '.join(CACHE_KEY_TYPES), value))
+            else:
+                for key_type, args in keys:
+                    message.cache_keys.setdefault(key_type, []).extend(re.findall(r'\'([^\']+)\'', args))
+        seen.add(key)
+
+    for key in ('type', 'origin'):
+        if key not in seen:
+            error(line, 'missing `{}`'.format(key))
+    return message if len(errors) == n_errors else None
+
+
+def parse_calls(value: str, names: Tuple[str, ...], args: str) -> Optional[List[Tuple[str, str]]]:
+    """
+    Parses `name(args) name(args) ...`, None if value isn't exactly that.
+    """
+    call = r'({})\(({})\)'.format('|'.join(names), args)
+    if not re.fullmatch(r'(?:\s*{}\s*)+'.format(call), value):
+        return None
+    return re.findall(call, value)
+
+
+class ProtoTypes:
+    """
+    Messages and fields of all protos by full name (eg. `demo.Item.Nested`), for the field tables of the compact
+    encoding - decoders map field numbers back to the json names of to_dict().
+    """
+
+    def __init__(self):
+        self.packages: Dict[str, str] = {}  # proto path -> package
+        self.declared: Dict[str, List[str]] = {}  # proto path -> full names of its messages and enums
+        # full name -> [(json name, number, type, is map, scope)]
+        self.messages: Dict[str, List[Tuple[str, int, str, bool, str]]] = {}
+        self.enums: Set[str] = set()
+
+    def add(self, path: str, parsed: Tuple[str, dict, Set[str]]):
+        package, messages, enums = parsed
+        self.packages[path] = package
+        self.declared[path] = list(messages) + sorted(enums)
+        self.messages.update(messages)
+        self.enums.update(enums)
+
+    def get_class_names(self, path: str) -> List[str]:
+        """
+        Python class names betterproto generates for the messages and enums of a proto - nested ones are flattened
+        (`Item.Nested` -> ItemNested).
+        """
+        package = self.packages[path]
+        prefix = package + '.' if package else ''
+        return [stringcase.pascalcase(name[len(prefix):].replace('.', '')) for name in self.declared[path]]
+
+    def get_full_name(self, spec: MessageSpec) -> str:
+        package = self.packages.get(spec.path)
+        return package + '.' + spec.proto if package else spec.proto
+
+    def resolve(self, ref: str, scope: str) -> Optional[str]:
+        """
+        Full name of the message a field type refers to (searching the enclosing scopes like protoc), None for
+        scalars, enums and types of protos that weren't parsed (eg. google.protobuf).
+        """
+        if ref.startswith('.'):
+            candidates = [ref[1:]]
+        else:
+            parts = scope.split('.') if scope else []
+            candidates = ['.'.join(parts[:i] + [ref]) for i in range(len(parts), -1, -1)]
+        for candidate in candidates:
+            if candidate in self.messages:
+                return candidate
+            if candidate in self.enums:
+                return None
+        return None
+
+    def get_compact_fields(self, roots: List[str]) -> Dict[str, Dict[int, tuple]]:
+        """
+        Field tables of the roots and the messages they contain: number -> (json name,) or (json name, message)
+        or (json name, message, 1) for maps of messages.
+        """
+        tables = {}
+        pending = [r for r in roots if r in self.messages]
+        while pending:
+            name = pending.pop()
+            if name in tables:
+                continue
+            table = tables[name] = {}
+            for json_name, number, type, is_map, scope in self.messages[name]:
+                message = self.resolve(type, scope)
+                if message is None:
+                    table[number] = (json_name,)
+                else:
+                    table[number] = (json_name, message, 1) if is_map else (json_name, message)
+                    pending.append(message)
+        return dict(sorted(tables.items()))
+
+
+def parse_types(path: str, content: str) -> Tuple[str, Dict[str, list], Set[str]]:
+    """
+    Returns the package, fields of each message (see ProtoTypes.messages) and enums of a proto source.
+    """
+    package = ''
+    messages: Dict[str, list] = {}
+    enums: Set[str] = set()
+    scopes: List[Tuple[str, str]] = []  # (kind, full name) of the enclosing blocks
+
+    def message_scope() -> Optional[str]:
+        for kind, name in reversed(scopes):
+            if kind == 'message':
+                return name
+            if kind != 'oneof':
+                return None
+        return None
+
+    for token in TYPE_TOKENS.finditer(content):
+        if token.group('package'):
+            package = token.group('package')
+        elif token.group('scope'):
+            kind, name = token.group('scope'), token.group('scope_name')
+            parent = message_scope() if scopes else package
+            if kind in ('message', 'enum'):
+                name = parent + '.' + name if parent else name
+                if kind == 'message':
+                    messages[name] = []
+                else:
+                    enums.add(name)
+            scopes.append((kind, name))
+        elif token.group('field'):
+            message = message_scope()
+            if message is not None and token.group('type') != 'option':
+                value_type = token.group('map_value')
+                messages[message].append((Casing.CAMEL(safe_snake_case(token.group('field'))).rstrip('_'),
+                                          int(token.group('number')), value_type or token.group('type'),
+                                          value_type is not None, message))
+        elif token.group('open'):
+            scopes.append(('block', ''))
+        elif token.group('close') and scopes:
+            scopes.pop()
+    return package, messages, enums
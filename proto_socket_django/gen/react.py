@@ -1,24 +1,52 @@
 import os
-import subprocess
 import sys
 import json
-from . import get_protos, delete_existing
+from . import get_protos, get_message_ids_path
+from .jobs import Jobs, Timings, GenerateError
+from .manifest import Manifest
 from .platforms.react.messages_generator import generate
 
 
-def main():
+def run(config: dict, check=False, timings: Timings = None) -> int:
+    timings = timings or Timings()
+    proto_out = config.get('out', 'src/proto')
+    with timings.stage('react', 'plan'):
+        proto_path, protos = get_protos(config, '-p')
+        manifest = Manifest(proto_out, 'react', protos, config)
+        if check:
+            return manifest.report_check()
+        changed = manifest.plan()
+    if not changed:
+        print(f'{proto_out} is up to date')
+        return 0
+
+    # pbjs compiles all protos into a single module, so any change rebuilds it (unchanged files are not rewritten)
+    staging = manifest.staging()
+    try:
+        with timings.stage('react', 'messages'):
+            generate(protos, config.get('proto-socket-module', False), staging, get_message_ids_path(config))
+        with timings.stage('react', 'pbjs'):
+            Jobs.run([f'pbjs {proto_path} -t static-module -w es6 -o {staging}/compiled.js {" ".join(protos)}'],
+                     'pbjs')
+            Jobs.run([f'pbts -o {staging}/compiled.d.ts {staging}/compiled.js'], 'pbts')
+    except GenerateError:
+        manifest.discard(staging)
+        raise
+    with timings.stage('react', 'sync'):
+        manifest.sync(staging)
+    return 0
+
+
+def main(check=False):
     if not os.path.isfile('fps_config.json') or not os.path.isfile('package.json'):
         print('Run the command from react project root, containing fps_config.json and package.json.')
         sys.exit(1)
 
-    config = json.load(open('fps_config.json'))
-    proto_out = config.get('out', 'src/proto')
-    delete_existing(proto_out)
-    proto_path, protos = get_protos(config, '-p')
-    subprocess.run(f'pbjs {proto_path} -t static-module -w es6 -o {proto_out}/compiled.js {" ".join(protos)}',
-                   shell=True)
-    subprocess.run(f'pbts -o {proto_out}/compiled.d.ts {proto_out}/compiled.js', shell=True)
-    generate(protos, config.get('proto-socket-module', False), proto_out)
+    try:
+        sys.exit(run(json.load(open('fps_config.json')), check))
+    except GenerateError as e:
+        print(e)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,513 @@
+import asyncio
+import hashlib
+import os
+import socket
+import stat
+import struct
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+
+class LocalChannel:
+    __slots__ = ('messages', 'capacity', 'groups', 'waiter', 'last_used')
+
+    def __init__(self, capacity: int):
+        self.messages: Deque[dict] = deque()
+        self.capacity = capacity
+        self.groups: Set[str] = set()
+        self.waiter: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = None
+        self.last_used = time.monotonic()
+
+
+def _wake(futures: List[asyncio.Future]):
+    for future in futures:
+        if not future.done():
+            future.set_result(None)
+
+
+class HostChannelLayer(BaseChannelLayer):
+    """
+    Channel layer for several worker processes on one host, without a server. Each process listens on a unix socket
+    in `path` and connects to the others. Group membership is kept by the process that owns the channel, so
+    group_send delivers to local members directly and sends one batch per process for the rest. Sends from all
+    threads and event loops are batched on the layer's own I/O thread - group_send never waits for the network.
+
+    Across hosts, `remote` (another channel layer config, eg. channels_redis) relays groups and specific channels of
+    other hosts; normal (non `!`) channels are only delivered in-process without it.
+
+        CHANNEL_LAYERS = {'default': {
+            'BACKEND': 'proto_socket_django.layers.HostChannelLayer',
+            'CONFIG': {'path': '/run/psd', 'remote': {'BACKEND': 'channels_redis.core.RedisChannelLayer', ...}},
+        }}
+
+    Messages are msgpack encoded between processes, so they may only contain the types of ASGI messages. The socket
+    dir must be owned by the user and not accessible to others (0700), the layer refuses to start otherwise. Events of
+    a group are shared by its members in a process, so consumers must not modify them. Sends to a full channel raise
+    ChannelFull (group members that are full miss the message, like with the other layers); sends to a full channel
+    of another process are dropped there. Frames for a process that isn't connected yet wait until it is (or the
+    connection fails); a process that starts while a group message is sent misses it - its consumers haven't joined
+    groups yet.
+    """
+    extensions = ['groups', 'flush']
+    scan_interval = 1.0
+
+    def __init__(self, path: Optional[str] = None, host: Optional[str] = None, remote: Optional[dict] = None,
+                 expiry=60, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.path = path or os.path.join(tempfile.gettempdir(), 'psd-layer-{}'.format(os.getuid()))
+        self.host = hashlib.sha1((host or socket.gethostname()).encode()).hexdigest()[:8]
+        self.remote_config = remote
+        self.remote: Optional[BaseChannelLayer] = None
+        self.lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.channels: Dict[str, LocalChannel] = {}
+        self.groups: Dict[str, Set[str]] = {}
+        self.pid: Optional[int] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.server = None
+        self.peers: Dict[int, asyncio.StreamWriter] = {}
+        self.connecting: Set[int] = set()
+        self.last_scan = 0.0
+        self.outbox: List[tuple] = []  # for all processes
+        self.direct: Dict[int, List[tuple]] = {}  # by pid
+        self.waiting: Dict[int, List[bytes]] = {}  # frames for processes that are being connected to, by pid
+        self.flush_scheduled = False
+
+    @property
+    def process(self) -> str:
+        return '{}x{}'.format(self.pid or os.getpid(), self.host)
+
+    @property
+    def socket_path(self) -> str:
+        return os.path.join(self.path, '{}.sock'.format(self.pid))
+
+    @property
+    def relay_channel(self) -> str:
+        return 'psd-relay.' + self.process
+
+    def parse_channel(self, channel: str) -> Tuple[Optional[str], Optional[int]]:
+        """
+        Host hash and pid of a specific channel created by a HostChannelLayer, (None, None) for other channels.
+        """
+        if '!' not in channel:
+            return None, None
+        process = channel[:channel.index('!')].rsplit('.', 1)[-1]
+        pid, _, host = process.partition('x')
+        if not pid.isdigit() or not host:
+            return None, None
+        return host, int(pid)
+
+    # I/O thread
+
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            # (re)start after fork - the parent's thread and sockets don't exist in this process
+            self.check_path()
+            self.pid = os.getpid()
+            self.peers = {}
+            self.connecting = set()
+            self.waiting = {}
+            ready = threading.Event()
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self.run_io, args=(ready,), daemon=True, name='psd-layer').start()
+            ready.wait(5)
+
+    def check_path(self):
+        """
+        Creates the socket dir, raises if other users could place sockets in it or connect to the ones in it.
+        """
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        info = os.lstat(self.path)
+        if not stat.S_ISDIR(info.st_mode):
+            raise RuntimeError('HostChannelLayer: {} is not a directory'.format(self.path))
+        if info.st_uid != os.getuid():
+            raise RuntimeError('HostChannelLayer: {} is owned by another user (uid {})'.format(
+                self.path, info.st_uid))
+        if stat.S_IMODE(info.st_mode) != 0o700:
+            raise RuntimeError('HostChannelLayer: {} must have mode 0700, not {:04o}'.format(
+                self.path, stat.S_IMODE(info.st_mode)))
+
+    def run_io(self, ready: threading.Event):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.open(ready))
+        self.loop.run_forever()
+
+    async def open(self, ready: threading.Event):
+        try:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.server = await asyncio.start_unix_server(self.accept, self.socket_path)
+            # connect to the running processes right away, so they know about this one before its consumers join
+            # groups
+            await asyncio.gather(*[self.connect(pid) for pid in self.scan()])
+            if self.remote_config:
+                from django.utils.module_loading import import_string
+                self.remote = import_string(self.remote_config['BACKEND'])(**self.remote_config.get('CONFIG', {}))
+                self.loop.create_task(self.relay())
+            self.loop.create_task(self.expire())
+        except Exception:
+            traceback.print_exc()
+        finally:
+            ready.set()
+
+    def scan(self) -> List[int]:
+        self.last_scan = time.monotonic()
+        pids = []
+        for entry in os.scandir(self.path):
+            name = entry.name
+            if name.endswith('.sock') and name[:-5].isdigit():
+                pid = int(name[:-5])
+                if pid != self.pid and pid not in self.peers and pid not in self.connecting:
+                    pids.append(pid)
+        return pids
+
+    async def connect(self, pid: int):
+        self.connecting.add(pid)
+        try:
+            reader, writer = await asyncio.open_unix_connection(os.path.join(self.path, '{}.sock'.format(pid)))
+        except OSError:
+            if not pid_exists(pid):
+                try:
+                    os.unlink(os.path.join(self.path, '{}.sock'.format(pid)))
+                except OSError:
+                    pass
+            if pid not in self.peers:
+                self.waiting.pop(pid, None)
+            return
+        finally:
+            self.connecting.discard(pid)
+        writer.write(struct.pack('>I', self.pid))
+        self.add_peer(pid, reader, writer)
+
+    async def accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            pid, = struct.unpack('>I', await reader.readexactly(4))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        self.add_peer(pid, reader, writer)
+
+    def add_peer(self, pid: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # both processes may connect at once - either connection works, the other one is only read
+        if self.peers.setdefault(pid, writer) is writer:
+            for frame in self.waiting.pop(pid, ()):
+                writer.write(frame)
+        self.loop.create_task(self.read(pid, reader, writer))
+
+    async def read(self, pid: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                size, = struct.unpack('>I', await reader.readexactly(4))
+                self.deliver_batch(msgpack.unpackb(await reader.readexactly(size), raw=False))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            traceback.print_exc()
+        finally:
+            if self.peers.get(pid) is writer:
+                del self.peers[pid]
+            writer.close()
+
+    def enqueue(self, pid: Optional[int], item: tuple):
+        """
+        Queues the item for the process (all processes if pid is None) - items queued until the I/O thread gets to
+        them are sent as one batch.
+        """
+        with self.lock:
+            if pid is None:
+                self.outbox.append(item)
+            else:
+                self.direct.setdefault(pid, []).append(item)
+            scheduled, self.flush_scheduled = self.flush_scheduled, True
+        if not scheduled:
+            self.loop.call_soon_threadsafe(self.flush_outbox)
+
+    def flush_outbox(self):
+        with self.lock:
+            self.flush_scheduled = False
+            outbox, self.outbox = self.outbox, []
+            direct, self.direct = self.direct, {}
+        if time.monotonic() - self.last_scan > self.scan_interval:
+            for pid in self.scan():
+                self.loop.create_task(self.connect(pid))
+        if outbox:
+            # group messages go to every process, each delivers to its own members - encoded once per batch
+            frame = self.frame(outbox)
+            for writer in list(self.peers.values()):
+                writer.write(frame)
+            for pid in self.connecting:
+                self.waiting.setdefault(pid, []).append(frame)
+        for pid, items in direct.items():
+            writer = self.peers.get(pid)
+            if writer is not None:
+                writer.write(self.frame(items))
+                continue
+            # eg. a channel of a process that just started
+            self.waiting.setdefault(pid, []).append(self.frame(items))
+            if pid not in self.connecting:
+                self.connecting.add(pid)
+                self.loop.create_task(self.connect(pid))
+
+    @staticmethod
+    def frame(items: List[tuple]) -> bytes:
+        data = msgpack.packb(items, use_bin_type=True)
+        return struct.pack('>I', len(data)) + data
+
+    async def expire(self):
+        """
+        Channels with messages nobody received for `expiry` seconds are removed from their groups (their consumer is
+        gone, like the message expiry of the other layers). Idle channels without groups are dropped.
+        """
+        while True:
+            await asyncio.sleep(self.expiry)
+            deadline = time.monotonic() - self.expiry
+            with self.lock:
+                for name, channel in list(self.channels.items()):
+                    if channel.waiter is not None or channel.last_used >= deadline:
+                        continue
+                    if channel.messages:
+                        for group in list(channel.groups):
+                            self.discard_local(group, name)
+                    if not channel.groups:
+                        del self.channels[name]
+
+    # remote relay
+
+    async def relay(self):
+        while True:
+            try:
+                message = await self.remote.receive(self.relay_channel)
+                if message['host'] == self.host:
+                    continue  # already delivered on this host
+                self.deliver_batch([(message['kind'], message['target'], message['message'])])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+                await asyncio.sleep(1)
+
+    def call_remote(self, method: str, *args):
+        asyncio.run_coroutine_threadsafe(getattr(self.remote, method)(*args), self.loop)
+
+    def relay_message(self, kind: str, target: str, message: dict) -> dict:
+        return {'type': 'psd.relay', 'host': self.host, 'kind': kind, 'target': target, 'message': message}
+
+    # local delivery
+
+    def deliver_batch(self, items: List[tuple]):
+        waiters: Dict[asyncio.AbstractEventLoop, List[asyncio.Future]] = {}
+        with self.lock:
+            for kind, target, message in items:
+                if kind == 'group':
+                    for name in self.groups.get(target, ()):
+                        self.deliver(name, message, waiters)
+                elif kind == 'send':
+                    if not self.deliver(target, message, waiters, create=True):
+                        print('HostChannelLayer: channel {} is full, message dropped'.format(target))
+                elif kind == 'add':
+                    self.add_local(target, message)
+                elif kind == 'discard':
+                    self.discard_local(target, message)
+        self.wake(waiters)
+
+    def deliver(self, name: str, message: dict, waiters: Dict[asyncio.AbstractEventLoop, List[asyncio.Future]],
+                create: bool = False) -> bool:
+        # called with self.lock held, False if the channel doesn't exist (and create is False) or is full
+        channel = self.channels.get(name)
+        if channel is None:
+            if not create:
+                return False
+            channel = self.channels[name] = LocalChannel(self.get_capacity(name))
+        if len(channel.messages) >= channel.capacity:
+            return False
+        channel.messages.append(message)
+        if channel.waiter is not None:
+            loop, future = channel.waiter
+            channel.waiter = None
+            waiters.setdefault(loop, []).append(future)
+        return True
+
+    @staticmethod
+    def wake(waiters: Dict[asyncio.AbstractEventLoop, List[asyncio.Future]]):
+        # one wakeup per event loop, not per channel
+        for loop, futures in waiters.items():
+            try:
+                loop.call_soon_threadsafe(_wake, futures)
+            except RuntimeError:
+                pass  # loop closed
+
+    def add_local(self, group: str, channel: str):
+        members = self.groups.setdefault(group, set())
+        if not members and self.remote is not None:
+            self.call_remote('group_add', group, self.relay_channel)
+        members.add(channel)
+        local = self.channels.get(channel)
+        if local is None:
+            local = self.channels[channel] = LocalChannel(self.get_capacity(channel))
+        local.groups.add(group)
+
+    def discard_local(self, group: str, channel: str):
+        members = self.groups.get(group)
+        if members is None:
+            return
+        members.discard(channel)
+        local = self.channels.get(channel)
+        if local is not None:
+            local.groups.discard(group)
+        if not members:
+            del self.groups[group]
+            if self.remote is not None:
+                self.call_remote('group_discard', group, self.relay_channel)
+
+    # sync API (any thread, no event loop needed)
+
+    def send_nowait(self, channel: str, message: dict):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        self.start()
+        host, pid = self.parse_channel(channel)
+        if pid is None or (host == self.host and pid == self.pid):
+            waiters = {}
+            with self.lock:
+                delivered = self.deliver(channel, message, waiters, create=True)
+            self.wake(waiters)
+            if not delivered:
+                raise ChannelFull(channel)
+        elif host == self.host:
+            self.enqueue(pid, ('send', channel, message))
+        elif self.remote is not None:
+            self.call_remote('send', 'psd-relay.{}x{}'.format(pid, host), self.relay_message('send', channel, message))
+
+    def group_send_nowait(self, group: str, message: dict):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        self.start()
+        waiters = {}
+        with self.lock:
+            for name in self.groups.get(group, ()):
+                self.deliver(name, message, waiters)
+        self.wake(waiters)
+        self.enqueue(None, ('group', group, message))
+        if self.remote is not None:
+            self.call_remote('group_send', group, self.relay_message('group', group, message))
+
+    def group_add_nowait(self, group: str, channel: str):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        self.start()
+        self.membership('add', group, channel)
+
+    def group_discard_nowait(self, group: str, channel: str):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        self.start()
+        self.membership('discard', group, channel)
+
+    def membership(self, kind: str, group: str, channel: str):
+        host, pid = self.parse_channel(channel)
+        if pid is not None and pid != self.pid and host == self.host:
+            # the owning process keeps the membership
+            self.enqueue(pid, (kind, group, channel))
+            return
+        with self.lock:
+            if kind == 'add':
+                self.add_local(group, channel)
+            else:
+                self.discard_local(group, channel)
+
+    # channel layer API
+
+    async def send(self, channel, message):
+        if '!' not in channel and self.remote is not None:
+            self.start()
+            await self.remote.send(channel, message)
+            return
+        self.send_nowait(channel, message)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        self.start()
+        if '!' not in channel and self.remote is not None:
+            return await self.remote.receive(channel)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.lock:
+                local = self.channels.get(channel)
+                if local is None:
+                    local = self.channels[channel] = LocalChannel(self.get_capacity(channel))
+                local.last_used = time.monotonic()
+                if local.messages:
+                    return local.messages.popleft()
+                future = loop.create_future()
+                local.waiter = (loop, future)
+            try:
+                await future
+            finally:
+                with self.lock:
+                    if local.waiter is not None and local.waiter[1] is future:
+                        local.waiter = None
+
+    async def new_channel(self, prefix='specific'):
+        self.start()
+        return '{}.{}!{}'.format(prefix, self.process, uuid.uuid4().hex[:12])
+
+    async def group_add(self, group, channel):
+        self.group_add_nowait(group, channel)
+
+    async def group_discard(self, group, channel):
+        self.group_discard_nowait(group, channel)
+
+    async def group_send(self, group, message):
+        self.group_send_nowait(group, message)
+
+    async def flush(self):
+        with self.lock:
+            self.channels = {}
+            self.groups = {}
+            self.outbox = []
+            self.direct = {}
+        if self.remote is not None:
+            await self.remote.flush()
+
+    async def close(self):
+        if self.pid != os.getpid() or self.loop is None:
+            return
+        loop = self.loop
+
+        async def _close():
+            self.server.close()
+            for writer in self.peers.values():
+                writer.close()
+            if self.remote is not None:
+                await self.remote.close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+            loop.stop()
+        asyncio.run_coroutine_threadsafe(_close(), loop)
+        self.pid = None
+
+
+def pid_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
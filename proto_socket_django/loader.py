@@ -0,0 +1,95 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Type, TypeVar
+
+from django.conf import settings
+from django.db import models
+
+from proto_socket_django.dispatch import HandlerDispatcher
+
+M = TypeVar('M', bound=models.Model)
+
+
+class Batch:
+    """
+    Keys of one query round and, once fetched, their rows (None for missing ones, or the exception of the query).
+    """
+
+    def __init__(self):
+        self.keys: Dict[Type[models.Model], set] = {}
+        self.rows: Dict[Type[models.Model], Dict] = {}
+        self.fetched = False
+
+
+class Loader:
+    """
+    Loads rows by primary key in batches across the messages of a connection (DataLoader style): keys requested by
+    handlers are collected until every running handler of the connection waits for the loader, or for at most
+    PSD_LOADER_WINDOW seconds (default 0.005), and fetched with one filter(pk__in=...) query per model. Rows are
+    only shared by the loads of one batch - every load after it queries again, so it sees the current rows.
+    Batches grow with concurrent handlers (concurrency='parallel' or 'ordered', see receive) - for a serial one
+    the query runs right away.
+    """
+
+    def __init__(self, dispatcher: HandlerDispatcher):
+        self.dispatcher = dispatcher
+        self.condition = threading.Condition()
+        self.batch = Batch()  # collecting keys
+        self.fetching = False
+
+    def load(self, model: Type[M], pk) -> Optional[M]:
+        return self.load_many(model, [pk])[0]
+
+    def load_many(self, model: Type[M], pks: Iterable) -> List[Optional[M]]:
+        """
+        Rows of the primary keys, in order (None for missing ones).
+        """
+        keys = [model._meta.pk.to_python(pk) for pk in pks]
+        if not keys:
+            return []
+        with self.condition:
+            batch = self.batch
+            batch.keys.setdefault(model, set()).update(keys)
+        self._wait(batch)
+        rows = batch.rows[model]
+        result = [rows.get(key) for key in keys]
+        for row in result:
+            if isinstance(row, Exception):
+                raise row
+        return result
+
+    def _wait(self, batch: Batch):
+        dispatcher = self.dispatcher if HandlerDispatcher.current() is self.dispatcher else None
+        if dispatcher is not None:
+            dispatcher.suspend()
+        try:
+            deadline = time.monotonic() + getattr(settings, 'PSD_LOADER_WINDOW', 0.005)
+            with self.condition:
+                while not batch.fetched:
+                    remaining = deadline - time.monotonic()
+                    if (not self.fetching and batch is self.batch
+                            and (remaining <= 0 or (dispatcher is not None and dispatcher.stalled()))):
+                        self._fetch()
+                    else:
+                        self.condition.wait(max(remaining, 0.001) if not self.fetching else None)
+        finally:
+            if dispatcher is not None:
+                dispatcher.resume()
+
+    def _fetch(self):
+        # called with self.condition held, releases it while querying - keys requested meanwhile go to the next batch
+        batch, self.batch = self.batch, Batch()
+        self.fetching = True
+        self.condition.release()
+        try:
+            for model, keys in batch.keys.items():
+                try:
+                    rows = {row.pk: row for row in model._default_manager.filter(pk__in=keys)}
+                    batch.rows[model] = {key: rows.get(key) for key in keys}
+                except Exception as e:
+                    batch.rows[model] = {key: e for key in keys}
+        finally:
+            self.condition.acquire()
+            self.fetching = False
+            batch.fetched = True
+            self.condition.notify_all()
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, Tuple, Union
+
+CONTROL = 'control'
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = (CONTROL, INTERACTIVE, BULK)
+
+
+class Outbox:
+    """
+    Send path of a connection with priority classes: control (acks, token-invalid, upgrade-api-version), interactive
+    (default) and bulk (stream chunks). One frame is sent at a time - threads sending while another one does wait for
+    their turn, which goes to the highest class first and in order within a class. So an ack waits for at most the
+    frame being sent, not for the bulk frames queued before it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.busy = False
+        self.waiting: Tuple[Deque[Union[threading.Event, 'LoopTurn']], ...] = tuple(deque() for _ in PRIORITIES)
+
+    def send(self, send: Callable[[], None], priority: Optional[str] = None):
+        """
+        Calls send (which sends one frame) on this thread once it's its turn.
+        """
+        with self.lock:
+            turn = None
+            if self.busy:
+                turn = threading.Event()
+                self.waiting[PRIORITIES.index(priority or INTERACTIVE)].append(turn)
+            else:
+                self.busy = True
+        if turn is not None:
+            # busy was handed over by the previous sender
+            turn.wait()
+        try:
+            send()
+        finally:
+            self.release()
+
+    async def send_async(self, send: Callable[[], Awaitable], priority: Optional[str] = None):
+        """
+        Like send, from an event loop: awaits send() once it's its turn, without holding a thread while waiting.
+        """
+        with self.lock:
+            turn = None
+            if self.busy:
+                turn = LoopTurn(self, asyncio.get_running_loop())
+                self.waiting[PRIORITIES.index(priority or INTERACTIVE)].append(turn)
+            else:
+                self.busy = True
+        if turn is not None:
+            await turn.future
+        try:
+            await send()
+        finally:
+            self.release()
+
+    def release(self):
+        # hands the turn to the next waiting sender
+        with self.lock:
+            for waiting in self.waiting:
+                if waiting:
+                    turn = waiting.popleft()
+                    break
+            else:
+                self.busy = False
+                return
+        turn.set()
+
+
+class LoopTurn:
+    """
+    Turn of a send_async caller, set from the thread of the previous sender.
+    """
+
+    def __init__(self, outbox: Outbox, loop: asyncio.AbstractEventLoop):
+        self.outbox = outbox
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def set(self):
+        try:
+            self.loop.call_soon_threadsafe(self._set)
+        except RuntimeError:
+            # loop closed
+            self.outbox.release()
+
+    def _set(self):
+        if self.future.cancelled():
+            # the caller is gone, the turn goes to the next one
+            self.outbox.release()
+        else:
+            self.future.set_result(None)
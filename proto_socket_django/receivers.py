@@ -1,7 +1,16 @@
+from typing import Optional
+
 import proto_socket_django as psd
 import proto.messages as pb
+from django.apps import apps
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.core.files.storage import default_storage
 from rest_framework_simplejwt.tokens import RefreshToken
+from proto_socket_django.coalescer import Coalescer
+from proto_socket_django.uploads import Upload, max_size
+from proto_socket_django.derivatives import Derivatives
+from proto_socket_django.subscriptions import filter_sets, is_subscribable, subscription_group
 
 
 class AuthenticationReceiver(psd.FPSReceiver):
@@ -39,3 +48,112 @@ class AuthenticationReceiver(psd.FPSReceiver):
             message = pb.TxRefreshTokenInvalid(pb.TxRefreshTokenInvalid.proto())
         self.consumer.send_message(message)
         self.consumer.authenticate()
+
+
+class UploadReceiver(psd.FPSReceiver):
+    """
+    Server side of the sfiles upload protocol: upload-start (resumes by local_key, the slot carries the offset to
+    continue from) -> upload-chunk (binary data, written on a sync worker if there are any) -> upload-end.
+    Chunks can also be sent over HTTP, see views.upload_chunk.
+    """
+    progress_coalescer = Coalescer()
+
+    @psd.receive()
+    def upload_start(self, message: pb.RxUploadStart):
+        if not 0 <= (message.proto.size or 0) <= max_size():
+            return psd.FPSReceiverError('Upload is too large.')
+        upload = Upload.start(self.consumer.user.pk, message.proto.local_key, name=message.proto.name or '',
+                              extension=message.proto.extension or '', mime=message.proto.mime or '',
+                              size=message.proto.size or 0)
+        self.consumer.send_message(pb.TxUploadStartSlot(pb.UploadStartSlot(
+            key=upload.key, local_key=upload.local_key, offset=upload.offset,
+        )))
+
+    @psd.receive()
+    def upload_chunk(self, message: pb.RxUploadChunk):
+        upload = self.get_upload(message.proto.key)
+        if upload is None:
+            return psd.FPSReceiverError('Unknown upload.')
+        offset, data = message.proto.offset or 0, message.proto.data or b''
+        consumer = self.consumer.original
+
+        def _write():
+            upload.write(offset, data)
+            UploadReceiver.progress_coalescer.submit(
+                upload.key,
+                lambda: consumer.send_message(pb.TxUploadProgress(pb.UploadProgress(
+                    n_bytes=upload.offset, key=upload.key, local_key=upload.local_key,
+                ))),
+                getattr(settings, 'PSD_UPLOAD_PROGRESS_INTERVAL', 0.5),
+            )
+
+        if psd.ApiWebsocketConsumer.sync_workers:
+            return self.continue_async(_write)
+        _write()
+
+    @psd.receive()
+    def upload_end(self, message: pb.RxUploadEnd):
+        upload = self.get_upload(message.proto.key)
+        if upload is None:
+            return psd.FPSReceiverError('Unknown upload.')
+        if upload.size and upload.offset < upload.size:
+            return psd.FPSReceiverError('Upload is incomplete.')
+        name = upload.finish()
+        self.consumer.send_message(pb.TxUploadDone(pb.UploadDone(
+            key=upload.key, file=self.uploaded_file(upload, name),
+        )))
+
+        # upload-done is sent again with thumb/preview urls once derivatives are ready
+        if getattr(settings, 'PSD_UPLOAD_DERIVATIVES', True):
+            consumer = self.consumer.original
+            Derivatives.submit(name, lambda derivatives: consumer.send_message(pb.TxUploadDone(pb.UploadDone(
+                key=upload.key, file=self.uploaded_file(upload, name, derivatives),
+            ))))
+
+    def get_upload(self, key: str) -> Optional[Upload]:
+        upload = Upload.get(key or '')
+        if upload is None or upload.user_id != str(self.consumer.user.pk):
+            return None
+        return upload
+
+    def uploaded_file(self, upload: Upload, name: str, derivatives: Optional[Derivatives] = None) -> pb.UploadedFile:
+        """
+        Override to eg. store the file in a model - name is the file's name in the default storage. Called again with
+        derivatives once they are generated.
+        """
+        uploaded_file = pb.UploadedFile(
+            local_key=upload.local_key,
+            url=default_storage.url(name),
+            id=name,
+            mime=upload.mime,
+            name=upload.name,
+        )
+        if derivatives is not None:
+            uploaded_file.thumb_url = derivatives.thumb_url
+            uploaded_file.preview_url = derivatives.preview_url
+            uploaded_file.metadata = derivatives.metadata
+        return uploaded_file
+
+
+class SubscriptionReceiver(psd.FPSReceiver):
+    """
+    model-subscribe: pushes model-changes for the rows of a subscribable ApiModel (see subscriptions.ChangeFeed)
+    matching the filter. Subscriptions are groups, so they last until unsubscribe or disconnect.
+    """
+
+    @psd.receive()
+    def model_subscribe(self, message: pb.RxModelSubscribe):
+        try:
+            model = apps.get_model(message.proto.model)
+        except (LookupError, ValueError):
+            return psd.FPSReceiverError('Unknown model.')
+        filter = dict(message.proto.filter)
+        if not is_subscribable(model) or tuple(sorted(filter)) not in filter_sets(model):
+            return psd.FPSReceiverError('Unsupported subscription.')
+        if not model.can_subscribe(self.consumer.user, filter):
+            return psd.FPSReceiverError('Unauthorized.', pb.AckErrorCode.error_code_unauthorized)
+        group = subscription_group(model, filter)
+        if message.proto.unsubscribe:
+            self.consumer.remove_group(group)
+        else:
+            self.consumer.add_group(group)
@@ -0,0 +1,134 @@
+import asyncio
+import fnmatch
+import os
+import threading
+import traceback
+import zlib
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple, Union
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+
+from proto_socket_django.outbox import INTERACTIVE
+from proto_socket_django.sessions import Session
+
+if TYPE_CHECKING:
+    from proto_socket_django.consumer import ApiWebsocketConsumer
+
+
+class GroupRelay:
+    """
+    Fan-out of sharded groups (group names matching a PSD_SHARDED_GROUPS pattern). The channel layer doesn't see
+    the consumers of such a group - one relay per process joins one of PSD_GROUP_SHARDS (default 16) physical
+    groups `<group>.s<shard>` (by hash of its channel) and forwards broadcasts to its local members. A broadcast is
+    one group_send per shard, reaching one relay per process, instead of one layer message per member. Each relay
+    encodes the json once per encoding of its members (compactBodies, messageTypeIds). Sessions (see sessions.Session)
+    are members of plain groups through the relay as well, so their groups outlive the connection.
+    """
+
+    def __init__(self):
+        self.pid: Optional[int] = None
+        self.channel_name: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self.members: Dict[str, Set[Union['ApiWebsocketConsumer', Session]]] = {}
+        self.lock = threading.Lock()
+        # joins and leaves, including the layer's group_add/group_discard - separate from lock, which fan_out takes on
+        # the event loop the layer calls run on
+        self.membership_lock = threading.Lock()
+
+    @staticmethod
+    def is_sharded(group: str) -> bool:
+        return any(fnmatch.fnmatchcase(group, pattern) for pattern in getattr(settings, 'PSD_SHARDED_GROUPS', []))
+
+    @staticmethod
+    def n_shards() -> int:
+        return getattr(settings, 'PSD_GROUP_SHARDS', 16)
+
+    @staticmethod
+    def shard_group(group: str, shard: int) -> str:
+        return '{}.s{}'.format(group, shard)
+
+    @classmethod
+    def shard_events(cls, group: str, event: dict) -> List[Tuple[str, dict]]:
+        relay_event = {'type': 'psd.relay', 'group': group, 'event': event['event']}
+        return [(cls.shard_group(group, shard), relay_event) for shard in range(cls.n_shards())]
+
+    def join(self, member: Union['ApiWebsocketConsumer', Session], group: str, layer):
+        with self.membership_lock:
+            with self.lock:
+                members = self.members.setdefault(group, set())
+                first = not members
+                members.add(member)
+            if first:
+                async_to_sync(self.group_add)(layer, group)
+
+    def leave(self, member: Union['ApiWebsocketConsumer', Session], group: str, layer):
+        with self.membership_lock:
+            with self.lock:
+                members = self.members.get(group)
+                if members is None or member not in members:
+                    return
+                members.discard(member)
+                last = not members
+                if last:
+                    del self.members[group]
+            if last and self.channel_name is not None:
+                async_to_sync(layer.group_discard)(self.own_group(group), self.channel_name)
+
+    def own_group(self, group: str) -> str:
+        if not self.is_sharded(group):
+            return group
+        return self.shard_group(group, zlib.crc32(self.channel_name.encode()) % self.n_shards())
+
+    async def group_add(self, layer, group: str):
+        await self.start(layer)
+        await layer.group_add(self.own_group(group), self.channel_name)
+
+    async def start(self, layer):
+        # runs on the server's event loop (async_to_sync from a consumer), per process
+        if self.pid == os.getpid() and self.task is not None and not self.task.done():
+            return
+        self.pid = os.getpid()
+        self.channel_name = await layer.new_channel('psd-relay')
+        self.task = asyncio.ensure_future(self.run(layer))
+
+    async def run(self, layer):
+        while True:
+            try:
+                event = await layer.receive(self.channel_name)
+                await self.fan_out(event['group'], event['event'])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+
+    async def fan_out(self, group: str, json: dict):
+        with self.lock:
+            members = list(self.members.get(group, ()))
+        texts = {}
+        sends = []
+        for member in members:
+            if isinstance(member, Session):
+                # numbered and sent under the session's send lock, through the outbox of its connection
+                sends.append(sync_to_async(self.send_session, thread_sensitive=False)(member, json))
+                continue
+            consumer = member
+            variant = (consumer.body_casing, consumer.message_type_ids)
+            text = texts.get(variant)
+            if text is None:
+                text = texts[variant] = consumer.encode_json(consumer.encode_broadcast(json))
+            send = getattr(consumer.base_send, 'awaitable', None)
+            if send is not None:
+                # the ASGI send of the connection (without the async_to_sync wrapper of sync consumers), in its turn
+                sends.append(consumer.outbox.send_async(
+                    lambda send=send, text=text: send({'type': 'websocket.send', 'text': text}), INTERACTIVE))
+            else:
+                sends.append(sync_to_async(consumer.outbox.send, thread_sensitive=False)(
+                    lambda consumer=consumer, text=text: consumer.send(text_data=text), INTERACTIVE))
+        for i in range(0, len(sends), 1000):
+            await asyncio.gather(*sends[i:i + 1000], return_exceptions=True)
+
+    @staticmethod
+    def send_session(session: Session, json: dict):
+        consumer = session.consumer
+        consumer.outbox.send(lambda: consumer.send_session_frame(consumer.encode_broadcast(json)), INTERACTIVE)
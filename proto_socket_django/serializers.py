@@ -1,13 +1,108 @@
 import abc
+from typing import Callable, Dict, List, Optional, Tuple, Type
+
+import betterproto
 from proto.messages import TxMessage, RxMessage
 
 
 class ProtoSerializer(abc.ABC):
     tx: TxMessage
 
-    def __new__(cls, *args, **kwargs):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # betterproto resolves field type hints in the class's module - use the one of the proto it extends
         cls.__module__ = cls.__bases__[0].__module__
-        return super().__new__(cls)
 
     def msg(self):
         return self.tx(self)
+
+
+class ModelSerializer:
+    """
+    Generated model -> proto serializer (see model_serializer). Builds protos from model attributes
+    (serializer(obj)) or from queryset.values_list() rows (serializer.many(queryset)) by filling the message's
+    __dict__ directly, skipping the dataclass __init__/__post_init__ default machinery and from_dict. Enum fields
+    (choices) get enum members, like from_dict sets.
+    """
+    __slots__ = ('model', 'proto', 'columns', 'source', 'one', 'row')
+
+    def __init__(self, model, proto: Type[betterproto.Message]):
+        from .api_models import SerializationPlan
+        from .betterproto_patch import get_plan
+        plan = SerializationPlan.get(model)
+        proto_plan = get_plan(proto)
+        columns = {field_name: (column, serialize) for column, (field_name, serialize) in
+                   zip(plan.columns, plan.fields)}
+
+        self.model = model
+        self.proto = proto
+        self.columns: List[str] = []
+        namespace: Dict[str, object] = {'proto': proto, 'new': object.__new__}
+        obj_values, row_values = [], []
+        for field in proto_plan.fields:
+            if field.name not in columns:
+                # not a model column - fresh default, as set by __post_init__
+                namespace['d_' + field.name] = field.default_gen
+                obj_values.append('{name}=d_{name}()'.format(name=field.name))
+                row_values.append(obj_values[-1])
+                continue
+            column, serialize = columns[field.name]
+            if field.enum_values is not None:
+                serialize = enum_serializer(field.enum_values, serialize)
+            obj_value = 'obj.' + column
+            row_value = 'row[{}]'.format(len(self.columns))
+            if serialize is not None:
+                namespace['s_' + field.name] = serialize
+                obj_value = 's_{name}({value}) if {value} is not None else None'.format(name=field.name, value=obj_value)
+                row_value = 's_{name}({value}) if {value} is not None else None'.format(name=field.name, value=row_value)
+            obj_values.append('{}={}'.format(field.name, obj_value))
+            row_values.append('{}={}'.format(field.name, row_value))
+            self.columns.append(column)
+
+        if any(field.meta.group for field in proto_plan.fields):
+            # oneofs need __post_init__ to build the group map
+            body = '    return proto({values})\n'
+        else:
+            body = (
+                '    message = new(proto)\n'
+                '    message.__dict__.update({values}, _serialized_on_wire=True, _unknown_fields=b"", _group_map={{}})\n'
+                '    return message\n'
+            )
+        self.source = 'def one(obj):\n' + body.format(values=', '.join(obj_values)) + \
+                      '\ndef row(row):\n' + body.format(values=', '.join(row_values))
+        exec(compile(self.source, '<{} serializer>'.format(proto.__name__), 'exec'), namespace)
+        self.one: Callable = namespace['one']
+        self.row: Callable = namespace['row']
+
+    def __call__(self, obj) -> betterproto.Message:
+        return self.one(obj)
+
+    def many(self, queryset, chunk_size: int = 2000) -> List[betterproto.Message]:
+        return list(map(self.row, queryset.values_list(*self.columns).iterator(chunk_size=chunk_size)))
+
+
+def enum_serializer(enum_values: Dict[int, betterproto.Enum], serialize: Optional[Callable]) -> Callable:
+    # unknown values stay ints, as in from_dict
+    if serialize is None:
+        return lambda value: enum_values.get(value, value)
+
+    def to_member(value):
+        value = serialize(value)
+        return enum_values.get(value, value)
+    return to_member
+
+
+_model_serializers: Dict[Tuple[type, type], ModelSerializer] = {}
+
+
+def model_serializer(model, proto: Optional[Type[betterproto.Message]] = None) -> ModelSerializer:
+    """
+    Returns the (cached) generated serializer of an ApiModel into `proto` (the model's proto by default), eg.
+    model_serializer(Book)(book) or model_serializer(Book).many(Book.objects.all()).
+    """
+    proto = proto or model.proto_class()
+    serializer = _model_serializers.get((model, proto))
+    if serializer is None:
+        serializer = ModelSerializer(model, proto)
+        _model_serializers[(model, proto)] = serializer
+    return serializer
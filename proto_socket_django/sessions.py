@@ -0,0 +1,203 @@
+import secrets
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+from django.conf import settings
+from django.core.cache import caches
+
+Frames = List[Union[str, bytes]]  # binary slot frames followed by the json text
+
+
+class Session:
+    """
+    Resumable session of a connection. Outbound json frames get a `seq` header and are kept in a ring buffer
+    (PSD_SESSION_BUFFER frames, default 256), group memberships are held by the session (see relay.GroupRelay)
+    instead of the connection. After disconnect the session is parked for PSD_SESSION_GRACE seconds (default 30) -
+    it keeps buffering broadcasts to its groups, and a connection sending `session-resume` with the last seq it
+    received gets the missed frames and the groups back. With PSD_SESSION_CACHE (a cache alias) parked sessions
+    are also kept in that cache, so they can be resumed by another process.
+    """
+    sessions: Dict[str, 'Session'] = {}  # sessions of this process
+    sessions_lock = threading.Lock()
+
+    def __init__(self, session_id: str, state: Optional[dict] = None):
+        self.id = session_id
+        self.restored = state is not None  # loaded from the cache, the groups still have to be joined
+        state = state or {}
+        self.seq: int = state.get('seq', 0)
+        self.frames: Deque[Tuple[int, Frames]] = deque(state.get('frames', ()),
+                                                       maxlen=getattr(settings, 'PSD_SESSION_BUFFER', 256))
+        self.groups: List[str] = state.get('groups', [])
+        self.user_id: Optional[str] = state.get('user_id')
+        self.sync_states: dict = state.get('sync_states', {})
+        self.binary_slot_id: int = state.get('binary_slot_id', 0)
+        self.consumer = None  # current connection, or the last one while parked
+        self.connected = False
+        self.replaying = False
+        self.expires: Optional[float] = None
+        self.on_drop: Optional[Callable[['Session'], None]] = None
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()  # held while numbering and sending a frame
+
+    @staticmethod
+    def cache():
+        alias = getattr(settings, 'PSD_SESSION_CACHE', None)
+        return caches[alias] if alias else None
+
+    @staticmethod
+    def cache_key(session_id: str) -> str:
+        return 'psd-session:' + session_id
+
+    @classmethod
+    def create(cls, consumer) -> 'Session':
+        session = Session(secrets.token_urlsafe(24))
+        session.consumer = consumer
+        session.connected = True
+        with cls.sessions_lock:
+            cls.sessions[session.id] = session
+        return session
+
+    @classmethod
+    def take(cls, session_id: str) -> Optional['Session']:
+        """
+        The session to resume - parked, from the cache, or still connected (the server may not have noticed yet that
+        the old connection is gone). None if there is none.
+        """
+        with cls.sessions_lock:
+            session = cls.sessions.get(session_id)
+        cache = cls.cache()
+        if session is None and cache is not None:
+            state = cache.get(cls.cache_key(session_id))
+            if state is not None:
+                session = Session(session_id, state)
+                session.expires = time.monotonic() + getattr(settings, 'PSD_SESSION_GRACE', 30)
+                with cls.sessions_lock:
+                    session = cls.sessions.setdefault(session_id, session)
+        if session is not None:
+            with session.lock:
+                if session.expires is not None and session.expires < time.monotonic():
+                    return None
+        return session
+
+    def credentials(self) -> Tuple[Optional[str], int]:
+        """
+        User id (str of the pk, None if anonymous) and next binary slot id of the connection (or the last one).
+        """
+        consumer = self.consumer
+        if consumer is None:
+            return self.user_id, self.binary_slot_id
+        user = consumer.user
+        return (str(user.pk) if user is not None else None), consumer.binary_slot_id
+
+    def attach(self, consumer, last_seq: int) -> bool:
+        """
+        Makes consumer the connection of the session, False if frames after last_seq were already dropped from the
+        buffer. New frames are only buffered until replay() caught up.
+        """
+        with self.lock:
+            oldest = self.frames[0][0] if self.frames else self.seq + 1
+            if last_seq > self.seq or oldest > last_seq + 1:
+                return False
+            self.consumer = consumer
+            self.connected = True
+            self.replaying = True
+            parked = self.expires is not None
+            self.expires = None
+        cache = self.cache()
+        if parked and cache is not None:
+            # claims the session, if it's parked in another process too (see save)
+            cache.delete(self.cache_key(self.id))
+        return True
+
+    def replay(self, after: int) -> List[Tuple[int, Frames]]:
+        """
+        Buffered frames after seq `after`. Once none are left, frames are sent as they are added again.
+        """
+        with self.lock:
+            frames = [f for f in self.frames if f[0] > after]
+            if not frames:
+                self.replaying = False
+            return frames
+
+    def frame(self, json: dict, encode: Callable[[dict], str], blobs: Sequence[bytes] = ()) -> Optional[Frames]:
+        """
+        Adds the next seq to json and buffers it, returns the frames to send - None while parked or replaying (parked
+        sessions should be saved afterwards).
+        """
+        with self.lock:
+            self.seq += 1
+            json = dict(json, headers=dict(json['headers'], seq=self.seq))
+            frames = list(blobs) + [encode(json)]
+            self.frames.append((self.seq, frames))
+            live = self.connected and not self.replaying
+        return frames if live else None
+
+    @property
+    def parked(self) -> bool:
+        return self.expires is not None
+
+    def park(self, on_drop: Callable[['Session'], None]):
+        """
+        Keeps the session for PSD_SESSION_GRACE seconds after its connection closed, on_drop is called when it
+        expires (or was resumed by another process).
+        """
+        grace = getattr(settings, 'PSD_SESSION_GRACE', 30)
+        with self.lock:
+            self.connected = False
+            self.expires = time.monotonic() + grace
+            self.on_drop = on_drop
+        self.save(parking=True)
+        timer = threading.Timer(grace, self._expire)
+        timer.daemon = True
+        timer.start()
+
+    def save(self, parking: bool = False):
+        """
+        Writes the parked session to PSD_SESSION_CACHE. If it's gone from the cache, it was resumed by another
+        process (see attach) and is dropped here.
+        """
+        cache = self.cache()
+        if cache is None:
+            return
+        try:
+            user_id, binary_slot_id = self.credentials()
+            with self.lock:
+                if self.expires is None:
+                    return
+                state = {
+                    'seq': self.seq, 'frames': list(self.frames), 'groups': list(self.groups),
+                    'user_id': user_id, 'sync_states': self.sync_states,
+                    'binary_slot_id': binary_slot_id,
+                }
+                timeout = self.expires - time.monotonic()
+            key = self.cache_key(self.id)
+            if not parking and cache.get(key) is None:
+                self.drop()
+            elif timeout > 0:
+                cache.set(key, state, timeout)
+        except Exception:
+            traceback.print_exc()
+
+    def _expire(self):
+        with self.lock:
+            if self.expires is None or self.expires > time.monotonic():
+                return
+        self.drop()
+
+    def drop(self):
+        """
+        Ends the parked session (connected ones are kept).
+        """
+        with self.lock:
+            if self.expires is None:
+                return
+            self.expires = None
+            on_drop = self.on_drop
+        with Session.sessions_lock:
+            if Session.sessions.get(self.id) is self:
+                del Session.sessions[self.id]
+        if on_drop is not None:
+            on_drop(self)
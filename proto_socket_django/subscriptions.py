@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+Filter = Dict[str, str]
+
+_filter_sets: Dict[type, List[Tuple[str, ...]]] = {}
+
+
+def is_subscribable(model: type) -> bool:
+    return getattr(model, 'subscribe_filters', None) is not None
+
+
+def filter_sets(model: type) -> List[Tuple[str, ...]]:
+    """
+    Column sets clients may filter by: none (all rows), the primary key and the model's subscribe_filters.
+    """
+    sets = _filter_sets.get(model)
+    if sets is None:
+        columns = {f.name: f.attname for f in model._meta.concrete_fields}
+        sets = [(), ('id',)]
+        for names in model.subscribe_filters:
+            names = (names,) if isinstance(names, str) else names
+            sets.append(tuple(sorted(columns.get(name, name) for name in names)))
+        sets = list(dict.fromkeys(sets))
+        _filter_sets[model] = sets
+    return sets
+
+
+def filter_values(instance: models.Model) -> Filter:
+    """
+    Values of the filter columns loaded on the instance (deferred ones are not fetched).
+    """
+    values = {'id': str(instance.pk)}
+    for columns in filter_sets(type(instance)):
+        for column in columns:
+            if column != 'id' and column in instance.__dict__:
+                value = instance.__dict__[column]
+                values[column] = '' if value is None else str(value)
+    return values
+
+
+def subscription_group(model: type, filter: Filter) -> str:
+    key = json.dumps(sorted(filter.items()), separators=(',', ':'))
+    return 'psd-model.{}.{}'.format(model._meta.label_lower, hashlib.sha1(key.encode()).hexdigest()[:20])
+
+
+def instance_groups(model: type, values: Optional[Filter]) -> Dict[str, Filter]:
+    """
+    The subscription groups a row with these filter values belongs to - one per filter set, so the number of
+    subscriptions doesn't matter.
+    """
+    groups = {}
+    if values:
+        for columns in filter_sets(model):
+            if all(column in values for column in columns):
+                filter = {column: values[column] for column in columns}
+                groups[subscription_group(model, filter)] = filter
+    return groups
+
+
+class ChangeFeed:
+    """
+    Pushes changed rows of subscribable ApiModels (subscribe_filters is not None) to the subscribers of their
+    model, id and filters. Changes are collected when transactions commit and flushed every PSD_SUBSCRIPTION_WINDOW
+    seconds (default 0.1) - rows changed several times within the window are sent once, as they are when flushed.
+    Each row is serialized once (to_proto) and the model-changes messages are sent with broadcast_many.
+    """
+    pending: Dict[type, Dict[str, Dict[str, Filter]]] = {}  # model -> pk -> groups the row belonged to
+    condition = threading.Condition()
+    thread: Optional[threading.Thread] = None
+    # event loop of the connections (set by ApiWebsocketConsumer) - broadcasts of the runner thread are sent through
+    # it, so async_to_sync doesn't run them on a new one
+    loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @classmethod
+    def add(cls, model: type, pk: str, groups: Dict[str, Filter]):
+        with cls.condition:
+            cls.pending.setdefault(model, {}).setdefault(pk, {}).update(groups)
+            if cls.thread is None:
+                cls.thread = threading.Thread(target=cls.runner)
+                cls.thread.daemon = True
+                cls.thread.start()
+            cls.condition.notify()
+
+    @classmethod
+    def runner(cls):
+        while True:
+            with cls.condition:
+                while not cls.pending:
+                    cls.condition.wait()
+            time.sleep(getattr(settings, 'PSD_SUBSCRIPTION_WINDOW', 0.1))
+            try:
+                loop = cls.loop
+                if loop is None or loop.is_closed():
+                    cls.flush_pending()
+                else:
+                    asyncio.run_coroutine_threadsafe(
+                        sync_to_async(cls.flush_pending, thread_sensitive=False)(), loop).result()
+            except Exception:
+                traceback.print_exc()
+
+    @classmethod
+    def flush_pending(cls):
+        # on whichever executor thread is free - its connections are checked like a request's
+        close_old_connections()
+        try:
+            cls.flush()
+        finally:
+            close_old_connections()
+
+    @classmethod
+    def flush(cls):
+        """
+        Sends the pending changes now (eg. at the end of a management command).
+        """
+        import proto.messages as pb
+        from proto_socket_django.consumer import ApiWebsocketConsumer
+
+        with cls.condition:
+            pending, cls.pending = cls.pending, {}
+        broadcasts = []
+        for model, changes in pending.items():
+            rows: Dict[str, Tuple[Filter, List[bytes]]] = {}
+            removed: Dict[str, Tuple[Filter, List[str]]] = {}
+            pks = list(changes)
+            for i in range(0, len(pks), 2000):
+                objects = {str(obj.pk): obj for obj in model._default_manager.filter(pk__in=pks[i:i + 2000])}
+                for pk in pks[i:i + 2000]:
+                    obj = objects.get(pk)
+                    groups = instance_groups(model, filter_values(obj)) if obj is not None else {}
+                    if groups:
+                        data = bytes(obj.to_proto())
+                        for group, filter in groups.items():
+                            rows.setdefault(group, (filter, []))[1].append(data)
+                    for group, filter in changes[pk].items():
+                        if group not in groups:
+                            removed.setdefault(group, (filter, []))[1].append(pk)
+
+            for group in dict.fromkeys(list(rows) + list(removed)):
+                filter = (rows.get(group) or removed.get(group))[0]
+                broadcasts.append((group, pb.TxModelChanges(pb.ModelChanges(
+                    model=model._meta.label, filter=filter,
+                    rows=rows.get(group, (None, []))[1], removed=removed.get(group, (None, []))[1],
+                ))))
+        if broadcasts:
+            ApiWebsocketConsumer.broadcast_many(broadcasts)
+
+
+def changed(model: type, pk, groups: Dict[str, Filter], using: Optional[str]):
+    # nothing is sent for rolled back changes
+    pk = str(pk)
+    transaction.on_commit(lambda: ChangeFeed.add(model, pk, groups), using=using)
+
+
+@receiver(post_save)
+def on_post_save(sender, instance, using=None, **kwargs):
+    if not is_subscribable(sender):
+        return
+    loaded = getattr(instance, '_psd_filter_values', None)
+    instance._psd_filter_values = filter_values(instance)
+    # the row leaves the groups of its old values if they changed
+    changed(sender, instance.pk, instance_groups(sender, loaded), using)
+
+
+@receiver(post_delete)
+def on_post_delete(sender, instance, using=None, **kwargs):
+    if not is_subscribable(sender):
+        return
+    groups = instance_groups(sender, getattr(instance, '_psd_filter_values', None))
+    groups.update(instance_groups(sender, filter_values(instance)))
+    changed(sender, instance.pk, groups, using)
+
+
+@receiver(m2m_changed)
+def on_m2m_changed(sender, instance, action, model, pk_set, using=None, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if is_subscribable(type(instance)):
+        changed(type(instance), instance.pk, {}, using)
+    if is_subscribable(model) and pk_set:
+        for pk in pk_set:
+            changed(model, pk, {}, using)
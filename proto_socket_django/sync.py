@@ -0,0 +1,94 @@
+import copy
+import threading
+from typing import Optional, Tuple, List
+
+# body of a patch frame:
+#   set: {field: value} - new or changed fields (whole value)
+#   unset: [field] - fields that are now default (omitted from the body)
+#   patch: {field: patch} - changed nested messages
+#   items: {field: {upsert: [item], patch: {id: patch}, remove: [id], order: [id]}} - changed repeated messages with ids
+#          (order is only sent if the order of ids changed, new items are appended otherwise)
+
+
+def diff(old: dict, new: dict) -> dict:
+    patch = {}
+    for key, value in new.items():
+        if key not in old:
+            patch.setdefault('set', {})[key] = value
+            continue
+        old_value = old[key]
+        if old_value == value:
+            continue
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            patch.setdefault('patch', {})[key] = diff(old_value, value)
+        elif is_keyed_list(value) and is_keyed_list(old_value):
+            patch.setdefault('items', {})[key] = diff_items(old_value, value)
+        else:
+            patch.setdefault('set', {})[key] = value
+    unset = [key for key in old if key not in new]
+    if unset:
+        patch['unset'] = unset
+    return patch
+
+
+def is_keyed_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(i, dict) and 'id' in i for i in value)
+
+
+def diff_items(old: List[dict], new: List[dict]) -> dict:
+    old_items = {i['id']: i for i in old}
+    new_ids = [i['id'] for i in new]
+    patch = {}
+    for item in new:
+        old_item = old_items.get(item['id'])
+        if old_item is None:
+            patch.setdefault('upsert', []).append(item)
+        elif old_item != item:
+            patch.setdefault('patch', {})[item['id']] = diff(old_item, item)
+
+    new_id_set = set(new_ids)
+    remove = [i for i in old_items if i not in new_id_set]
+    if remove:
+        patch['remove'] = remove
+
+    kept = [i['id'] for i in old if i['id'] in new_id_set]
+    if kept + [i['id'] for i in patch.get('upsert', [])] != new_ids:
+        patch['order'] = new_ids
+    return patch
+
+
+class SyncState:
+    """
+    Last body sent for one (message type, key) on a connection. Every update gets a new version, patches are sent
+    against the previous version and every `snapshot_interval` updates (or on resync) the full body is sent instead.
+    Hold `lock` from update/snapshot until the frame is sent, so parallel handlers send the versions in order.
+    """
+
+    def __init__(self, snapshot_interval: int):
+        self.lock = threading.Lock()
+        self.snapshot_interval = snapshot_interval
+        self.body: Optional[dict] = None
+        self.version = 0
+        self.since_snapshot = 0
+
+    def update(self, body: dict) -> Tuple[Optional[dict], Optional[dict]]:
+        """
+        Returns (sync headers, body to send) - (None, None) if nothing changed.
+        """
+        if self.body is not None and self.since_snapshot < self.snapshot_interval:
+            patch = diff(self.body, body)
+            if not patch:
+                return None, None
+            self.set_body(body)
+            self.since_snapshot += 1
+            return {'syncVersion': self.version, 'syncBase': self.version - 1, 'syncPatch': True}, patch
+        self.set_body(body)
+        return self.snapshot()
+
+    def set_body(self, body: dict):
+        self.body = copy.deepcopy(body)
+        self.version += 1
+
+    def snapshot(self) -> Tuple[dict, dict]:
+        self.since_snapshot = 0
+        return {'syncVersion': self.version}, self.body
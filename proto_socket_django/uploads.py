@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Union
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+
+def upload_dir() -> str:
+    path = getattr(settings, 'PSD_UPLOAD_DIR', None) or os.path.join(
+        getattr(settings, 'MEDIA_ROOT', None) or tempfile.gettempdir(), 'psd_uploads')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def max_size() -> int:
+    return getattr(settings, 'PSD_UPLOAD_MAX_SIZE', 1024 ** 3)
+
+
+class PartFile(File):
+    # lets FileSystemStorage move the finished part file instead of copying it
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class Upload:
+    """
+    Resumable upload, written incrementally to a preallocated part file in PSD_UPLOAD_DIR. Chunks are written with
+    pwrite at their offset, so they may be written in parallel and out of order - `offset` is the number of
+    contiguous bytes written from the start, which is where an interrupted upload resumes. Metadata is kept in a
+    json file next to the part file, so uploads can be resumed (by the same user and local_key) after a restart.
+    """
+    uploads: Dict[str, 'Upload'] = {}
+    uploads_lock = threading.Lock()
+    meta_save_interval = 1
+
+    def __init__(self, key: str, meta: dict):
+        self.key = key
+        self.user_id: str = str(meta['user_id'])  # str of the pk, json can't dump uuids
+        self.local_key = meta['local_key']
+        self.name = meta['name']
+        self.extension = meta['extension']
+        self.mime = meta['mime']
+        self.size = meta['size']
+        self.offset = meta['offset']
+        self.lock = threading.Lock()
+        self.written: Dict[int, int] = {}  # start -> end of chunks written past offset
+        self.meta_saved = 0
+        self.done = False
+
+    @staticmethod
+    def make_key(user_id, local_key: str) -> str:
+        return hashlib.sha256('{}:{}'.format(user_id, local_key).encode()).hexdigest()[:32]
+
+    @property
+    def part_path(self) -> str:
+        return os.path.join(upload_dir(), self.key + '.part')
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(upload_dir(), self.key + '.json')
+
+    @classmethod
+    def start(cls, user_id, local_key: str, name: str = '', extension: str = '', mime: str = '',
+              size: int = 0) -> 'Upload':
+        if size < 0 or size > max_size():
+            raise Exception('upload size {} is over the limit of {} bytes'.format(size, max_size()))
+        key = cls.make_key(user_id, local_key)
+        with cls.uploads_lock:
+            upload = cls.get(key)
+            if upload is not None:
+                return upload
+            upload = Upload(key, {
+                'user_id': str(user_id),
+                'local_key': local_key,
+                'name': name,
+                'extension': re.sub('[^A-Za-z0-9]', '', extension),
+                'mime': mime,
+                'size': size,
+                'offset': 0,
+            })
+            fd = os.open(upload.part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                if size:
+                    if hasattr(os, 'posix_fallocate'):
+                        os.posix_fallocate(fd, 0, size)
+                    else:
+                        os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+            upload.save_meta()
+            cls.uploads[key] = upload
+            return upload
+
+    @classmethod
+    def get(cls, key: str) -> Optional['Upload']:
+        upload = cls.uploads.get(key)
+        if upload is not None or not re.fullmatch('[0-9a-f]{32}', key):
+            return upload
+        try:
+            with open(os.path.join(upload_dir(), key + '.json'), 'r', encoding='utf-8') as f:
+                upload = Upload(key, json.load(f))
+        except FileNotFoundError:
+            return None
+        if not os.path.isfile(upload.part_path):
+            return None
+        return cls.uploads.setdefault(key, upload)
+
+    def save_meta(self):
+        meta = {
+            'user_id': self.user_id,
+            'local_key': self.local_key,
+            'name': self.name,
+            'extension': self.extension,
+            'mime': self.mime,
+            'size': self.size,
+            'offset': self.offset,
+        }
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+        self.meta_saved = time.time()
+
+    def write(self, offset: int, data: Union[bytes, memoryview]) -> int:
+        """
+        Writes data at offset and returns the new contiguous offset.
+        """
+        if self.done:
+            raise Exception('upload {} is already finished'.format(self.key))
+        # uploads of unknown size (0) are limited too, pwrite would grow the part file without bounds
+        if offset < 0 or offset + len(data) > (self.size or max_size()):
+            raise Exception('chunk {}+{} is out of bounds for upload {}'.format(offset, len(data), self.key))
+
+        fd = os.open(self.part_path, os.O_WRONLY)
+        try:
+            view = memoryview(data)
+            while view:
+                n = os.pwrite(fd, view, offset)
+                view = view[n:]
+                offset += n
+        finally:
+            os.close(fd)
+
+        with self.lock:
+            start = offset - len(data)
+            self.written[start] = max(offset, self.written.get(start, 0))
+            advanced = True
+            while advanced:
+                advanced = False
+                for start, end in list(self.written.items()):
+                    if start <= self.offset:
+                        del self.written[start]
+                        if end > self.offset:
+                            self.offset = end
+                            advanced = True
+            if time.time() - self.meta_saved > self.meta_save_interval:
+                self.save_meta()
+            return self.offset
+
+    def finish(self, storage_prefix: Optional[str] = None) -> str:
+        """
+        Moves the part file to the default storage and returns its name there.
+        """
+        with self.lock:
+            if self.size and self.offset < self.size:
+                raise Exception('upload {} is incomplete ({}/{} bytes)'.format(self.key, self.offset, self.size))
+            self.done = True
+        if not self.size:
+            os.truncate(self.part_path, self.offset)
+
+        if storage_prefix is None:
+            storage_prefix = getattr(settings, 'PSD_UPLOAD_STORAGE_PREFIX', 'uploads/')
+        name = storage_prefix + self.key + ('.' + self.extension if self.extension else '')
+        with open(self.part_path, 'rb') as f:
+            name = default_storage.save(name, PartFile(f, name=self.part_path))
+        for path in (self.part_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        with Upload.uploads_lock:
+            Upload.uploads.pop(self.key, None)
+        return name
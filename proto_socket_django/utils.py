@@ -1,6 +1,6 @@
 import zoneinfo
 from datetime import datetime
-from typing import Optional, Union
+from typing import Optional, Union, Callable, List, Iterator
 
 from django.utils import timezone
 
@@ -17,3 +17,34 @@ def from_timestamp(ts) -> Optional[timezone.datetime]:
     if ts is None:
         return None
     return timezone.datetime.fromtimestamp(ts / 1000, tz=zoneinfo.ZoneInfo('UTC'))
+
+
+def stream_queryset(queryset, to_message: Callable[[List], 'TxMessage'], chunk_size: int = 500) -> Iterator[
+    'TxMessage']:
+    """
+    Yields `to_message(chunk)` for chunks of `chunk_size` objects, for use in streaming (generator) handlers. Each
+    chunk is fetched by its own query - streams continue on whichever pool thread is free, so no cursor (or its
+    thread's connection) is kept open across yields. Unordered querysets are read by primary key ranges (keyset),
+    ordered ones by offset slices.
+    """
+    if not queryset.ordered:
+        queryset = queryset.order_by('pk')
+        last_pk = None
+        while True:
+            chunk = list((queryset if last_pk is None else queryset.filter(pk__gt=last_pk))[:chunk_size])
+            if not chunk:
+                return
+            last_pk = chunk[-1].pk
+            yield to_message(chunk)
+            if len(chunk) < chunk_size:
+                return
+
+    offset = 0
+    while True:
+        chunk = list(queryset[offset:offset + chunk_size])
+        if not chunk:
+            return
+        offset += len(chunk)
+        yield to_message(chunk)
+        if len(chunk) < chunk_size:
+            return
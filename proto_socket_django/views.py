@@ -1,5 +1,8 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import AccessToken
+from proto_socket_django.uploads import Upload
 
 
 def auth_header(request):
@@ -7,3 +10,35 @@ def auth_header(request):
         return HttpResponse(str(AccessToken.for_user(request.user)))
     else:
         return HttpResponse(status=401)
+
+
+@csrf_exempt
+def upload_chunk(request, key: str):
+    """
+    Streams the request body into the upload (started with upload-start) at ?offset= (the upload's current offset
+    by default). Authenticated by session or the Authorization: Bearer <access token> header.
+    """
+    if request.method not in ('POST', 'PUT'):
+        return HttpResponse(status=405)
+
+    user = request.user if request.user.is_authenticated else None
+    if user is None:
+        try:
+            user = (JWTAuthentication().authenticate(request) or (None, None))[0]
+        except Exception:
+            user = None
+    upload = Upload.get(key)
+    if user is None or upload is None or upload.user_id != str(user.pk):
+        return HttpResponse(status=404)
+
+    try:
+        offset = int(request.GET.get('offset', upload.offset))
+        while True:
+            chunk = request.read(64 * 1024)
+            if not chunk:
+                break
+            upload.write(offset, chunk)
+            offset += len(chunk)
+    except Exception as e:
+        return JsonResponse({'offset': upload.offset, 'error': str(e)}, status=400)
+    return JsonResponse({'offset': upload.offset})
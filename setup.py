@@ -28,5 +28,6 @@ setup(
         'djangorestframework-simplejwt>=5.3.0',
         'betterproto==1.2.5',
         'channels',
+        'msgpack',
     ]
 )
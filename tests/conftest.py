@@ -0,0 +1,39 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+def pytest_configure(config):
+    """
+    Generates tests/project (a django project using the library) in a temporary directory and sets it up.
+    """
+    if shutil.which('protoc') is None or shutil.which('protoc-gen-python_betterproto') is None:
+        pytest.exit('protoc and betterproto[compiler] are needed to generate the test project', 1)
+    project = config.psd_project = tempfile.mkdtemp(prefix='psd-tests-')
+    shutil.copytree(os.path.join(HERE, 'project'), project, dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns('__pycache__'))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get('PYTHONPATH', '')]))
+    result = subprocess.run([sys.executable, '-m', 'proto_socket_django', 'generate'], cwd=project, env=env,
+                            capture_output=True, text=True)
+    if result.returncode:
+        pytest.exit('generating the test project failed:\n' + result.stdout + result.stderr, 1)
+
+    sys.path[:0] = [ROOT, project]
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'testproject.settings'
+    import django
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+def pytest_unconfigure(config):
+    project = getattr(config, 'psd_project', None)
+    if project is not None:
+        shutil.rmtree(project, ignore_errors=True)
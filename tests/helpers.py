@@ -0,0 +1,66 @@
+import asyncio
+import json
+import time
+from typing import List, Optional
+
+from channels.testing import WebsocketCommunicator
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def frame(message_type: str, body: Optional[dict] = None, uuid: Optional[str] = None, **headers) -> dict:
+    headers = dict(headers, messageType=message_type)
+    if uuid is not None:
+        headers['uuid'] = uuid
+    return {'headers': headers, 'body': body or {}}
+
+
+class Client:
+    """
+    A websocket connection to a consumer class, with helpers to read the frames it sends.
+    """
+
+    def __init__(self, consumer_class, path: str = '/ws/'):
+        self.communicator = WebsocketCommunicator(consumer_class.as_asgi(), path)
+        self.binary: List[bytes] = []
+
+    async def __aenter__(self) -> 'Client':
+        connected, _ = await self.communicator.connect()
+        assert connected
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.communicator.disconnect()
+
+    async def send(self, message_type: str, body: Optional[dict] = None, uuid: Optional[str] = None, **headers):
+        await self.communicator.send_json_to(frame(message_type, body, uuid, **headers))
+
+    async def receive(self, timeout: float = 3) -> dict:
+        """
+        The next json frame, binary frames before it are collected in self.binary.
+        """
+        while True:
+            message = await self.communicator.receive_output(timeout)
+            assert message['type'] == 'websocket.send', message
+            if message.get('text') is not None:
+                return json.loads(message['text'])
+            self.binary.append(message['bytes'])
+
+    async def receive_until(self, predicate, timeout: float = 3) -> List[dict]:
+        """
+        Frames up to and including the first one matching predicate.
+        """
+        frames = []
+        deadline = time.monotonic() + timeout
+        while not frames or not predicate(frames[-1]):
+            frames.append(await self.receive(max(deadline - time.monotonic(), 0.01)))
+        return frames
+
+    async def nothing(self, timeout: float = 0.1) -> bool:
+        return await self.communicator.receive_nothing(timeout)
+
+
+def acked(uuid: str):
+    return lambda f: f['headers']['messageType'] == 'ack' and f['body'].get('uuid') == uuid
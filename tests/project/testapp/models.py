@@ -0,0 +1,24 @@
+from django.db import models
+
+from proto_socket_django.api_models import ApiModel, Choice, Choices, ProtoManager
+
+
+class Author(ApiModel):
+    name = models.CharField(max_length=100)
+
+
+class Book(ApiModel):
+    class Status(Choices):
+        draft = Choice('draft', 'Draft', 0)
+        published = Choice('published', 'Published', 1)
+
+    title = models.CharField(max_length=100)
+    pages = models.IntegerField(default=0)
+    status = models.CharField(max_length=20, choices=Status.choices(), default='draft')
+    author = models.ForeignKey(Author, on_delete=models.CASCADE, null=True, related_name='+')
+    cover = models.FileField(null=True, blank=True)
+    released = models.DateField(null=True)
+    published = models.DateTimeField(null=True)
+
+    objects = ProtoManager()
+    subscribe_filters = ['author', 'status']
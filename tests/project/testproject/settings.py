@@ -0,0 +1,24 @@
+import os
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SECRET_KEY = 'tests-secret-key-of-at-least-32-bytes'
+DEBUG = False
+USE_TZ = True
+PROJECT = 'testproject'
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'channels',
+    'proto_socket_django',
+    'testapp',
+]
+DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(BASE_DIR, 'db.sqlite3')}}
+CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_URL = '/media/'
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+PSD_UUID_AS_CHAR_FIELD = True
+PSD_DEFAULT_AUTH = False
+PSD_N_SYNC_WORKERS = 2
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+import proto.messages as pb
+from proto_socket_django.betterproto_patch import get_plan
+
+
+def test_to_dict_from_dict_roundtrip():
+    item = pb.Item(id='i', tags=['a', 'b'], nested=pb.Nested(test='t', n=3), blob=b'\x00\x01')
+    body = item.to_dict()
+    assert body == {'id': 'i', 'tags': ['a', 'b'], 'nested': {'test': 't', 'n': 3}, 'blob': 'AAE='}
+    assert pb.Item().from_dict(body) == item
+    assert pb.Nested().to_dict() == {}
+
+
+def test_from_dict_accepts_snake_case_and_skips_unknown_keys():
+    book = pb.Book().from_dict({'author_id': 'a', 'unknownKey': 1})
+    assert book.author_id == 'a'
+    # unknown keys don't grow the plan's key cache
+    plan = get_plan(pb.Book)
+    assert plan.field_for_key('unknownKey') is None and 'unknownKey' not in plan.by_key
+
+
+def test_bench_messages():
+    result = subprocess.run([sys.executable, '-m', 'proto_socket_django', 'bench-messages', '--count', '100',
+                             '--runs', '1'], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert len(result.stdout.splitlines()) == 12 and 'from_dict betterproto' in result.stdout
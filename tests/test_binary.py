@@ -0,0 +1,53 @@
+import base64
+import struct
+
+import proto.messages as pb
+import proto_socket_django as psd
+
+from helpers import Client, run
+
+received = []
+
+
+class BlobReceiver(psd.FPSReceiver):
+    @psd.receive()
+    def get_items(self, message: pb.RxGetItems):
+        self.consumer.send_message(pb.TxItem(pb.Item(id='blob', blob=b'x' * message.proto.count)))
+
+    @psd.receive()
+    def upload_chunk(self, message: pb.RxUploadChunk):
+        received.append(message.proto.data)
+
+
+class Consumer(psd.ApiWebsocketConsumer):
+    receivers = [BlobReceiver]
+
+
+def test_large_bytes_are_sent_as_binary_frames():
+    async def main():
+        async with Client(Consumer) as client:
+            await client.send('get-items', {'count': 2000}, binaryFrames=True)
+            frame = await client.receive()
+            slot_id, = frame['headers']['binarySlots']
+            assert frame['body']['blob'] == {'$binary': slot_id}
+            assert client.binary == [struct.pack('>I', slot_id) + b'x' * 2000]
+
+            # small ones stay inline
+            await client.send('get-items', {'count': 10})
+            frame = await client.receive()
+            assert 'binarySlots' not in frame['headers']
+            assert base64.b64decode(frame['body']['blob']) == b'x' * 10
+    run(main())
+
+
+def test_binary_frames_are_received_without_copies():
+    async def main():
+        received.clear()
+        async with Client(Consumer) as client:
+            await client.communicator.send_to(bytes_data=struct.pack('>I', 7) + b'payload')
+            await client.send('upload-chunk', {'key': 'k', 'data': {'$binary': 7}}, uuid='chunk', ack=True,
+                              binarySlots=[7])
+            await client.receive()
+        assert len(received) == 1 and isinstance(received[0], memoryview)
+        assert bytes(received[0]) == b'payload'
+    run(main())
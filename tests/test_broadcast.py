@@ -0,0 +1,106 @@
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.test import override_settings
+
+import proto.messages as pb
+import proto_socket_django as psd
+from proto_socket_django.coalescer import Coalescer
+
+from helpers import Client, acked, run
+
+
+class GroupReceiver(psd.FPSReceiver):
+    @psd.receive()
+    def get_item(self, message: pb.RxGetItem):
+        self.consumer.add_group(message.proto.id)
+
+
+class Consumer(psd.ApiWebsocketConsumer):
+    receivers = [GroupReceiver]
+
+
+async def join(client: Client, group: str):
+    await client.send('get-item', {'id': group}, uuid='join', ack=True)
+    await client.receive_until(acked('join'))
+
+
+def broadcast(group: str, item_id: str):
+    return sync_to_async(psd.ApiWebsocketConsumer.broadcast)(group, pb.TxItem(pb.Item(id=item_id)))
+
+
+def test_coalesced_broadcasts_send_the_first_and_the_latest():
+    def broadcast():
+        for i in range(5):
+            psd.ApiWebsocketConsumer.broadcast_coalesced('coalesced', pb.TxItem(pb.Item(id=str(i))), window=0.2)
+        time.sleep(0.3)
+        psd.ApiWebsocketConsumer.broadcast_coalesced('coalesced', pb.TxItem(pb.Item(id='after')), window=0.2)
+
+    async def main():
+        async with Client(Consumer) as client:
+            await join(client, 'coalesced')
+            await sync_to_async(broadcast)()
+            assert [(await client.receive())['body']['id'] for _ in range(3)] == ['0', '4', 'after']
+            assert await client.nothing(0.4)
+    run(main())
+
+
+def test_windows_share_one_timer_thread():
+    coalescer = Coalescer()
+    ran = []
+    before = threading.active_count()
+    for key in range(50):
+        for value in range(3):
+            coalescer.submit(key, lambda key=key, value=value: ran.append((key, value)), 0.05)
+    assert threading.active_count() <= before + 1
+    time.sleep(0.3)
+    assert sorted(ran) == sorted([(key, 0) for key in range(50)] + [(key, 2) for key in range(50)])
+    assert not coalescer.windows
+
+
+def test_sharded_groups_are_relayed():
+    async def main():
+        layer = get_channel_layer()
+        async with Client(Consumer) as client, Client(Consumer) as compact:
+            await join(client, 'big.room')
+            await compact.send('get-item', {'id': 'big.room'}, uuid='join', ack=True, compactBodies=True)
+            await compact.receive_until(lambda f: f['headers']['messageType'] == 'ack')
+            # the layer only knows the relay's shard group
+            groups = [group for group in layer.groups if group.startswith('big.room')]
+            assert len(groups) == 1 and groups[0].startswith('big.room.s')
+
+            await broadcast('big.room', 'relayed')
+            assert (await client.receive())['body'] == {'id': 'relayed'}
+            assert (await compact.receive())['body'] == {'1': 'relayed'}
+    with override_settings(PSD_SHARDED_GROUPS=['big.*'], PSD_GROUP_SHARDS=4):
+        run(main())
+
+
+def test_broadcast_many_and_on_commit():
+    def send_committed_and_rolled_back():
+        with transaction.atomic():
+            psd.ApiWebsocketConsumer.broadcast_on_commit([('many.a', pb.TxItem(pb.Item(id='committed')))])
+        with transaction.atomic():
+            psd.ApiWebsocketConsumer.broadcast_on_commit([('many.a', pb.TxItem(pb.Item(id='rolled-back')))])
+            transaction.set_rollback(True)
+
+    async def main():
+        async with Client(Consumer) as first, Client(Consumer) as second:
+            await join(first, 'many.a')
+            await join(second, 'many.b')
+            await sync_to_async(psd.ApiWebsocketConsumer.broadcast_many)([
+                ('many.a', pb.TxItem(pb.Item(id='a'))),
+                ('many.b', pb.TxItem(pb.Item(id='b'))),
+            ])
+            assert (await first.receive())['body'] == {'id': 'a'}
+            assert (await second.receive())['body'] == {'id': 'b'}
+
+            await sync_to_async(send_committed_and_rolled_back)()
+            assert (await first.receive())['body'] == {'id': 'committed'}
+            assert await first.nothing()
+    # many.b is sharded, many.a a plain group
+    with override_settings(PSD_SHARDED_GROUPS=['many.b']):
+        run(main())
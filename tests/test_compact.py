@@ -0,0 +1,42 @@
+import proto.messages as pb
+import proto_socket_django as psd
+from proto_socket_django.betterproto_patch import FIELD_NUMBERS
+
+from helpers import Client, run
+
+keys = []
+
+
+class CompactReceiver(psd.FPSReceiver):
+    @psd.receive(concurrency='ordered', key=lambda m: keys.append(m.get_field('id')))
+    def get_item(self, message: pb.RxGetItem):
+        self.consumer.send_message(pb.TxItem(pb.Item(id=message.proto.id, nested=pb.Nested(test='t', n=2))))
+
+
+class Consumer(psd.ApiWebsocketConsumer):
+    receivers = [CompactReceiver]
+
+
+def test_to_dict_with_field_numbers():
+    book = pb.Book(id='b', title='Title', status=pb.Status.published)
+    assert book.to_dict(FIELD_NUMBERS) == {'1': 'b', '4': 'Title', '6': 1}
+    assert pb.Book().from_dict({'1': 'b', '6': 1}).status == pb.Status.published
+
+
+def test_get_field_of_compact_bodies():
+    message = pb.RxGetItem(pb.RxMessageData({'headers': {'messageType': 'get-item'}, 'body': {'1': 'compact'}}))
+    assert message.get_field('id') == 'compact'
+    message = pb.RxGetItem(pb.RxMessageData({'headers': {'messageType': 'get-item'}, 'body': {'id': 'named'}}))
+    assert message.get_field('id') == 'named'
+
+
+def test_compact_bodies_over_a_connection():
+    async def main():
+        keys.clear()
+        async with Client(Consumer) as client:
+            await client.send('get-item', {'1': 'x'}, uuid='u1', ack=True, compactBodies=True)
+            frames = await client.receive_until(lambda f: f['headers']['messageType'] == 'ack')
+            # the ack is compact too
+            assert [f['body'] for f in frames] == [{'1': 'x', '3': {'1': 't', '2': 2}}, {'1': 'u1'}]
+            assert keys == ['x']
+    run(main())
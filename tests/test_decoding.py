@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+import proto.messages as pb
+import proto_socket_django as psd
+
+from helpers import Client, acked, run
+
+
+# read when the handler is decorated - without it, unauthorized messages close the connection
+with override_settings(PSD_FORWARD_EXCEPTIONS=True):
+    class AuthReceiver(psd.FPSReceiver):
+        @psd.receive(auth=True)
+        def get_items(self, message: pb.RxGetItems):
+            self.consumer.send_message(pb.TxItem(pb.Item(id=str(message.proto.count))))
+
+
+class Consumer(psd.ApiWebsocketConsumer):
+    receivers = [AuthReceiver]
+
+
+def count_decodes(monkeypatch) -> list:
+    decoded = []
+    from_dict = pb.GetItems.from_dict
+
+    def _from_dict(self, value):
+        decoded.append(value)
+        return from_dict(self, value)
+    monkeypatch.setattr(pb.GetItems, 'from_dict', _from_dict)
+    return decoded
+
+
+def test_unauthorized_messages_are_not_decoded(monkeypatch):
+    decoded = count_decodes(monkeypatch)
+    user, _ = get_user_model().objects.get_or_create(username='decoder')
+    token = str(AccessToken.for_user(user))
+
+    async def main():
+        async with Client(Consumer) as client:
+            await client.send('get-items', {'count': 2}, uuid='anonymous', ack=True)
+            frames = await client.receive_until(acked('anonymous'))
+            assert 'unauthorized' in frames[-1]['body']['errorMessage']
+            await client.send('get-items', {'count': 3}, uuid='user', ack=True, authHeader=token)
+            frames = await client.receive_until(acked('user'))
+            assert frames[0]['body'] == {'id': '3'}
+        assert decoded == [{'count': 3}]
+    run(main())
+
+
+def test_get_field_decodes_only_that_field():
+    message = pb.RxGetItem(pb.RxMessageData({'headers': {'messageType': 'get-item'}, 'body': {'id': 'x'}}))
+    assert message.get_field('id') == 'x'
+    assert 'proto' not in vars(message)
+    assert message.proto.id == 'x'
@@ -0,0 +1,151 @@
+import time
+
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.tokens import AccessToken
+
+import proto.messages as pb
+import proto_socket_django as psd
+
+from helpers import Client, acked, run
+
+log = []
+
+
+class ItemReceiver(psd.FPSReceiver):
+    @psd.receive()
+    def get_item(self, message: pb.RxGetItem):
+        log.append(message.proto.id)
+        self.consumer.send_message(pb.TxItem(pb.Item(id=message.proto.id)))
+
+
+class ParallelReceiver(psd.FPSReceiver):
+    @psd.receive(concurrency='parallel')
+    def get_item(self, message: pb.RxGetItem):
+        time.sleep(0.3 if message.proto.id == 'slow' else 0)
+        self.consumer.send_message(pb.TxItem(pb.Item(id=message.proto.id)))
+
+
+class OrderedReceiver(psd.FPSReceiver):
+    @psd.receive(concurrency='ordered', key=lambda m: m.get_field('id').split('-')[0])
+    def get_item(self, message: pb.RxGetItem):
+        time.sleep(0.02)
+        log.append(message.proto.id)
+
+
+class Consumer(psd.ApiWebsocketConsumer):
+    receivers = [ItemReceiver]
+
+
+class ParallelConsumer(psd.ApiWebsocketConsumer):
+    receivers = [ParallelReceiver]
+
+
+class OrderedConsumer(psd.ApiWebsocketConsumer):
+    receivers = [OrderedReceiver]
+
+
+def test_connect_and_ack():
+    async def main():
+        async with Client(Consumer) as client:
+            await client.send('get-item', {'id': 'a'}, uuid='u1', ack=True)
+            frames = await client.receive_until(acked('u1'))
+            assert [(f['headers']['messageType'], f['body']) for f in frames] == [
+                ('item', {'id': 'a'}), ('ack', {'uuid': 'u1'})]
+            assert frames[0]['headers']['uuid'] == 'u1'
+    run(main())
+
+
+def test_parallel_handlers_dont_wait_for_slow_ones():
+    async def main():
+        async with Client(ParallelConsumer) as client:
+            await client.send('get-item', {'id': 'slow'}, uuid='slow', ack=True)
+            await client.send('get-item', {'id': 'fast'}, uuid='fast', ack=True)
+            frames = await client.receive_until(acked('slow'))
+            items = [f['body']['id'] for f in frames if f['headers']['messageType'] == 'item']
+            assert items == ['fast', 'slow']
+    run(main())
+
+
+def test_ordered_handlers_keep_order_per_key():
+    async def main():
+        log.clear()
+        async with Client(OrderedConsumer) as client:
+            ids = ['a-1', 'b-1', 'a-2', 'b-2', 'a-3']
+            for i in ids:
+                await client.send('get-item', {'id': i}, uuid=i, ack=True)
+            await client.receive_until(lambda f: len(log) == len(ids) and acked('a-3')(f) or False, 5)
+        assert [i for i in log if i.startswith('a')] == ['a-1', 'a-2', 'a-3']
+        assert [i for i in log if i.startswith('b')] == ['b-1', 'b-2']
+    run(main())
+
+
+key_calls = []
+
+
+def failing_key(message):
+    key_calls.append(message.get_field('id'))
+    raise ValueError('no key')
+
+
+class GuardedReceiver(psd.FPSReceiver):
+    @psd.receive(auth=True, concurrency='ordered', key=lambda m: key_calls.append(m.get_field('id')))
+    def get_item(self, message: pb.RxGetItem):
+        log.append(message.proto.id)
+
+
+class FailingKeyReceiver(psd.FPSReceiver):
+    @psd.receive(concurrency='ordered', key=failing_key)
+    def get_items(self, message: pb.RxGetItems):
+        log.append('items')
+
+
+class GuardedConsumer(psd.ApiWebsocketConsumer):
+    receivers = [ItemReceiver, GuardedReceiver, FailingKeyReceiver]
+
+
+def test_order_key_is_read_after_authorization():
+    async def main():
+        log.clear()
+        key_calls.clear()
+        async with Client(GuardedConsumer) as client:
+            await client.send('get-item', {'id': 'anonymous'}, uuid='u1')
+            await client.receive_until(lambda f: f['headers']['messageType'] == 'item')
+            assert key_calls == []
+            assert log == ['anonymous']  # only the serial receiver
+
+            # the key function fails: reported, the handler doesn't run and the connection stays open
+            await client.send('get-items', {'count': 1}, uuid='u2')
+            await client.send('get-item', {'id': 'next'}, uuid='u3')
+            frames = await client.receive_until(lambda f: f['headers']['messageType'] == 'item')
+            assert frames[-1]['body'] == {'id': 'next'}
+            assert 'items' not in log
+    run(main())
+
+
+keyed = []
+
+
+class PermissionReceiver(psd.FPSReceiver):
+    @psd.receive(permissions=['testapp.view_book'], concurrency='ordered', key=keyed.append)
+    def get_item(self, message: pb.RxGetItem):
+        assert message is keyed[-1]
+        self.consumer.send_message(pb.TxItem(pb.Item(id=message.proto.id)))
+
+
+class PermissionConsumer(psd.ApiWebsocketConsumer):
+    receivers = [PermissionReceiver]
+
+
+def test_ordered_messages_are_authorized_once(monkeypatch):
+    user, _ = get_user_model().objects.get_or_create(username='ordered')
+    token = str(AccessToken.for_user(user))
+    checks = []
+    monkeypatch.setattr(get_user_model(), 'has_perms', lambda self, perms, obj=None: checks.append(perms) or True)
+
+    async def main():
+        async with Client(PermissionConsumer) as client:
+            await client.send('get-item', {'id': 'once'}, uuid='u', ack=True, authHeader=token)
+            frames = await client.receive_until(acked('u'))
+            assert [f['body'] for f in frames if f['headers']['messageType'] == 'item'] == [{'id': 'once'}]
+    run(main())
+    assert checks == [['testapp.view_book']]
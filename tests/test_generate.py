@@ -0,0 +1,48 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def generate(project, *args) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(HERE))
+    return subprocess.run([sys.executable, '-m', 'proto_socket_django', 'generate', *args], cwd=str(project), env=env,
+                          capture_output=True, text=True, timeout=120)
+
+
+@pytest.fixture
+def project(tmp_path):
+    project = tmp_path / 'project'
+    shutil.copytree(os.path.join(HERE, 'project'), str(project), ignore=shutil.ignore_patterns('__pycache__'))
+    assert generate(project).returncode == 0
+    return project
+
+
+def test_only_changed_protos_are_regenerated(project):
+    assert generate(project, '--check').returncode == 0
+    mtimes = {p.name: p.stat().st_mtime_ns for p in (project / 'proto').iterdir()}
+
+    with open(str(project / 'protos' / 'tests.proto'), 'a') as f:
+        f.write('message Extra {\n  string id = 1;\n}\n')
+    result = generate(project, '--check')
+    assert result.returncode == 1 and 'changed: protos/tests.proto' in result.stdout
+
+    assert generate(project).returncode == 0
+    changed = {p.name for p in (project / 'proto').iterdir() if p.stat().st_mtime_ns != mtimes.get(p.name)}
+    assert {'tests.py', 'messages.py'} <= changed
+    assert 'sfiles.py' not in changed and 'testproject_testapp.py' not in changed
+    assert generate(project, '--check').returncode == 0
+
+
+def test_platforms_are_chosen_explicitly(project):
+    result = generate(project, '--platforms', 'django,bogus')
+    assert result.returncode == 1 and "unknown platforms ['bogus']" in result.stdout
+
+    result = generate(project, '--platforms', 'django')
+    assert result.returncode == 0
+    # timings of each platform's stages
+    assert any(line.split()[:1] == ['django'] for line in result.stdout.splitlines())
@@ -0,0 +1,100 @@
+import os
+import socket
+import struct
+
+import msgpack
+import pytest
+from asgiref.sync import sync_to_async
+from channels.exceptions import ChannelFull
+from django.test import override_settings
+
+import proto.messages as pb
+import proto_socket_django as psd
+from proto_socket_django.layers import HostChannelLayer
+
+from helpers import Client, acked, run
+
+
+class GroupReceiver(psd.FPSReceiver):
+    @psd.receive()
+    def get_item(self, message: pb.RxGetItem):
+        self.consumer.add_group(message.proto.id)
+
+
+class Consumer(psd.ApiWebsocketConsumer):
+    receivers = [GroupReceiver]
+
+
+def test_refuses_a_socket_dir_others_can_access(tmp_path):
+    path = tmp_path / 'layer'
+    path.mkdir(mode=0o777)
+    os.chmod(path, 0o777)
+    layer = HostChannelLayer(path=str(path))
+    with pytest.raises(RuntimeError, match='mode 0700'):
+        layer.start()
+    assert layer.pid is None
+
+    os.symlink(str(path), str(tmp_path / 'link'))
+    with pytest.raises(RuntimeError, match='not a directory'):
+        HostChannelLayer(path=str(tmp_path / 'link')).start()
+
+
+def test_send_to_a_full_channel_raises(tmp_path):
+    layer = HostChannelLayer(path=str(tmp_path / 'layer'), capacity=2)
+
+    async def main():
+        channel = await layer.new_channel()
+        await layer.send(channel, {'type': 'a'})
+        await layer.send(channel, {'type': 'b'})
+        with pytest.raises(ChannelFull):
+            await layer.send(channel, {'type': 'c'})
+        # full group members miss the message
+        await layer.group_add('group', channel)
+        await layer.group_send('group', {'type': 'd'})
+        assert [(await layer.receive(channel))['type'] for _ in range(2)] == ['a', 'b']
+        await layer.close()
+    run(main())
+    assert os.stat(str(tmp_path / 'layer')).st_mode & 0o777 == 0o700
+
+
+def test_frames_are_msgpack():
+    items = [('group', 'g', {'type': 'broadcast.message', 'event': {'body': {'id': 'x'}}, 'blob': b'\x00\x01'})]
+    data = HostChannelLayer.frame(items)
+    assert msgpack.unpackb(data[4:], raw=False) == [list(item) for item in items]
+
+
+def test_sends_wait_for_the_connection(tmp_path):
+    layer = HostChannelLayer(path=str(tmp_path / 'layer'))
+    layer.start()
+    # a process that started after the layer's last scan
+    pid = layer.pid + 100000
+    server = socket.socket(socket.AF_UNIX)
+    server.bind(str(tmp_path / 'layer' / '{}.sock'.format(pid)))
+    server.listen(1)
+    server.settimeout(5)
+    layer.send_nowait('specific.{}x{}!a'.format(pid, layer.host), {'type': 'a'})
+    connection, _ = server.accept()
+    with connection, server:
+        connection.settimeout(5)
+        data = b''
+        while len(data) < 8 or len(data) < 8 + struct.unpack('>I', data[4:8])[0]:
+            data += connection.recv(65536)
+    assert struct.unpack('>I', data[:4]) == (layer.pid,)
+    assert msgpack.unpackb(data[8:], raw=False) == [['send', 'specific.{}x{}!a'.format(pid, layer.host), {'type': 'a'}]]
+
+
+def test_broadcast_reaches_group_members(tmp_path):
+    layers = {'default': {'BACKEND': 'proto_socket_django.layers.HostChannelLayer',
+                          'CONFIG': {'path': str(tmp_path / 'layer')}}}
+
+    async def main():
+        async with Client(Consumer) as first, Client(Consumer) as second:
+            for client in (first, second):
+                await client.send('get-item', {'id': 'items'}, uuid='join', ack=True)
+                await client.receive_until(acked('join'))
+            await sync_to_async(psd.ApiWebsocketConsumer.broadcast)('items', pb.TxItem(pb.Item(id='new')))
+            for client in (first, second):
+                frame = await client.receive()
+                assert (frame['headers']['messageType'], frame['body']) == ('item', {'id': 'new'})
+    with override_settings(CHANNEL_LAYERS=layers):
+        run(main())
@@ -0,0 +1,68 @@
+import time
+
+from asgiref.sync import sync_to_async
+
+import proto.messages as pb
+import proto_socket_django as psd
+from proto_socket_django.loader import Loader
+from testapp.models import Author
+
+from helpers import Client, run
+
+
+class AuthorReceiver(psd.FPSReceiver):
+    @psd.receive(concurrency='parallel')
+    def get_item(self, message: pb.RxGetItem):
+        author = self.consumer.loader.load(Author, message.proto.id)
+        self.consumer.send_message(pb.TxItem(pb.Item(id=author.name if author is not None else 'missing')))
+
+    @psd.receive(concurrency='parallel')
+    def get_items(self, message: pb.RxGetItems):
+        # keeps the connection busy
+        time.sleep(message.proto.count / 1000)
+
+
+class Consumer(psd.ApiWebsocketConsumer):
+    receivers = [AuthorReceiver]
+
+
+def count_fetches(monkeypatch) -> list:
+    fetches = []
+    fetch = Loader._fetch
+
+    def _fetch(self):
+        fetches.append(dict(self.batch.keys))
+        fetch(self)
+    monkeypatch.setattr(Loader, '_fetch', _fetch)
+    return fetches
+
+
+def test_concurrent_loads_are_batched(monkeypatch):
+    authors = [Author.objects.create(name='author-{}'.format(i)) for i in range(4)]
+    fetches = count_fetches(monkeypatch)
+
+    async def main():
+        async with Client(Consumer) as client:
+            ids = [a.id for a in authors] + [authors[0].id, 'missing-id']
+            for i in ids:
+                await client.send('get-item', {'id': i})
+            names = [(await client.receive())['body']['id'] for _ in ids]
+            assert sorted(names) == sorted([a.name for a in authors] + [authors[0].name, 'missing'])
+    run(main())
+    # PSD_CONNECTION_CONCURRENCY = 4 handlers at once, waiting ones don't count
+    assert len(fetches) < 4
+
+
+def test_loads_after_a_batch_see_current_rows():
+    author = Author.objects.create(name='before')
+
+    async def main():
+        async with Client(Consumer) as client:
+            # the connection never goes idle in between
+            await client.send('get-items', {'count': 500})
+            await client.send('get-item', {'id': author.id})
+            assert (await client.receive())['body'] == {'id': 'before'}
+            await sync_to_async(Author.objects.filter(pk=author.pk).update)(name='after')
+            await client.send('get-item', {'id': author.id})
+            assert (await client.receive())['body'] == {'id': 'after'}
+    run(main())
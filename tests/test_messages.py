@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+import proto.messages as pb
+from proto_socket_django.gen.platforms.django import messages_generator
+from proto_socket_django.gen.platforms.schema import SpecError
+
+PROJECT = os.path.dirname(os.path.dirname(os.path.abspath(pb.__file__)))
+
+
+def run_fresh(code: str) -> str:
+    # a new interpreter, no proto package is loaded yet
+    result = subprocess.run([sys.executable, '-c', textwrap.dedent(code)], cwd=PROJECT, capture_output=True,
+                            text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.strip()
+
+
+def test_names_load_only_their_package():
+    assert run_fresh('''
+        import proto.messages as pb
+        pb.Nested
+        try:
+            pb.Unknown
+        except AttributeError:
+            pass
+        print(sorted(pb._loaded))
+    ''') == "['tests']"
+
+
+def test_conflicting_names_raise():
+    assert run_fresh('''
+        import types
+        import proto.messages as pb
+        module = types.ModuleType('proto.other')
+        exec('class Item: pass', vars(module))
+        pb._packages['other'] = lambda: (module, [])
+        pb.load_package('tests')
+        try:
+            pb.load_package('other')
+        except ImportError as e:
+            print(e)
+    ''').startswith('Item of proto package other conflicts with')
+
+
+def test_generate_rejects_names_defined_twice(tmp_path):
+    for package in ('first', 'second'):
+        (tmp_path / (package + '.proto')).write_text('syntax = "proto3";\npackage {};\nmessage Item {{\n}}\n'.format(
+            package))
+    with pytest.raises(SpecError, match='Item is defined by first as well'):
+        messages_generator.generate([str(tmp_path / 'first.proto'), str(tmp_path / 'second.proto')], str(tmp_path))
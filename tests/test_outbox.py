@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+
+from proto_socket_django.outbox import BULK, CONTROL, INTERACTIVE, Outbox
+
+
+def test_control_frames_go_ahead_of_waiting_bulk_frames():
+    outbox = Outbox()
+    sent = []
+    sending = threading.Event()
+    release = threading.Event()
+
+    def first():
+        sending.set()
+        release.wait()
+        sent.append('first')
+
+    def send(name: str, priority: str):
+        thread = threading.Thread(target=outbox.send, args=(lambda: sent.append(name), priority))
+        thread.start()
+        return thread
+
+    threads = [threading.Thread(target=outbox.send, args=(first,))]
+    threads[0].start()
+    sending.wait()
+    for name, priority in [('bulk-1', BULK), ('bulk-2', BULK), ('ack', CONTROL), ('message', None)]:
+        threads.append(send(name, priority))
+        time.sleep(0.02)  # queued in this order
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert sent == ['first', 'ack', 'message', 'bulk-1', 'bulk-2']
+
+
+def test_async_senders_wait_for_their_turn():
+    outbox = Outbox()
+    sent = []
+    sending = threading.Event()
+    release = threading.Event()
+
+    def first():
+        sending.set()
+        release.wait()
+        sent.append('first')
+
+    async def append(name: str):
+        sent.append(name)
+
+    async def main():
+        thread = threading.Thread(target=outbox.send, args=(first,))
+        thread.start()
+        await asyncio.get_running_loop().run_in_executor(None, sending.wait)
+        broadcast = asyncio.ensure_future(outbox.send_async(lambda: append('broadcast'), INTERACTIVE))
+        cancelled = asyncio.ensure_future(outbox.send_async(lambda: append('cancelled'), INTERACTIVE))
+        await asyncio.sleep(0.02)
+        cancelled.cancel()
+        ack = threading.Thread(target=outbox.send, args=(lambda: sent.append('ack'), CONTROL))
+        ack.start()
+        await asyncio.sleep(0.02)
+        release.set()
+        await broadcast
+        await asyncio.get_running_loop().run_in_executor(None, ack.join, 5)
+        # the cancelled sender's turn is passed on
+        await outbox.send_async(lambda: append('last'))
+    asyncio.run(asyncio.wait_for(main(), 5))
+    assert sent == ['first', 'ack', 'broadcast', 'last']
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from proto_socket_django.gen.platforms.schema import SpecError, parse_proto
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROTO = '''syntax = "proto3";
+package demo;
+option optimize_for = SPEED;
+
+// message Commented {
+/*
+type = 'get-data'
+origin = client
+ */
+message GetData {
+  string id = 1;  // message inside a comment
+  string note = 2 [json_name = "message { x"];
+}
+
+/* plain documentation */
+message Nested {
+  /*
+  type = 'nested'
+  origin = server
+   */
+  message Inner {}
+}
+option java_package = "com.example";
+'''
+
+
+def test_parse_specs():
+    with pytest.raises(SpecError) as error:
+        parse_proto('demo.proto', PROTO)
+    assert error.value.errors == ['demo.proto:17: specs of nested messages (Inner) are not supported']
+
+    messages = parse_proto('demo.proto', PROTO.replace("type = 'nested'\n  origin = server", ''))
+    assert [(m.proto, m.type, m.origin, m.line) for m in messages] == [('GetData', 'get-data', 'client', 6)]
+
+
+def test_trailing_text_after_the_last_token_parses_in_linear_time():
+    # the token pattern used to backtrack exponentially on text after the last token
+    code = textwrap.dedent('''
+        import sys
+        sys.argv = ['-m']  # proto_socket_django without generated messages
+        from proto_socket_django.gen.platforms.schema import parse_proto
+        assert parse_proto('a.proto', 'message A {}\\n' + ' ' * 100000) == []
+        assert len(parse_proto('b.proto', %r * 500)) == 500
+    ''') % ("/*\ntype = 'a'\norigin = client\n */\nmessage A {}\noption optimize_for = SPEED;\n",)
+    subprocess.run([sys.executable, '-c', code], check=True, timeout=20, cwd=ROOT)
@@ -0,0 +1,60 @@
+import datetime
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+
+import betterproto
+from django.test import override_settings
+
+import proto.messages as pb
+import proto.testproject_testapp as app_pb
+from testapp.models import Author, Book
+
+PROJECT = os.path.dirname(os.path.dirname(os.path.abspath(pb.__file__)))
+
+
+@dataclass(eq=False, repr=False)
+class BookSummary(betterproto.Message):
+    title: str = betterproto.string_field(1)
+    author: app_pb.Author = betterproto.message_field(2)
+
+
+def test_bench_serialize():
+    Book.objects.create(title='bench', author=Author.objects.create(name='bench'))
+    result = subprocess.run([sys.executable, '-m', 'proto_socket_django', 'bench-serialize', 'testapp.Book',
+                             '--rows', '10', '--runs', '1', '--settings', 'testproject.settings'],
+                            cwd=PROJECT, capture_output=True, text=True, timeout=60,
+                            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert [line.split()[0] for line in result.stdout.splitlines()] == ['query', 'query', 'to_proto_many', 'to_dict',
+                                                                         'from_dict']
+
+
+def test_to_proto_many_matches_to_proto():
+    author = Author.objects.create(name='many')
+    books = [
+        Book.objects.create(title='full', pages=3, status='published', author=author, cover='covers/a.png',
+                            released=datetime.date(2020, 1, 2),
+                            published=datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)),
+        Book.objects.create(title='empty'),
+    ]
+    queryset = Book.objects.filter(pk__in=[b.pk for b in books]).order_by('title')
+    many = Book.to_proto_many(queryset)
+    assert many == [book.to_proto() for book in queryset]
+    assert [proto.to_dict() for proto in many] == [book.to_proto().to_dict() for book in queryset]
+    # choices are enum members, as from_dict would set them
+    status = many[0].status
+    assert isinstance(status, betterproto.Enum) and status == type(status).from_string(status.name)
+    assert many[0] == app_pb.Book().from_dict(many[0].to_dict())
+
+
+
+def test_to_proto_loads_only_what_the_proto_needs():
+    book = Book.objects.create(title='planned', pages=7, author=Author.objects.create(name='planned'))
+    queryset = Book.objects.filter(pk=book.pk)
+    # the author is joined, serializing issues no queries
+    with override_settings(PSD_ASSERT_SERIALIZATION_QUERIES=True):
+        summary, = queryset.to_proto(BookSummary, lambda b: BookSummary(title=b.title, author=b.author.to_proto()))
+    assert (summary.title, summary.author.id, summary.author.name) == ('planned', book.author_id, 'planned')
+    assert {'pages', 'cover', 'released'} <= queryset.for_proto(BookSummary).get().get_deferred_fields()
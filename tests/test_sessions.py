@@ -0,0 +1,101 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.tokens import AccessToken
+
+import proto.messages as pb
+import proto_socket_django as psd
+
+from helpers import Client, acked, run
+
+
+class GroupReceiver(psd.FPSReceiver):
+    @psd.receive()
+    def get_item(self, message: pb.RxGetItem):
+        self.consumer.add_group(message.proto.id)
+
+    @psd.receive(concurrency='parallel')
+    def get_items(self, message: pb.RxGetItems):
+        for i in range(message.proto.count):
+            self.consumer.send_message(pb.TxItem(pb.Item(id='own-{}'.format(i))))
+
+
+class Consumer(psd.ApiWebsocketConsumer):
+    receivers = [GroupReceiver]
+
+
+def token(username: str) -> str:
+    user, _ = get_user_model().objects.get_or_create(username=username)
+    return str(AccessToken.for_user(user))
+
+
+async def resume(client: Client, session_id: str = '', last_seq: int = 0, **headers) -> dict:
+    await client.send('session-resume', {'sessionId': session_id, 'lastSeq': last_seq}, uuid='resume', **headers)
+    frames = await client.receive_until(lambda f: f['headers']['messageType'] == 'session')
+    return frames[-1]['body']
+
+
+def broadcast(group: str, item_id: str):
+    return sync_to_async(psd.ApiWebsocketConsumer.broadcast)(group, pb.TxItem(pb.Item(id=item_id)))
+
+
+def test_resume_replays_missed_broadcasts():
+    async def main():
+        async with Client(Consumer) as client:
+            session = await resume(client)
+            assert not session.get('resumed')
+            await client.send('get-item', {'id': 'session-group'}, uuid='join', ack=True)
+            frames = await client.receive_until(acked('join'))
+            last_seq = frames[-1]['headers']['seq']
+        await broadcast('session-group', 'missed')
+
+        async with Client(Consumer) as client:
+            assert (await resume(client, session['sessionId'], last_seq))['resumed']
+            frame = await client.receive()
+            assert frame['body'] == {'id': 'missed'}
+            assert frame['headers']['seq'] == last_seq + 1
+            # the group was kept
+            await broadcast('session-group', 'live')
+            assert (await client.receive())['body'] == {'id': 'live'}
+    run(main())
+
+
+def test_only_the_sessions_user_can_resume_it():
+    async def main():
+        user_token = await sync_to_async(token)('session-user')
+        async with Client(Consumer) as client:
+            session = await resume(client, authHeader=user_token)
+        session_id = session['sessionId']
+
+        # the session id is no credential
+        async with Client(Consumer) as client:
+            assert not (await resume(client, session_id)).get('resumed')
+        other_token = await sync_to_async(token)('other-user')
+        async with Client(Consumer) as client:
+            assert not (await resume(client, session_id, authHeader=other_token)).get('resumed')
+
+        async with Client(Consumer) as client:
+            assert (await resume(client, session_id, authHeader=user_token))['resumed']
+
+        # anonymous sessions can be resumed by anyone with the id
+        async with Client(Consumer) as client:
+            session_id = (await resume(client))['sessionId']
+        async with Client(Consumer) as client:
+            assert (await resume(client, session_id, authHeader=user_token))['resumed']
+    run(main())
+
+
+def test_broadcasts_and_responses_are_numbered_in_send_order():
+    async def main():
+        async with Client(Consumer) as client:
+            await resume(client)
+            await client.send('get-item', {'id': 'numbered'}, uuid='join', ack=True)
+            await client.receive_until(acked('join'))
+            await client.send('get-items', {'count': 50}, uuid='items')
+            for i in range(50):
+                await broadcast('numbered', 'broadcast-{}'.format(i))
+            frames = []
+            while len([f for f in frames if f['headers']['messageType'] == 'item']) < 100:
+                frames.append(await client.receive())
+            seqs = [f['headers']['seq'] for f in frames]
+            assert seqs == list(range(seqs[0], seqs[0] + len(seqs)))
+    run(main())
@@ -0,0 +1,123 @@
+from django.test import override_settings
+
+import proto.messages as pb
+import proto_socket_django as psd
+from proto_socket_django.utils import stream_queryset
+from testapp.models import Author
+
+from helpers import Client, acked, run
+
+closed = []
+
+
+class StreamReceiver(psd.FPSReceiver):
+    @psd.receive()
+    def get_items(self, message: pb.RxGetItems):
+        try:
+            for i in range(message.proto.count):
+                yield pb.TxItem(pb.Item(id=str(i)))
+        finally:
+            closed.append(message.proto.count)
+
+
+class Consumer(psd.ApiWebsocketConsumer):
+    receivers = [StreamReceiver]
+
+
+def chunks(frames):
+    return [(f['headers']['streamSeq'], f['body']['id']) for f in frames if f['headers']['messageType'] == 'item']
+
+
+def test_chunks_are_sent_as_credit_arrives():
+    async def main():
+        async with Client(Consumer) as client:
+            await client.send('get-items', {'count': 5}, uuid='s', streamCredit=2)
+            assert chunks([await client.receive(), await client.receive()]) == [(0, '0'), (1, '1')]
+            assert await client.nothing()
+            # the generator is only advanced (to its end, here) with credit
+            await client.send('stream-credit', {'uuid': 's', 'credit': 4})
+            frames = await client.receive_until(acked('s'))
+            assert chunks(frames) == [(2, '2'), (3, '3'), (4, '4')]
+    run(main())
+
+
+def test_streams_waiting_for_credit_dont_hold_threads():
+    async def main():
+        async with Client(Consumer) as client:
+            # more stalled streams than pool threads (PSD_HANDLER_THREADS = 16)
+            stalled = [str(i) for i in range(20)]
+            for uuid in stalled:
+                await client.send('get-items', {'count': 3}, uuid=uuid, streamCredit=1)
+            await client.send('get-items', {'count': 2}, uuid='last', streamCredit=3)
+            frames = await client.receive_until(acked('last'))
+            assert sorted(f['headers']['uuid'] for f in frames if f['headers']['messageType'] == 'item') == sorted(
+                stalled + ['last', 'last'])
+    run(main())
+
+
+def test_cancel_closes_the_generator():
+    async def main():
+        closed.clear()
+        async with Client(Consumer) as client:
+            await client.send('get-items', {'count': 7}, uuid='s', streamCredit=1)
+            await client.receive()
+            await client.send('stream-credit', {'uuid': 's', 'cancel': True})
+            await client.receive_until(acked('s'))
+            assert closed == [7]
+    run(main())
+
+
+def test_streams_without_credit_time_out():
+    async def main():
+        async with Client(Consumer) as client:
+            await client.send('get-items', {'count': 3}, uuid='s', streamCredit=1)
+            frames = await client.receive_until(acked('s'))
+            assert 'timed out' in frames[-1]['body']['errorMessage']
+    with override_settings(PSD_STREAM_CREDIT_TIMEOUT=0.2, PSD_FORWARD_EXCEPTIONS=True):
+        run(main())
+
+
+def test_streams_dont_need_sync_workers():
+    async def main():
+        async with Client(Consumer) as client:
+            await client.send('get-items', {'count': 2}, uuid='s')
+            frames = await client.receive_until(acked('s'))
+            assert chunks(frames) == [(0, '0'), (1, '1')]
+    sync_workers = psd.ApiWebsocketConsumer.sync_workers
+    psd.ApiWebsocketConsumer.sync_workers = []
+    try:
+        run(main())
+    finally:
+        psd.ApiWebsocketConsumer.sync_workers = sync_workers
+
+
+def test_stream_credit_is_capped():
+    async def main():
+        async with Client(Consumer) as client:
+            await client.send('get-items', {'count': 5}, uuid='s', streamCredit=100)
+            assert len(chunks([await client.receive(), await client.receive()])) == 2
+            assert await client.nothing()
+            await client.send('stream-credit', {'uuid': 's', 'credit': 1000})
+            assert len(chunks([await client.receive(), await client.receive()])) == 2
+            assert await client.nothing()
+            await client.send('stream-credit', {'uuid': 's', 'credit': 2})
+            assert len(chunks(await client.receive_until(acked('s')))) == 1
+    with override_settings(PSD_STREAM_MAX_CREDIT=2):
+        run(main())
+
+
+def test_stream_queryset_fetches_each_chunk():
+    Author.objects.all().delete()
+    names = ['streamed-{}'.format(i) for i in range(5)]
+    for name in names:
+        Author.objects.create(name=name)
+    for queryset in (Author.objects.all(), Author.objects.order_by('-name')):
+        stream = stream_queryset(queryset, lambda chunk: [a.name for a in chunk], chunk_size=2)
+        streamed = []
+        for chunk in stream:
+            # nothing is held open between chunks
+            Author.objects.filter(name=chunk[0]).update(name=chunk[0])
+            streamed.append(chunk)
+        assert [len(chunk) for chunk in streamed] == [2, 2, 1]
+        assert sorted(sum(streamed, [])) == names
+    assert sum(streamed, []) == sorted(names, reverse=True)
@@ -0,0 +1,50 @@
+import threading
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.tokens import AccessToken
+
+import proto.messages as pb
+import proto.testproject_testapp as app_pb
+import proto_socket_django as psd
+import proto_socket_django.subscriptions as subscriptions
+from proto_socket_django.receivers import SubscriptionReceiver
+from testapp.models import Author, Book
+
+from helpers import Client, acked, run
+
+
+class Consumer(psd.ApiWebsocketConsumer):
+    receivers = [SubscriptionReceiver]
+
+
+def changes(frame: dict) -> tuple:
+    assert frame['headers']['messageType'] == 'model-changes'
+    message = pb.ModelChanges().from_dict(frame['body'])
+    return [app_pb.Book().parse(row).title for row in message.rows], message.removed
+
+
+def test_changes_are_pushed_to_filtered_subscriptions(monkeypatch):
+    user, _ = get_user_model().objects.get_or_create(username='subscriber', is_superuser=True)
+    token = str(AccessToken.for_user(user))
+    author, other = Author.objects.create(name='subscribed'), Author.objects.create(name='other')
+    checks = []
+    monkeypatch.setattr(subscriptions, 'close_old_connections', lambda: checks.append(threading.current_thread()))
+
+    async def main():
+        async with Client(Consumer) as client:
+            await client.send('model-subscribe', {'model': 'testapp.Book', 'filter': {'author_id': author.id}},
+                              uuid='subscribe', ack=True, authHeader=token)
+            assert 'errorMessage' not in (await client.receive_until(acked('subscribe')))[-1]['body']
+
+            book = await sync_to_async(Book.objects.create)(title='first', author=author)
+            await sync_to_async(Book.objects.create)(title='elsewhere', author=other)
+            assert changes(await client.receive()) == (['first'], [])
+
+            book.author = other
+            await sync_to_async(book.save)()
+            assert changes(await client.receive()) == ([], [book.id])
+            assert await client.nothing()
+    run(main())
+    # flushed on executor threads, which check their connections
+    assert checks and subscriptions.ChangeFeed.thread not in checks
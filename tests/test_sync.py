@@ -0,0 +1,61 @@
+import proto.messages as pb
+import proto_socket_django as psd
+
+from helpers import Client, run
+
+
+class StateReceiver(psd.FPSReceiver):
+    @psd.receive()
+    def get_item(self, message: pb.RxGetItem):
+        tags = message.proto.id.split(',')
+        self.consumer.send_state(pb.TxItem(pb.Item(id='doc', tags=tags, nested=pb.Nested(test=tags[0], n=1))),
+                                 key='doc')
+
+
+    @psd.receive(concurrency='parallel')
+    def get_items(self, message: pb.RxGetItems):
+        self.consumer.send_state(pb.TxItem(pb.Item(id='counter', tags=[str(message.proto.count)])), key='counter')
+
+
+class Consumer(psd.ApiWebsocketConsumer):
+    receivers = [StateReceiver]
+
+
+def sync_headers(frame: dict) -> dict:
+    return {k: v for k, v in frame['headers'].items() if k.startswith('sync')}
+
+
+def test_state_is_sent_as_patches():
+    async def main():
+        async with Client(Consumer) as client:
+            await client.send('get-item', {'id': 'a'})
+            frame = await client.receive()
+            assert sync_headers(frame) == {'syncKey': 'doc', 'syncVersion': 1}
+            assert frame['body'] == {'id': 'doc', 'tags': ['a'], 'nested': {'test': 'a', 'n': 1}}
+
+            await client.send('get-item', {'id': 'b,c'})
+            frame = await client.receive()
+            assert sync_headers(frame) == {'syncKey': 'doc', 'syncVersion': 2, 'syncBase': 1, 'syncPatch': True}
+            assert frame['body'] == {'set': {'tags': ['b', 'c']}, 'patch': {'nested': {'set': {'test': 'b'}}}}
+
+            # unchanged state isn't resent
+            await client.send('get-item', {'id': 'b,c'})
+            assert await client.nothing()
+
+            await client.send('sync-resync', {'messageType': 'item', 'key': 'doc'})
+            frame = await client.receive()
+            assert sync_headers(frame) == {'syncKey': 'doc', 'syncVersion': 2}
+            assert frame['body'] == {'id': 'doc', 'tags': ['b', 'c'], 'nested': {'test': 'b', 'n': 1}}
+    run(main())
+
+
+def test_parallel_updates_are_sent_in_version_order():
+    async def main():
+        async with Client(Consumer) as client:
+            for i in range(40):
+                await client.send('get-items', {'count': i})
+            frames = [await client.receive() for _ in range(40)]
+            versions = [sync_headers(frame) for frame in frames]
+            assert [v['syncVersion'] for v in versions] == list(range(1, 41))
+            assert all(v.get('syncBase', 0) == v['syncVersion'] - 1 for v in versions)
+    run(main())
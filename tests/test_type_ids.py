@@ -0,0 +1,37 @@
+from asgiref.sync import sync_to_async
+
+import proto.messages as pb
+import proto_socket_django as psd
+
+from helpers import Client, run
+
+
+class ItemReceiver(psd.FPSReceiver):
+    @psd.receive()
+    def get_item(self, message: pb.RxGetItem):
+        self.consumer.add_group(message.proto.id)
+        self.consumer.send_message(pb.TxItem(pb.Item(id=message.proto.id)))
+
+
+class Consumer(psd.ApiWebsocketConsumer):
+    receivers = [ItemReceiver]
+
+
+def test_numeric_message_types():
+    assert pb.rx_message_types[pb.RxGetItem.type_id] == 'get-item'
+    assert pb.tx_message_type_ids['item'] == pb.TxItem.type_id
+
+    async def main():
+        async with Client(Consumer) as client:
+            # accepted always, sent once the client asks for them
+            await client.communicator.send_json_to(
+                {'headers': {'messageType': pb.RxGetItem.type_id}, 'body': {'id': 'a'}})
+            assert (await client.receive())['headers']['messageType'] == 'item'
+
+            await client.send('get-item', {'id': 'ids'}, uuid='u', ack=True, messageTypeIds=True)
+            frames = await client.receive_until(lambda f: f['body'].get('uuid') == 'u')
+            assert [f['headers']['messageType'] for f in frames] == [pb.TxItem.type_id, pb.TxAck.type_id]
+
+            await sync_to_async(psd.ApiWebsocketConsumer.broadcast)('ids', pb.TxItem(pb.Item(id='broadcast')))
+            assert (await client.receive())['headers']['messageType'] == pb.TxItem.type_id
+    run(main())
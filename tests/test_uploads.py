@@ -0,0 +1,139 @@
+import base64
+import io
+import json
+import os
+import threading
+import uuid
+
+import pytest
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+import proto_socket_django as psd
+from proto_socket_django import views
+from proto_socket_django.derivatives import Derivatives, generate
+from proto_socket_django.dispatch import HandlerDispatcher
+from proto_socket_django.receivers import UploadReceiver
+from proto_socket_django.uploads import Upload
+
+from helpers import Client, acked, run
+
+
+class Consumer(psd.ApiWebsocketConsumer):
+    receivers = [UploadReceiver]
+
+
+def test_uuid_owners_survive_a_restart(tmp_path):
+    owner = uuid.uuid4()
+    with override_settings(PSD_UPLOAD_DIR=str(tmp_path)):
+        key = Upload.start(owner, 'local', size=4).key
+        Upload.uploads.pop(key)
+        assert Upload.get(key).user_id == str(owner)
+
+
+def test_upload_over_a_connection(tmp_path, monkeypatch):
+    monkeypatch.setattr(Upload, 'meta_save_interval', 0)
+    user, _ = get_user_model().objects.get_or_create(username='uploader')
+    token = str(AccessToken.for_user(user))
+
+    async def start(client: Client) -> dict:
+        await client.send('upload-start', {'localKey': 'photo', 'extension': 'txt', 'size': 4}, authHeader=token)
+        return (await client.receive())['body']
+
+    async def main():
+        async with Client(Consumer) as client:
+            slot = await start(client)
+            data = base64.b64encode(b'data').decode()
+            await client.send('upload-chunk', {'key': slot['key'], 'data': data}, uuid='chunk', ack=True,
+                              authHeader=token)
+            await client.receive_until(acked('chunk'))
+        # as after a restart, the owner is read back from the json metadata
+        await sync_to_async(Upload.uploads.clear)()
+
+        async with Client(Consumer) as client:
+            assert (await start(client)) == dict(slot, offset='4')
+            await client.send('upload-end', {'key': slot['key']}, authHeader=token)
+            frames = await client.receive_until(lambda f: f['headers']['messageType'] == 'upload-done')
+            assert frames[-1]['body']['file']['localKey'] == 'photo'
+    with override_settings(PSD_UPLOAD_DIR=str(tmp_path / 'parts'), MEDIA_ROOT=str(tmp_path / 'media'),
+                           PSD_UPLOAD_DERIVATIVES=False):
+        run(main())
+
+
+def test_derivatives_follow_the_upload(tmp_path):
+    image = pytest.importorskip('PIL.Image')
+    png = io.BytesIO()
+    image.new('RGB', (600, 300), 'red').save(png, 'PNG')
+    data = png.getvalue()
+    user, _ = get_user_model().objects.get_or_create(username='uploader')
+    token = str(AccessToken.for_user(user))
+
+    async def main():
+        async with Client(Consumer) as client:
+            await client.send('upload-start', {'localKey': 'image', 'extension': 'png', 'size': len(data)},
+                              authHeader=token)
+            key = (await client.receive())['body']['key']
+            await client.send('upload-chunk', {'key': key, 'data': base64.b64encode(data).decode()}, uuid='chunk',
+                              ack=True, authHeader=token)
+            await client.receive_until(acked('chunk'))
+            await client.send('upload-end', {'key': key}, authHeader=token)
+            frames = await client.receive_until(lambda f: 'thumbUrl' in f['body'].get('file', {}), 10)
+            done = [f['body']['file'] for f in frames if f['headers']['messageType'] == 'upload-done']
+            # sent once the original is stored, again with the derivatives
+            assert ['thumbUrl' in f for f in done] == [False, True]
+            assert done[-1]['metadata']['width'] == '600'
+    with override_settings(PSD_UPLOAD_DIR=str(tmp_path / 'parts'), MEDIA_ROOT=str(tmp_path / 'media')):
+        run(main())
+
+
+def test_derivatives_are_cached_by_size(tmp_path):
+    image = pytest.importorskip('PIL.Image')
+    path = str(tmp_path / 'image.png')
+    image.new('RGB', (600, 300), 'red').save(path, 'PNG')
+    small = generate(path, str(tmp_path / 'cache'), (64, 64), (128, 128))
+    large = generate(path, str(tmp_path / 'cache'), (128, 128), (256, 256))
+    assert small['hash'] == large['hash'] and small['dir'] != large['dir']
+    with image.open(os.path.join(large['dir'], 'thumb.jpg')) as thumb:
+        assert thumb.size == (128, 64)
+    assert generate(path, str(tmp_path / 'cache'), (64, 64), (128, 128)) == small
+
+
+def test_derivatives_are_stored_on_the_handler_pool(tmp_path):
+    (tmp_path / 'media').mkdir()
+    (tmp_path / 'media' / 'file.txt').write_bytes(b'text')
+    done = threading.Event()
+    threads = []
+
+    def callback(derivatives):
+        threads.append(threading.current_thread())
+        done.set()
+    with override_settings(MEDIA_ROOT=str(tmp_path / 'media')):
+        Derivatives.submit('file.txt', callback)
+        assert done.wait(10)
+    assert threads[0] in HandlerDispatcher.get_pool()._threads
+
+
+def test_uploads_are_limited_in_size(tmp_path):
+    with override_settings(PSD_UPLOAD_DIR=str(tmp_path), PSD_UPLOAD_MAX_SIZE=10):
+        with pytest.raises(Exception, match='over the limit'):
+            Upload.start('owner', 'too-large', size=11)
+        # the size is unknown, the limit still applies
+        upload = Upload.start('owner', 'unknown-size')
+        assert upload.write(0, b'x' * 10) == 10
+        with pytest.raises(Exception, match='out of bounds'):
+            upload.write(1 << 40, b'x')
+        assert os.path.getsize(upload.part_path) == 10
+
+
+def test_chunks_over_http_need_a_numeric_offset(tmp_path):
+    user, _ = get_user_model().objects.get_or_create(username='uploader')
+    with override_settings(PSD_UPLOAD_DIR=str(tmp_path)):
+        upload = Upload.start(user.pk, 'http', size=4)
+        request = RequestFactory().post('/upload/{}?offset=x'.format(upload.key), b'data',
+                                        content_type='application/octet-stream')
+        request.user = user
+        response = views.upload_chunk(request, upload.key)
+    assert response.status_code == 400 and json.loads(response.content)['offset'] == 0